@@ -0,0 +1,22 @@
+"""
+Abortable is shared by the minions which may abort the job they serve: the reason is recorded
+on the minion before exiting, for whoever runs the job to report without parsing the log
+"""
+
+import logging
+from typing import Optional
+
+
+class Abortable:
+    abort_reason: Optional[str] = None
+    _logger: logging.Logger
+
+    def _abort(self, reason: str, code: int) -> None:
+        """
+        Recording why the job aborts, logging it and exiting
+        :param reason: why the job aborts
+        :param code: the exit code
+        """
+        self.abort_reason = reason
+        self._logger.error('abort: {}'.format(reason))
+        exit(code)
@@ -1,18 +1,25 @@
 """
 Allocator is responsible of:
-1. concatenating .ts file fragments into one, and
-2. converting .ts file to .mp4
+1. concatenating .ts file fragments into one, with a tool or with the builtin engine,
+which appends the fragments in kernel space (copy_file_range or sendfile) where possible, and
+2. converting .ts file to .mp4, trimmed to a clip if asked, muxing in the alternate audio
+and subtitle renditions downloaded along with it in the same pass
 """
 
 
 import logging
 import os
+import shutil
 import subprocess as sp
 import sys
-from typing import List
+from typing import Any, Dict, List, Optional, Tuple
 
+from .abortable import Abortable
 
-class Allocator:
+
+class Allocator(Abortable):
+    BUILTIN_TOOL = 'builtin'
+    _CHUNK_SIZE = 1024 * 1024
 
     def __init__(self, alc_logger: logging.Logger) -> None:
         """
@@ -22,6 +29,8 @@ class Allocator:
         self._logger = alc_logger
         self.cov_tool = None
         self.cat_tool = None
+        self._trim = ''
+        self._kernel_copies = ['copy_file_range', 'sendfile']
 
     def check_tool(self, conversion_tool: str, concatenation_tool: str) -> None:
         """
@@ -29,40 +38,175 @@ class Allocator:
         :param conversion_tool: the tool assigned for conversion
         :param concatenation_tool: the tool assigned for concatenation
         """
-        if sp.call(['which', conversion_tool], stdout=sp.DEVNULL):
-            self._logger.error(
-                "abort: Cannot access conversion tool {}".format(conversion_tool))
-            exit(2)
+        if not shutil.which(conversion_tool):
+            self._abort(reason="Cannot access conversion tool {}".format(conversion_tool), code=2)
 
-        if sp.call(['which', concatenation_tool], stdout=sp.DEVNULL):
-            self._logger.error(
-                "abort: Cannot access concatenation_tool tool {}".format(concatenation_tool))
-            exit(2)
+        if concatenation_tool != self.BUILTIN_TOOL \
+                and not shutil.which(concatenation_tool):
+            self._abort(reason="Cannot access concatenation_tool tool {}".format(
+                concatenation_tool), code=2)
 
         self.cov_tool = conversion_tool
         self.cat_tool = concatenation_tool
 
-    def concatenate(self, input_files: List[str], concatenated_name: str) -> None:
+    def set_trim(self, start: float = 0.0, duration: float = None) -> None:
+        """
+        Setting the clip the conversion keeps, e.g. once only the fragments covering it are
+        downloaded, the converted file starts and ends exactly where the clip does
+        :param start: the seconds to drop from the start of the .ts file
+        :param duration: the seconds to keep from there, until the end if None
+        """
+        self._trim = '-ss {:.3f}'.format(start) if start else ''
+        if duration is not None:
+            self._trim += ' -t {:.3f}'.format(duration)
+
+    def concatenate(self, input_files: List[str], concatenated_name: str,
+                    remove_inputs: bool = False) -> None:
         """
         Concatenating the input files to one
-        :param input_files: a list of files to concatenate
+        :param input_files: a list of files to concatenate, in order
         :param concatenated_name: the name of the concatenated file
+        :param remove_inputs: whether to remove each input file once it is appended,
+        only honoured by the builtin engine
         """
+        if self.cat_tool == self.BUILTIN_TOOL:
+            self._append_files(input_files=input_files, concatenated_name=concatenated_name,
+                               remove_inputs=remove_inputs)
+            return
         if len(input_files) == 1:
             return
         cat_command = [self.cat_tool] + input_files + ['>', concatenated_name]
         os.system(" ".join(cat_command))
 
-    def convert(self, in_ts: str, out_mp4: str) -> None:
+    def _append_files(self, input_files: List[str], concatenated_name: str,
+                      remove_inputs: bool) -> None:
+        """
+        Appending the input files one by one to the concatenated file
+        :param input_files: a list of files to concatenate, in order
+        :param concatenated_name: the name of the concatenated file
+        :param remove_inputs: whether to remove each input file once it is appended
+        """
+        with open(concatenated_name, 'wb') as out_file:
+            for input_file in input_files:
+                try:
+                    with open(input_file, 'rb') as in_file:
+                        self._copy(in_fd=in_file.fileno(), out_fd=out_file.fileno(),
+                                   size=os.fstat(in_file.fileno()).st_size)
+                except FileNotFoundError:
+                    self._logger.error('Fragment {} is missing from the output'.format(input_file))
+                    continue
+                if remove_inputs:
+                    os.remove(input_file)
+
+    def merge_subtitles(self, input_files: List[str], merged_name: str) -> None:
+        """
+        Merging WebVTT fragments into one file, keeping the header of the first fragment only,
+        as each fragment starts with a header of its own (WEBVTT, X-TIMESTAMP-MAP, ...)
+        :param input_files: a list of WebVTT fragments to merge, in order
+        :param merged_name: the name of the merged file
+        """
+        with open(merged_name, 'wb') as out_file:
+            for position, input_file in enumerate(input_files):
+                try:
+                    with open(input_file, 'rb') as in_file:
+                        content = in_file.read().replace(b'\r\n', b'\n')
+                except FileNotFoundError:
+                    self._logger.error('Fragment {} is missing from the output'.format(input_file))
+                    continue
+                if position:
+                    content = content.partition(b'\n\n')[2]
+                out_file.write(content.strip(b'\n') + b'\n\n')
+
+    def _copy(self, in_fd: int, out_fd: int, size: int) -> None:
+        """
+        Copying the input file to the current position of the output file,
+        in kernel space if possible, otherwise through user space
+        :param in_fd: the file descriptor of the input file
+        :param out_fd: the file descriptor of the output file
+        :param size: the size of the input file
+        """
+        offset = 0
+        while offset < size:
+            copied = self._kernel_copy(in_fd=in_fd, out_fd=out_fd,
+                                       offset=offset, count=size - offset)
+            if copied is None:
+                os.lseek(in_fd, offset, os.SEEK_SET)
+                with open(in_fd, 'rb', closefd=False) as in_file, \
+                        open(out_fd, 'wb', closefd=False) as out_file:
+                    shutil.copyfileobj(in_file, out_file, self._CHUNK_SIZE)
+                return
+            if not copied:
+                return
+            offset += copied
+
+    def _kernel_copy(self, in_fd: int, out_fd: int, offset: int, count: int) -> Optional[int]:
+        """
+        Copying up to count bytes from offset of the input file to the output file in kernel
+        space, dropping the system calls that turn out to be unavailable for good
+        :param in_fd: the file descriptor of the input file
+        :param out_fd: the file descriptor of the output file
+        :param offset: where to start copying in the input file
+        :param count: the max number of bytes to copy
+        :return: the number of bytes copied, None if no system call is available
+        """
+        while self._kernel_copies:
+            try:
+                if self._kernel_copies[0] == 'copy_file_range':
+                    return os.copy_file_range(in_fd, out_fd, count, offset_src=offset)
+                return os.sendfile(out_fd, in_fd, offset, count)
+            except (AttributeError, OSError) as err:
+                self._logger.debug('{} unavailable: {}'.format(self._kernel_copies.pop(0), err))
+        return None
+
+    def convert(self, in_ts: str, out_mp4: str,
+                renditions: List[Dict[str, Any]] = None) -> int:
         """
         Converting .ts file to .mp4
         :param in_ts: the .ts file to convert
         :param out_mp4: the name of the converted file
+        :param renditions: the alternate renditions to mux in, each with the path to its file,
+        its type (AUDIO or SUBTITLES) and the seconds it starts after in_ts
+        :return: the exit code of the conversion tool
+        """
+        inputs, maps = self._mux(renditions=renditions or [])
+        cov_command = '{tool} -i {in_ts} {inputs} -codec {codec} {maps} {trim} {out_mp4} ' \
+            .format(tool=self.cov_tool, in_ts=in_ts, inputs=inputs, codec='copy', maps=maps,
+                    trim=self._trim, out_mp4=out_mp4)
+
+        return sp.call(cov_command.split())
+
+    @staticmethod
+    def _mux(renditions: List[Dict[str, Any]]) -> Tuple[str, str]:
+        """
+        The options muxing the alternate renditions in, along with all the streams of the input
+        :param renditions: the alternate renditions, see convert
+        :return: the input options, e.g. -i audio.ts, and the output options, e.g. -map 0 -map 1:a,
+        the latter following -codec so that they override it
+        """
+        if not renditions:
+            return '', ''
+        inputs = ['{}-i {}'.format('-itsoffset {:.3f} '.format(rendition['offset'])
+                                   if rendition.get('offset') else '', rendition['path'])
+                  for rendition in renditions]
+        maps = ['-map {}:{}'.format(position, 's' if rendition['type'] == 'SUBTITLES' else 'a')
+                for position, rendition in enumerate(renditions, 1)]
+        # MP4 carries subtitles as mov_text only, the rest is copied as it is
+        subtitles = any(rendition['type'] == 'SUBTITLES' for rendition in renditions)
+        return ' '.join(inputs), ' '.join(['-map 0'] + maps +
+                                          (['-c:s mov_text'] if subtitles else []))
+
+    def open_converter(self, out_mp4: str) -> sp.Popen:
+        """
+        Starting the conversion tool on its stdin, so that the .ts stream can be converted
+        while it is still being produced
+        :param out_mp4: the name of the converted file
+        :return: the conversion process, whose stdin takes the .ts stream
         """
-        cov_command = '{tool} -i {in_ts} -codec {codec} {out_mp4} ' \
-            .format(tool=self.cov_tool, in_ts=in_ts, codec='copy', out_mp4=out_mp4)
+        cov_command = '{tool} -i {in_ts} -codec {codec} {trim} {out_mp4} ' \
+            .format(tool=self.cov_tool, in_ts='pipe:0', codec='copy', trim=self._trim,
+                    out_mp4=out_mp4)
 
-        sp.call(cov_command.split())
+        return sp.Popen(cov_command.split(), stdin=sp.PIPE)
 
 
 # Demo
@@ -72,5 +216,6 @@ if __name__ == '__main__':
     logger.addHandler(logging.StreamHandler(sys.stdout))
 
     minion = Allocator(logger)
+    minion.check_tool(conversion_tool='ffmpeg', concatenation_tool=Allocator.BUILTIN_TOOL)
     minion.concatenate(input_files=['01.ts', '02.ts', '03.ts'], concatenated_name="out.ts")
     minion.convert(in_ts="out.ts", out_mp4="out.mp4")
@@ -0,0 +1,99 @@
+"""
+Assembler is responsible of writing the segments, which arrive in any order,
+to a sink (e.g. a file or the stdin of the next stage) in playlist order.
+Segments arriving early wait in a bounded reorder buffer,
+the threads delivering them are held back once the buffer is full.
+Once the sink fails (e.g. the next stage exits and breaks the pipe), the error is kept
+and the segments after it are dropped, so that no thread delivering them gets stuck
+"""
+
+import logging
+import sys
+import threading
+from typing import BinaryIO, Dict, Optional
+
+
+class Assembler:
+
+    def __init__(self, asm_logger: logging.Logger, sink: BinaryIO, window: int = 16) -> None:
+        """
+        Welcoming the logger assigned and prepare the reorder buffer
+        :param asm_logger: the logger assigned
+        :param sink: where the ordered segments are written to
+        :param window: the max number of segments held in the reorder buffer
+        """
+        self._logger = asm_logger
+        self._sink = sink
+        self._window = window
+        self._buffer: Dict[int, Optional[bytes]] = {}
+        self._next = 0
+        self._error: Optional[OSError] = None
+        self._cond = threading.Condition()
+
+    @property
+    def error(self) -> Optional[OSError]:
+        """
+        :return: the error the sink failed with, None if it has not failed
+        """
+        return self._error
+
+    def put(self, index: int, data: Optional[bytes]) -> None:
+        """
+        Handing a segment over to the assembler, blocking while the segment is too far ahead
+        of the next one to write, and writing every segment that is in order since
+        :param index: the position of the segment in the playlist
+        :param data: the content of the segment, None if the segment failed to download
+        """
+        with self._cond:
+            while index >= self._next + self._window:
+                self._cond.wait()
+            self._buffer[index] = data
+            self._drain()
+
+    def _drain(self) -> None:
+        """
+        Writing out the segments that are next in order and waking the threads held back
+        """
+        drained = False
+        while self._next in self._buffer:
+            data = self._buffer.pop(self._next)
+            if data is None:
+                self._logger.error('Segment {} is missing from the output'.format(self._next))
+            elif not self._error:
+                try:
+                    self._sink.write(data)
+                except OSError as err:
+                    self._logger.error('Failed to write segment {}: {}'.format(self._next, err))
+                    self._error = err
+            self._next += 1
+            drained = True
+        if drained:
+            self._cond.notify_all()
+
+    def close(self) -> int:
+        """
+        Closing the sink, nothing can be put afterwards
+        :return: the number of segments written in order
+        """
+        with self._cond:
+            if self._buffer:
+                self._logger.error('Segments {} never got their turn'.format(sorted(self._buffer)))
+            try:
+                self._sink.close()
+            except OSError as err:
+                self._logger.error('Failed to close the output: {}'.format(err))
+                self._error = self._error or err
+            return self._next
+
+
+# Demo
+if __name__ == '__main__':
+    logger = logging.getLogger(__name__)
+    logger.setLevel(logging.DEBUG)
+    logger.addHandler(logging.StreamHandler(sys.stdout))
+
+    with open('out.ts', 'wb') as out_file:
+        minion = Assembler(logger, sink=out_file, window=4)
+        for i in (1, 0, 3, 2):
+            minion.put(index=i, data='{}\n'.format(i).encode())
+        minion.close()
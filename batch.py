@@ -0,0 +1,106 @@
+"""
+Batch is responsible of running many jobs, each turning one M3U8 into one MP4, in one process.
+A few jobs run at a time, and the fragments of all of them are downloaded through one scheduler,
+which caps the connections in total and to each host and lets the jobs take turns.
+The manifest lists one job per line: <m3u_url> <output_name.mp4> [m3u_prefix],
+blank lines and lines starting with '#' are skipped
+"""
+
+import logging
+import shlex
+import sys
+import threadpool
+from typing import Dict, List
+
+from .master_engine import MasterEngine
+from .parser import Parser
+from .scheduler import Scheduler
+
+
+class Batch:
+
+    def __init__(self, bat_logger: logging.Logger, max_conns: int = 32, host_conns: int = 8,
+                 jobs: int = 4) -> None:
+        """
+        Welcoming the logger assigned and prepare the scheduler shared by the jobs
+        :param bat_logger: the logger assigned
+        :param max_conns: the max number of fragments downloaded at a time by all jobs
+        :param host_conns: the max number of fragments downloaded at a time from each host
+        :param jobs: the max number of jobs run at a time
+        """
+        self._logger = bat_logger
+        self._jobs = jobs
+        self._scheduler = Scheduler(sch_logger=bat_logger, max_conns=max_conns,
+                                    host_conns=host_conns)
+
+    def run(self, manifest: str, job_argv: List[str] = None) -> Dict[str, bool]:
+        """
+        Running the jobs listed in the manifest and reporting the aggregate throughput
+        :param manifest: the path to the manifest
+        :param job_argv: the arguments applied to every job, e.g. ['-W', 'builtin']
+        :return: whether each job succeeded, by output name
+        """
+        jobs = self._read_manifest(manifest=manifest)
+        results = {}  # type: Dict[str, bool]
+        engines = {}  # type: Dict[str, MasterEngine]
+
+        def run_job(m3u_url: str, output_name: str, m3u_prefix: str = None) -> None:
+            argv = [m3u_url, '-O', output_name] + (['-P', m3u_prefix] if m3u_prefix else [])
+            engine = engines[output_name] = MasterEngine(scheduler=self._scheduler)
+            try:
+                engine.assist(argv=argv + (job_argv or []))
+            finally:
+                engine.close()
+
+        def on_done(request: threadpool.WorkRequest, _) -> None:
+            results[request.args[1]] = True
+
+        def on_error(request: threadpool.WorkRequest, exc_info: tuple) -> None:
+            results[request.args[1]] = False
+            engine = engines.get(request.args[1])
+            self._logger.error('Job {} failed: {}'.format(
+                request.args[1], engine and engine.abort_reason() or exc_info[1]))
+
+        pool = threadpool.ThreadPool(min(self._jobs, len(jobs)) or 1)
+        [pool.putRequest(req) for req in threadpool.makeRequests(
+            run_job, [(job, None) for job in jobs], callback=on_done, exc_callback=on_error)]
+        pool.wait()
+        pool.dismissWorkers(len(pool.workers))
+
+        self._logger.warning('Jobs succeeded: {}/{}'.format(sum(results.values()), len(jobs)))
+        self._scheduler.report()
+        return results
+
+    def _read_manifest(self, manifest: str) -> List[List[str]]:
+        """
+        Reading the jobs from the manifest
+        :param manifest: the path to the manifest
+        :return: the m3u_url, the output name and optionally the m3u_prefix of each job
+        """
+        try:
+            with open(manifest) as manifest_file:
+                lines = [line.strip() for line in manifest_file]
+        except OSError as err:
+            self._logger.error('abort: Cannot read manifest {}: {}'.format(manifest, err))
+            exit(1)
+
+        jobs = [shlex.split(line) for line in lines if line and not line.startswith('#')]
+        invalid = [job for job in jobs if not 2 <= len(job) <= 3 or not job[1].endswith('.mp4')]
+        if invalid:
+            self._logger.error('abort: Invalid jobs in manifest {}: {}'.format(manifest, invalid))
+            exit(1)
+        self._logger.debug('Jobs listed: {}'.format(len(jobs)))
+        return jobs
+
+
+# Demo
+if __name__ == '__main__':
+    """
+    Check out README.md for demo
+    """
+    logger = logging.getLogger(__name__)
+    logger.addHandler(logging.StreamHandler(sys.stdout))
+
+    args, job_args = Parser(par_logger=logger).parse_batch_args()
+    Batch(logger, max_conns=args.max_conns, host_conns=args.host_conns,
+          jobs=args.jobs).run(manifest=args.manifest[0], job_argv=job_args)
@@ -0,0 +1,629 @@
+"""
+Benchmark is responsible of measuring how fast the minions work on synthetic segments and
+playlists, served by a local HTTP server where needed,
+so that different tools can be compared on the same input.
+The end-to-end suite runs whole jobs against synthetic HLS streams, with encryption,
+key rotation, latency and errors injected as configured, and records the wall time,
+throughput, peak RSS and peak disk usage of each configuration, which can be saved as JSON
+and compared with a baseline saved earlier to spot regressions
+"""
+
+import json
+import logging
+import math
+import os
+import platform
+import random
+import re
+import shutil
+import subprocess as sp
+import sys
+import tempfile
+import threading
+import time
+import tracemalloc
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Any, Dict, List, Optional, Tuple
+
+from cryptography.hazmat.backends import default_backend
+from cryptography.hazmat.primitives import padding
+from cryptography.hazmat.primitives.ciphers import Cipher, algorithms, modes
+
+from .decrypter import Decrypter
+from .downloader import Downloader
+from .parser import Parser
+
+E2E_CONFIGS = {
+    'plain': dict(seg_num=200, seg_size=256 * 1024),
+    'encrypted': dict(seg_num=200, seg_size=256 * 1024, encrypted=True),
+    'rotating': dict(seg_num=200, seg_size=256 * 1024, encrypted=True, rotation=10),
+    'latency': dict(seg_num=200, seg_size=256 * 1024, latency=0.05),
+    'flaky': dict(seg_num=200, seg_size=256 * 1024, error_rate=0.05),
+    'pipeline': dict(seg_num=200, seg_size=256 * 1024, encrypted=True, args=['--pipeline']),
+}
+
+
+class _SegmentHandler(BaseHTTPRequestHandler):
+    """
+    Serving the payloads of the server from memory, keeping connections alive,
+    a single byte range is served if requested.
+    The segments (.ts) are delayed and fail with 503 as the server is told to,
+    the playlists and keys are always served at once
+    """
+    protocol_version = 'HTTP/1.1'
+    _RANGE_PATTERN = re.compile(r'bytes=(\d+)-(\d*)$')
+
+    def do_GET(self) -> None:
+        path = self.path.split('?')[0]
+        payload = self.server.payloads.get(path)
+        if payload is None:
+            self.send_error(404)
+            return
+        if path.endswith('.ts'):
+            time.sleep(self.server.latency)
+            if self.server.random.random() < self.server.error_rate:
+                self.send_error(503)
+                return
+        matched = self._RANGE_PATTERN.match(self.headers.get('Range') or '')
+        if matched:
+            first = int(matched.group(1))
+            last = min(int(matched.group(2) or len(payload) - 1), len(payload) - 1)
+            self.send_response(206)
+            self.send_header('Content-Range', 'bytes {}-{}/{}'.format(first, last, len(payload)))
+            payload = payload[first:last + 1]
+        else:
+            self.send_response(200)
+        self.send_header('Content-Length', str(len(payload)))
+        self.end_headers()
+        self.wfile.write(payload)
+
+    def log_message(self, *args) -> None:
+        pass
+
+
+class SegmentServer:
+
+    def __init__(self, payloads: Dict[str, bytes], latency: float = 0,
+                 error_rate: float = 0, seed: int = 0) -> None:
+        """
+        Prepare a server on a free local port serving the payloads given
+        :param payloads: the content to serve, keyed by path, e.g. '/0.ts'
+        :param latency: the seconds each segment is delayed
+        :param error_rate: the share of segment requests failing with 503
+        :param seed: the seed of the errors injected, so that runs see the same sequence
+        """
+        self._httpd = ThreadingHTTPServer(('127.0.0.1', 0), _SegmentHandler)
+        self._httpd.daemon_threads = True
+        self._httpd.payloads = payloads
+        self._httpd.latency, self._httpd.error_rate = latency, error_rate
+        self._httpd.random = random.Random(seed)
+        self._thread = threading.Thread(target=self._httpd.serve_forever, daemon=True)
+
+    @property
+    def url(self) -> str:
+        """
+        :return: the URL prefix of the server, e.g. http://127.0.0.1:8000/
+        """
+        return 'http://{}:{}/'.format(*self._httpd.server_address)
+
+    def __enter__(self) -> 'SegmentServer':
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        self._httpd.shutdown()
+        self._httpd.server_close()
+
+
+class Benchmark:
+    _TS_PACKET = 188
+    _PMT_PID, _AUDIO_PID, _NULL_PID = 0x1000, 0x100, 0x1FFF
+    # a silent MPEG-1 Layer II frame, mono at 48 kHz and 128 kbps: 1152 samples, i.e. 2160 ticks
+    # of the 90 kHz clock, with no bits allocated to any subband
+    _AUDIO_FRAME = b'\xff\xfd\x84\xc0' + bytes(380)
+    _FRAME_TICKS = 2160
+
+    def __init__(self, ben_logger: logging.Logger) -> None:
+        """
+        Welcoming the logger assigned
+        :param ben_logger: the logger assigned
+        """
+        self._logger = ben_logger
+
+    def bench_download(self, tools: List[str], seg_num: int = 500, seg_size: int = 64 * 1024,
+                       repeat: int = 3) -> Dict[str, float]:
+        """
+        Timing the download of synthetic segments with each tool, tools unavailable are skipped
+        :param tools: the download tools to compare, e.g. aria2c and builtin
+        :param seg_num: the number of segments to download
+        :param seg_size: the size of each segment in bytes
+        :param repeat: the number of runs per tool, the best one is reported
+        :return: the best wall time in seconds of each tool
+        """
+        payloads = {'/{}.ts'.format(index): segment for index, segment
+                    in enumerate(self._synthesize_segments(seg_num=seg_num, seg_size=seg_size))}
+        results = {}
+
+        with SegmentServer(payloads=payloads) as server:
+            links = [server.url + path[1:] for path in payloads]
+            for tool in tools:
+                if tool != Downloader.BUILTIN_TOOL and not shutil.which(tool):
+                    self._logger.warning('Skipping unavailable download tool {}'.format(tool))
+                    continue
+                results[tool] = min(self._time_download(tool=tool, links=links)
+                                    for _ in range(repeat))
+                self._logger.warning('{}: {} x {} bytes in {:.3f}s ({:.1f} MB/s)'.format(
+                    tool, seg_num, seg_size, results[tool],
+                    seg_num * seg_size / results[tool] / 1e6))
+
+        return results
+
+    def _time_download(self, tool: str, links: List[str]) -> float:
+        """
+        Timing one download of all links with a fresh downloader
+        :param tool: the download tool to use
+        :param links: the links to download
+        :return: the wall time in seconds
+        """
+        minion = Downloader(dow_logger=self._logger)
+        minion.check_tool(tool=tool)
+        with tempfile.TemporaryDirectory() as out_dir:
+            start = time.perf_counter()
+            minion.download(links=links, out_dir=out_dir)
+            return time.perf_counter() - start
+
+    def bench_decrypt(self, seg_num: int = 200, seg_size: int = 1024 * 1024,
+                      repeat: int = 3) -> Dict[str, float]:
+        """
+        Timing the decryption of synthetic AES-128 segments with openssl over the
+        concatenated file and with the builtin engine over each segment in place
+        :param seg_num: the number of segments to decrypt
+        :param seg_size: the size of each segment in bytes
+        :param repeat: the number of runs per tool, the best one is reported
+        :return: the best wall time in seconds of each tool
+        """
+        key_bytes = os.urandom(16)
+        segments = [self._encrypt(data=segment, key_bytes=key_bytes,
+                                  iv=index.to_bytes(16, 'big'))
+                    for index, segment in enumerate(
+                        self._synthesize_segments(seg_num=seg_num, seg_size=seg_size))]
+        results = {}
+
+        for tool in ['openssl', Decrypter.BUILTIN_TOOL]:
+            if tool != Decrypter.BUILTIN_TOOL and not shutil.which(tool):
+                self._logger.warning('Skipping unavailable decryption tool {}'.format(tool))
+                continue
+            results[tool] = min(self._time_decrypt(tool=tool, key_bytes=key_bytes,
+                                                   segments=segments)
+                                for _ in range(repeat))
+            self._logger.warning('{}: {} x {} bytes in {:.3f}s ({:.1f} MB/s)'.format(
+                tool, seg_num, seg_size, results[tool],
+                seg_num * seg_size / results[tool] / 1e6))
+
+        return results
+
+    def _time_decrypt(self, tool: str, key_bytes: bytes, segments: List[bytes]) -> float:
+        """
+        Timing one decryption of all segments with a fresh decrypter,
+        writing the segments to disk is not timed
+        :param tool: the decryption tool to use
+        :param key_bytes: decryption key
+        :param segments: the encrypted segments, whose IV is their index
+        :return: the wall time in seconds
+        """
+        minion = Decrypter(dec_logger=self._logger)
+        minion.check_tool(tool=tool)
+        with tempfile.TemporaryDirectory() as out_dir:
+            paths = [os.path.join(out_dir, '{}.ts'.format(index))
+                     for index in range(len(segments))]
+            if tool == Decrypter.BUILTIN_TOOL:
+                for path, segment in zip(paths, segments):
+                    with open(path, 'wb') as out_file:
+                        out_file.write(segment)
+                start = time.perf_counter()
+                minion.decrypt_segments(key_of=lambda key_uri: key_bytes, segments=[
+                    (path, 'key', index.to_bytes(16, 'big')) for index, path in enumerate(paths)])
+                return time.perf_counter() - start
+
+            encrypted_file = os.path.join(out_dir, 'en.ts')
+            with open(encrypted_file, 'wb') as out_file:
+                [out_file.write(segment) for segment in segments]
+            start = time.perf_counter()
+            minion.decrypt(iv=(0).to_bytes(16, 'big').hex(), key_bytes=key_bytes,
+                           encrypted_file=encrypted_file, encryption_method='aes-128-cbc',
+                           out_name=os.path.join(out_dir, 'de.ts'))
+            return time.perf_counter() - start
+
+    def bench_e2e(self, configs: Dict[str, Dict[str, Any]] = None,
+                  repeat: int = 3) -> Dict[str, Dict[str, Any]]:
+        """
+        Running whole jobs against synthetic HLS streams, each in a process of its own
+        so that its peak RSS is its own, the run with the best wall time is reported
+        :param configs: the configurations to run by name, see E2E_CONFIGS for the keys,
+        E2E_CONFIGS if None
+        :param repeat: the number of runs per configuration
+        :return: the wall time, throughput, peak RSS, peak disk usage and the time of each
+        stage of each configuration, empty if the conversion tool is unavailable
+        """
+        if not shutil.which('ffmpeg'):
+            self._logger.warning('Skipping end-to-end suite without conversion tool ffmpeg')
+            return {}
+        results = {}
+
+        for name, config in (configs or E2E_CONFIGS).items():
+            payloads = self._synthesize_stream(
+                seg_num=config.get('seg_num', 200), seg_size=config.get('seg_size', 256 * 1024),
+                encrypted=config.get('encrypted', False), rotation=config.get('rotation', 0))
+            size = sum(len(payload) for path, payload in payloads.items()
+                       if path.endswith('.ts'))
+            with SegmentServer(payloads=payloads, latency=config.get('latency', 0),
+                               error_rate=config.get('error_rate', 0)) as server:
+                runs = [self._run_job(m3u_url=server.url + 'index.m3u8',
+                                      args=config.get('args', []))
+                        for _ in range(repeat)]
+            result = min(runs, key=lambda run: run.get('wall_seconds'))
+            result.update(ok=all(run.get('ok') for run in runs),
+                          throughput=size / result.get('wall_seconds'))
+            results[name] = result
+            self._logger.warning('{}: {:.3f}s ({:.1f} MB/s), peak RSS {:.1f} MB, '
+                                 'peak disk {:.1f} MB{}'.format(
+                                     name, result.get('wall_seconds'),
+                                     result.get('throughput') / 1e6,
+                                     result.get('peak_rss') / 1e6,
+                                     result.get('peak_disk') / 1e6,
+                                     '' if result.get('ok') else ', FAILED'))
+
+        return results
+
+    def _run_job(self, m3u_url: str, args: List[str]) -> Dict[str, Any]:
+        """
+        Running one job in a child process with the builtin tools, sampling its peak RSS and
+        the disk usage of its output directory until it exits
+        :param m3u_url: the url to the playlist
+        :param args: the extra arguments of the job, e.g. ['--pipeline']
+        :return: whether it succeeded, its wall time, peak RSS, peak disk usage and the
+        time of each stage
+        """
+        with tempfile.TemporaryDirectory() as out_dir:
+            metrics_path = os.path.join(out_dir, 'metrics.json')
+            command = [sys.executable, '-m', '{}.master_engine'.format(__package__), m3u_url,
+                       '-O', os.path.join(out_dir, 'out', 'out.mp4'), '-W', 'builtin',
+                       '-D', 'builtin', '--metrics', metrics_path] + args
+            start, peak_rss, peak_disk = time.perf_counter(), 0, 0
+            process = sp.Popen(command, stdout=sp.DEVNULL)
+            while True:
+                pid, status, usage = os.wait4(process.pid, os.WNOHANG)
+                if pid:
+                    break
+                peak_rss = self._peak_rss(pid=process.pid) or peak_rss
+                peak_disk = max(peak_disk, self._disk_usage(path=out_dir))
+                time.sleep(0.05)
+            seconds = time.perf_counter() - start
+            process.returncode = os.WEXITSTATUS(status) if os.WIFEXITED(status) else -1
+            try:
+                with open(metrics_path) as metrics_file:
+                    stages = json.load(metrics_file).get('stages')
+            except (OSError, ValueError):
+                stages = {}
+
+        if not peak_rss:
+            # ru_maxrss is in KB on Linux and in bytes on macOS
+            peak_rss = usage.ru_maxrss * (1 if sys.platform == 'darwin' else 1024)
+        return {'ok': process.returncode == 0, 'wall_seconds': seconds, 'peak_rss': peak_rss,
+                'peak_disk': peak_disk, 'stages': stages}
+
+    @staticmethod
+    def _peak_rss(pid: int) -> Optional[int]:
+        """
+        Reading the peak RSS of a running process from /proc, which unlike its rusage
+        does not count the memory of the parent it was forked from
+        :param pid: the id of the process
+        :return: the peak RSS in bytes, None if unknown, e.g. not on Linux
+        """
+        try:
+            with open('/proc/{}/status'.format(pid)) as status_file:
+                for line in status_file:
+                    if line.startswith('VmHWM:'):
+                        return int(line.split()[1]) * 1024
+        except (OSError, ValueError):
+            return None
+        return None
+
+    @staticmethod
+    def _disk_usage(path: str) -> int:
+        """
+        :param path: the directory to measure
+        :return: the number of bytes of the files under it, those vanishing meanwhile skipped
+        """
+        size = 0
+        for root, _, files in os.walk(path):
+            for file_name in files:
+                try:
+                    size += os.path.getsize(os.path.join(root, file_name))
+                except OSError:
+                    pass
+        return size
+
+    def save(self, results: Dict[str, Dict[str, Any]], path: str) -> None:
+        """
+        Saving the results of the end-to-end suite along with the environment they come from
+        :param results: the results of each configuration
+        :param path: the path to the JSON file
+        """
+        with open(path, 'w') as out_file:
+            json.dump({'python': platform.python_version(), 'platform': platform.platform(),
+                       'results': results}, out_file, indent=2)
+        self._logger.warning('Results saved: {}'.format(path))
+
+    def compare(self, results: Dict[str, Dict[str, Any]], baseline: str,
+                tolerance: float = 0.1) -> List[str]:
+        """
+        Comparing the results of the end-to-end suite with those saved earlier
+        :param results: the results of each configuration
+        :param baseline: the path to the JSON file saved earlier
+        :param tolerance: the share by which a measure may get worse before it is reported
+        :return: the regressions found, e.g. 'plain: wall_seconds 1.200 -> 1.500 (+25%)'
+        """
+        try:
+            with open(baseline) as in_file:
+                previous = json.load(in_file).get('results')
+        except (OSError, ValueError) as err:
+            self._logger.error('abort: Cannot read baseline {}: {}'.format(baseline, err))
+            exit(1)
+
+        regressions = []
+        for name, result in results.items():
+            if name not in previous:
+                continue
+            for measure, sign in [('wall_seconds', 1), ('throughput', -1), ('peak_rss', 1),
+                                  ('peak_disk', 1)]:
+                before, after = previous[name].get(measure), result.get(measure)
+                if not before:
+                    continue
+                change = (after - before) / before
+                if change * sign > tolerance:
+                    regressions.append('{}: {} {:.3f} -> {:.3f} ({:+.0%})'.format(
+                        name, measure, before, after, change))
+            if previous[name].get('ok') and not result.get('ok'):
+                regressions.append('{}: failed'.format(name))
+
+        for regression in regressions:
+            self._logger.warning('Regression {}'.format(regression))
+        return regressions
+
+    @staticmethod
+    def _synthesize_stream(seg_num: int, seg_size: int, encrypted: bool = False,
+                           rotation: int = 0) -> Dict[str, bytes]:
+        """
+        Synthesizing a VOD stream: the playlist, the segments and the keys, the same ones
+        on every run, each segment encrypted with the IV given by its media sequence number.
+        The segments are MPEG-TS a converter takes, see _synthesize_segments
+        :param seg_num: the number of segments
+        :param seg_size: the size of each segment in bytes, before encryption
+        :param encrypted: whether the segments are encrypted with AES-128
+        :param rotation: the number of segments sharing a key, one key for all if 0
+        :return: the payloads keyed by path, the playlist at '/index.m3u8'
+        """
+        seeded = random.Random(seg_num)
+        payloads = {}
+        seconds = Benchmark._frames_per_segment(seg_size=seg_size) * Benchmark._FRAME_TICKS / 90000
+        lines = ['#EXTM3U', '#EXT-X-VERSION:3',
+                 '#EXT-X-TARGETDURATION:{}'.format(math.ceil(seconds)), '#EXT-X-MEDIA-SEQUENCE:0']
+        key_bytes = None
+        segments = Benchmark._synthesize_segments(seg_num=seg_num, seg_size=seg_size)
+        for index, data in enumerate(segments):
+            if encrypted and (not index or rotation and not index % rotation):
+                key_path = '/keys/{}.key'.format(index // rotation if rotation else 0)
+                key_bytes = payloads[key_path] = seeded.getrandbits(128).to_bytes(16, 'big')
+                lines.append('#EXT-X-KEY:METHOD=AES-128,URI="{}"'.format(key_path[1:]))
+            payloads['/{}.ts'.format(index)] = Benchmark._encrypt(
+                data=data, key_bytes=key_bytes, iv=index.to_bytes(16, 'big')) \
+                if encrypted else data
+            lines += ['#EXTINF:{:.3f},'.format(seconds), '{}.ts'.format(index)]
+        lines.append('#EXT-X-ENDLIST')
+        payloads['/index.m3u8'] = '\n'.join(lines).encode()
+        return payloads
+
+    @staticmethod
+    def _synthesize_segments(seg_num: int, seg_size: int) -> List[bytes]:
+        """
+        Synthesizing the MPEG-TS segments of a silent audio stream, the same ones on every run:
+        each segment starts with the PAT and the PMT, then carries as many audio frames in PES
+        packets as fit, their PTS and PCR running on across segments, and is padded with null
+        packets, so that the segments play one after the other as a converter expects
+        :param seg_num: the number of segments
+        :param seg_size: the size of each segment in bytes, rounded down to whole TS packets
+        :return: the content of each segment
+        """
+        frames = Benchmark._frames_per_segment(seg_size=seg_size)
+        counters = {}  # type: Dict[int, int]
+        frame = 0
+        pat = Benchmark._psi_section(table_id=0x00, table_id_ext=1, body=b'\x00\x01' + (
+            0xE000 | Benchmark._PMT_PID).to_bytes(2, 'big'))
+        pmt = Benchmark._psi_section(table_id=0x02, table_id_ext=1, body=(
+            0xE000 | Benchmark._AUDIO_PID).to_bytes(2, 'big') + b'\xf0\x00'
+            + b'\x03' + (0xE000 | Benchmark._AUDIO_PID).to_bytes(2, 'big') + b'\xf0\x00')
+        segments = []
+        for _ in range(seg_num):
+            packets = [Benchmark._ts_packet(pid=0, payload=b'\x00' + pat, counters=counters,
+                                            start=True),
+                       Benchmark._ts_packet(pid=Benchmark._PMT_PID, payload=b'\x00' + pmt,
+                                            counters=counters, start=True)]
+            for _ in range(frames):
+                ticks = frame * Benchmark._FRAME_TICKS
+                pes = b'\x00\x00\x01\xc0' + (len(Benchmark._AUDIO_FRAME) + 8).to_bytes(2, 'big') \
+                    + b'\x80\x80\x05' + Benchmark._pts(ticks=ticks) + Benchmark._AUDIO_FRAME
+                first = True
+                while pes:
+                    # the first TS packet of the PES packet carries the PCR in 8 bytes
+                    room = 184 - 8 if first else 184
+                    packets.append(Benchmark._ts_packet(
+                        pid=Benchmark._AUDIO_PID, payload=pes[:room], counters=counters,
+                        start=first, pcr=ticks if first else None))
+                    pes, first = pes[room:], False
+                frame += 1
+            packets += [Benchmark._ts_packet(pid=Benchmark._NULL_PID, payload=b'\xff' * 184,
+                                             counters=counters)] \
+                * (max(seg_size // Benchmark._TS_PACKET, 5) - len(packets))
+            segments.append(b''.join(packets))
+        return segments
+
+    @staticmethod
+    def _frames_per_segment(seg_size: int) -> int:
+        """
+        :param seg_size: the size of each segment in bytes
+        :return: the number of audio frames a synthetic segment carries: a PES packet of one
+        frame spans 3 TS packets, after the PAT and the PMT
+        """
+        return (max(seg_size // Benchmark._TS_PACKET, 5) - 2) // 3
+
+    @staticmethod
+    def _ts_packet(pid: int, payload: bytes, counters: Dict[int, int], start: bool = False,
+                   pcr: int = None) -> bytes:
+        """
+        Building a TS packet, with an adaptation field for the PCR or the stuffing needed
+        :param pid: the PID of the packet
+        :param payload: the payload, at most 184 bytes, 176 along with a PCR
+        :param counters: the continuity counter of each PID, advanced
+        :param start: whether the payload starts a PES packet or a section
+        :param pcr: the PCR in ticks of the 90 kHz clock, None if none
+        :return: the 188 bytes of the packet
+        """
+        counter = counters.get(pid, 0)
+        counters[pid] = (counter + 1) % 16
+        room = 184 - len(payload)
+        adaptation = b''
+        if room == 1 and pcr is None:
+            adaptation = b'\x00'
+        elif room:
+            # the length of the adaptation field, its flags and the PCR if any, then stuffing
+            fields = b'\x10' + (pcr << 15 | 0x7E00).to_bytes(6, 'big') if pcr is not None \
+                else b'\x00'
+            adaptation = bytes([room - 1]) + fields + b'\xff' * (room - 1 - len(fields))
+        header = bytes([0x47, (0x40 if start else 0) | pid >> 8, pid & 0xFF,
+                        (0x30 if adaptation else 0x10) | counter])
+        return header + adaptation + payload
+
+    @staticmethod
+    def _psi_section(table_id: int, table_id_ext: int, body: bytes) -> bytes:
+        """
+        Building a PSI section, e.g. the PAT or the PMT, padded to fill its TS packet
+        :param table_id: the table ID, 0 for the PAT, 2 for the PMT
+        :param table_id_ext: the transport stream ID of the PAT, the program number of the PMT
+        :param body: the content of the section after its header
+        :return: the section, with its CRC
+        """
+        section = bytes([table_id]) + (0xB000 | len(body) + 9).to_bytes(2, 'big') \
+            + table_id_ext.to_bytes(2, 'big') + b'\xc1\x00\x00' + body
+        crc = 0xFFFFFFFF
+        for byte in section:
+            crc ^= byte << 24
+            for _ in range(8):
+                crc = (crc << 1 ^ 0x104C11DB7) if crc & 0x80000000 else crc << 1
+        section += crc.to_bytes(4, 'big')
+        return section + b'\xff' * (183 - len(section))
+
+    @staticmethod
+    def _pts(ticks: int) -> bytes:
+        """
+        :param ticks: the presentation time in ticks of the 90 kHz clock
+        :return: the 5 bytes of the PTS field of a PES header
+        """
+        return bytes([0x21 | (ticks >> 29 & 0x0E), ticks >> 22 & 0xFF, (ticks >> 14 & 0xFE) | 1,
+                      ticks >> 7 & 0xFF, (ticks << 1 & 0xFE) | 1])
+
+    @staticmethod
+    def _encrypt(data: bytes, key_bytes: bytes, iv: bytes) -> bytes:
+        """
+        Encrypting a segment as HLS does, with AES-128-CBC and PKCS7 padding
+        :param data: the content of the segment
+        :param key_bytes: encryption key
+        :param iv: the initial vector of the segment
+        :return: the encrypted segment
+        """
+        padder = padding.PKCS7(algorithms.AES.block_size).padder()
+        encryptor = Cipher(algorithms.AES(key_bytes), modes.CBC(iv),
+                           backend=default_backend()).encryptor()
+        return encryptor.update(padder.update(data) + padder.finalize()) + encryptor.finalize()
+
+    def bench_parse(self, sizes: Tuple[int, ...] = (1000, 10000, 100000),
+                    rotation: int = 100, repeat: int = 3) -> Dict[int, Tuple[float, int]]:
+        """
+        Timing the parsing of synthetic playlists of increasing size and measuring its peak
+        memory, the playlists rotate keys and use byte ranges so every tag is exercised
+        :param sizes: the numbers of segments of the playlists
+        :param rotation: the number of segments sharing a key
+        :param repeat: the number of runs per size, the best one is reported
+        :return: the best wall time in seconds and the peak memory in bytes of each size
+        """
+        minion = Parser(par_logger=self._logger)
+        results = {}
+
+        for size in sizes:
+            playlist = self._synthesize_playlist(seg_num=size, rotation=rotation)
+            seconds = min(self._time_parse(minion=minion, playlist=playlist)
+                          for _ in range(repeat))
+            tracemalloc.start()
+            minion.parse_m3u(contents_bytes=playlist, m3u_url='http://127.0.0.1/index.m3u8')
+            peak = tracemalloc.get_traced_memory()[1]
+            tracemalloc.stop()
+
+            results[size] = (seconds, peak)
+            self._logger.warning('parse: {} segments ({} bytes) in {:.3f}s, {:.0f} bytes/segment '
+                                 'at peak'.format(size, len(playlist), seconds, peak / size))
+
+        return results
+
+    @staticmethod
+    def _time_parse(minion: Parser, playlist: bytes) -> float:
+        """
+        Timing one parsing of the playlist
+        :param minion: the parser
+        :param playlist: the content of the playlist
+        :return: the wall time in seconds
+        """
+        start = time.perf_counter()
+        minion.parse_m3u(contents_bytes=playlist, m3u_url='http://127.0.0.1/index.m3u8')
+        return time.perf_counter() - start
+
+    @staticmethod
+    def _synthesize_playlist(seg_num: int, rotation: int) -> bytes:
+        """
+        Synthesizing a VOD playlist
+        :param seg_num: the number of segments
+        :param rotation: the number of segments sharing a key
+        :return: the content of the playlist
+        """
+        lines = ['#EXTM3U', '#EXT-X-VERSION:4', '#EXT-X-TARGETDURATION:6',
+                 '#EXT-X-MEDIA-SEQUENCE:0']
+        for index in range(seg_num):
+            if not index % rotation:
+                lines.append('#EXT-X-KEY:METHOD=AES-128,URI="keys/{}.key"'
+                             .format(index // rotation))
+            lines += ['#EXTINF:6.006,', '#EXT-X-BYTERANGE:188000@{}'.format(index * 188000),
+                      'media/video_{}.ts'.format(index // 1000)]
+        lines.append('#EXT-X-ENDLIST')
+        return '\n'.join(lines).encode()
+
+
+# Demo
+if __name__ == '__main__':
+    logger = logging.getLogger(__name__)
+    logger.setLevel(logging.WARNING)
+    logger.addHandler(logging.StreamHandler(sys.stdout))
+
+    args = Parser(par_logger=logger).parse_benchmark_args()
+    minion = Benchmark(logger)
+    if args.suite in ['tools', 'all']:
+        minion.bench_download(tools=['aria2c', Downloader.BUILTIN_TOOL], repeat=args.repeat)
+        minion.bench_decrypt(repeat=args.repeat)
+        minion.bench_parse(repeat=args.repeat)
+    if args.suite in ['e2e', 'all']:
+        e2e_results = minion.bench_e2e(
+            configs={name: E2E_CONFIGS[name] for name in args.configs or E2E_CONFIGS},
+            repeat=args.repeat)
+        if args.out:
+            minion.save(results=e2e_results, path=args.out)
+        if args.baseline and minion.compare(results=e2e_results, baseline=args.baseline,
+                                            tolerance=args.tolerance):
+            exit(1)
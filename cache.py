@@ -0,0 +1,273 @@
+"""
+SegmentCache is responsible of keeping the segments downloaded on disk, so that reruns,
+overlapping clips and several outputs from one source download each segment only once.
+A segment is found by its normalized URL and byte range, and brought into a job directory
+by a reflink (copy-on-write) where the file system supports it, or a hard link otherwise,
+so it is never copied. Since a hard link shares the file with the cache, the minions replace
+a segment file instead of writing over it.
+The least recently used segments are evicted once the cache grows beyond its capacity;
+the recency is the mtime of each file, so it carries over from one job to the next.
+The jobs of one process (e.g. a batch or a daemon) share one cache per directory,
+so its capacity holds however many of them run at a time
+"""
+
+import fcntl
+import hashlib
+import logging
+import os
+import shutil
+import sys
+import threading
+from collections import OrderedDict
+from typing import Dict, Optional, Tuple
+from urllib.parse import urlsplit, urlunsplit
+
+
+class SegmentCache:
+    _DEFAULT_PORTS = {'http': 80, 'https': 443}
+    _FICLONE = 0x40049409
+    _shared: Dict[str, 'SegmentCache'] = {}
+    _shared_lock = threading.Lock()
+
+    def __init__(self, cac_logger: logging.Logger, cache_dir: str,
+                 capacity: int = 2 * 1024 * 1024 * 1024) -> None:
+        """
+        Welcoming the logger assigned and index the segments already in the cache
+        :param cac_logger: the logger assigned
+        :param cache_dir: the directory of the cache, shared by the jobs using it
+        :param capacity: the max number of bytes kept in the cache
+        """
+        self._logger = cac_logger
+        self._cache_dir = cache_dir
+        self._capacity = capacity
+        self._entries: OrderedDict[str, int] = OrderedDict()
+        self._size = self._hits = self._misses = 0
+        self._lock = threading.Lock()
+        os.makedirs(cache_dir, exist_ok=True)
+        self._index()
+
+    @classmethod
+    def shared(cls, cac_logger: logging.Logger, cache_dir: str,
+               capacity: int = 2 * 1024 * 1024 * 1024) -> 'SegmentCache':
+        """
+        The cache of a directory shared by the jobs of the process, indexed by the first one;
+        the smallest capacity any of them asks for applies
+        :param cac_logger: the logger assigned
+        :param cache_dir: the directory of the cache
+        :param capacity: the max number of bytes kept in the cache
+        :return: the cache of the directory
+        """
+        cache_dir = os.path.realpath(cache_dir)
+        with cls._shared_lock:
+            cache = cls._shared.get(cache_dir)
+            if cache is None:
+                cache = cls._shared[cache_dir] = cls(cac_logger=cac_logger, cache_dir=cache_dir,
+                                                     capacity=capacity)
+        if capacity < cache._capacity:
+            with cache._lock:
+                cache._capacity = min(cache._capacity, capacity)
+                cache._evict()
+        return cache
+
+    def _index(self) -> None:
+        """
+        Indexing the segments in the cache from the least to the most recently used
+        """
+        entries = []
+        for root, _, files in os.walk(self._cache_dir):
+            for file_name in files:
+                if file_name.endswith('.tmp'):
+                    continue
+                stat = os.stat(os.path.join(root, file_name))
+                entries.append((stat.st_mtime, file_name, stat.st_size))
+        for _, key, size in sorted(entries):
+            self._entries[key] = size
+            self._size += size
+        self._logger.debug('Segments cached: {} ({} bytes)'.format(len(entries), self._size))
+
+    @classmethod
+    def key(cls, link: str, byterange: Tuple[int, int] = None) -> str:
+        """
+        The key of a segment: the digest of its URL, normalized so that the same resource is
+        found however it is spelled (case of scheme and host, default port, fragment),
+        and of its byte range
+        :param link: the link to the segment
+        :param byterange: the (length, offset) of the segment in the resource, None if all of it
+        :return: the key of the segment
+        """
+        parts = urlsplit(link)
+        scheme, host = parts.scheme.lower(), (parts.hostname or '').lower()
+        netloc = host if parts.port in (None, cls._DEFAULT_PORTS.get(scheme)) \
+            else '{}:{}'.format(host, parts.port)
+        normalized = urlunsplit((scheme, netloc, parts.path or '/', parts.query, ''))
+        if byterange:
+            normalized += '#{}-{}'.format(byterange[1], sum(byterange) - 1)
+        return hashlib.sha256(normalized.encode()).hexdigest()
+
+    def _path(self, key: str) -> str:
+        """
+        :param key: the key of a segment
+        :return: the path to the segment in the cache
+        """
+        return os.path.join(self._cache_dir, key[:2], key)
+
+    def contains(self, key: str) -> bool:
+        """
+        :param key: the key of a segment
+        :return: whether the segment is in the cache
+        """
+        with self._lock:
+            return key in self._entries
+
+    def restore(self, key: str, target: str) -> Optional[int]:
+        """
+        Bringing a segment from the cache into a job directory
+        :param key: the key of the segment
+        :param target: the path to bring the segment to
+        :return: the number of bytes of the segment, None if it is not in the cache
+        """
+        if not self._touch(key=key):
+            return None
+        tmp_path = '{}.{}.tmp'.format(target, threading.get_ident())
+        try:
+            self._clone(src=self._path(key=key), dst=tmp_path)
+            os.replace(tmp_path, target)
+            return os.path.getsize(target)
+        except OSError as err:
+            self._logger.debug('Failed to restore {} from cache: {}'.format(target, err))
+            self._forget(key=key)
+            return None
+
+    def read(self, key: str) -> Optional[bytes]:
+        """
+        Reading a segment from the cache
+        :param key: the key of the segment
+        :return: the content of the segment, None if it is not in the cache
+        """
+        if not self._touch(key=key):
+            return None
+        try:
+            with open(self._path(key=key), 'rb') as in_file:
+                return in_file.read()
+        except OSError as err:
+            self._logger.debug('Failed to read segment from cache: {}'.format(err))
+            self._forget(key=key)
+            return None
+
+    def store(self, key: str, path: str = None, data: bytes = None) -> None:
+        """
+        Keeping a segment downloaded in the cache, evicting the least recently used ones
+        if the cache grows beyond its capacity
+        :param key: the key of the segment
+        :param path: the file downloaded, linked into the cache
+        :param data: the content downloaded, written into the cache if no file is given
+        """
+        size = os.path.getsize(path) if path else len(data)
+        if size > self._capacity:
+            return
+        cache_path = self._path(key=key)
+        tmp_path = '{}.{}.tmp'.format(cache_path, threading.get_ident())
+        try:
+            os.makedirs(os.path.dirname(cache_path), exist_ok=True)
+            if path:
+                self._clone(src=path, dst=tmp_path)
+            else:
+                with open(tmp_path, 'wb') as out_file:
+                    out_file.write(data)
+            os.replace(tmp_path, cache_path)
+        except OSError as err:
+            self._logger.warning('Failed to cache segment: {}'.format(err))
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            return
+
+        with self._lock:
+            self._size += size - self._entries.pop(key, 0)
+            self._entries[key] = size
+            self._evict()
+
+    def _evict(self) -> None:
+        """
+        Evicting the least recently used segments until the cache fits its capacity,
+        to be called holding the lock
+        """
+        while self._size > self._capacity:
+            evicted, evicted_size = self._entries.popitem(last=False)
+            self._size -= evicted_size
+            try:
+                os.remove(self._path(key=evicted))
+            except OSError:
+                pass
+
+    def _touch(self, key: str) -> bool:
+        """
+        Counting a lookup and marking the segment as the most recently used if found
+        :param key: the key of the segment
+        :return: whether the segment is in the cache
+        """
+        with self._lock:
+            found = key in self._entries
+            if found:
+                self._entries.move_to_end(key)
+                self._hits += 1
+            else:
+                self._misses += 1
+        if found:
+            try:
+                os.utime(self._path(key=key))
+            except OSError:
+                pass
+        return found
+
+    def _forget(self, key: str) -> None:
+        """
+        Dropping a segment from the index, e.g. once another job evicted it,
+        its lookup counts as a miss
+        :param key: the key of the segment
+        """
+        with self._lock:
+            self._size -= self._entries.pop(key, 0)
+            self._hits, self._misses = self._hits - 1, self._misses + 1
+
+    def _clone(self, src: str, dst: str) -> None:
+        """
+        Making dst the same file as src without copying: a reflink if the file system
+        supports it, a hard link otherwise, a copy only if src is on another device
+        :param src: the file to clone
+        :param dst: the path to the clone, which must not exist
+        """
+        with open(src, 'rb') as in_file, open(dst, 'wb') as out_file:
+            try:
+                fcntl.ioctl(out_file.fileno(), self._FICLONE, in_file.fileno())
+                return
+            except OSError:
+                pass
+        os.remove(dst)
+        try:
+            os.link(src, dst)
+        except OSError:
+            shutil.copyfile(src, dst)
+
+    def report(self) -> Tuple[int, int]:
+        """
+        Reporting the hit rate of the lookups so far, by all jobs sharing the cache
+        :return: the number of hits and misses
+        """
+        with self._lock:
+            hits, misses, size = self._hits, self._misses, self._size
+        self._logger.warning('Segment cache: {} hits, {} misses ({:.0%} hit rate), {} bytes '
+                             'cached'.format(hits, misses, hits / max(hits + misses, 1), size))
+        return hits, misses
+
+
+# Demo
+if __name__ == '__main__':
+    logger = logging.getLogger(__name__)
+    logger.setLevel(logging.DEBUG)
+    logger.addHandler(logging.StreamHandler(sys.stdout))
+
+    minion = SegmentCache(logger, cache_dir='cache', capacity=1024 * 1024)
+    segment_key = minion.key(link='HTTP://Sample.com:80/0.ts')
+    minion.store(key=segment_key, data=b'segment')
+    print(minion.restore(key=SegmentCache.key(link='http://sample.com/0.ts'), target='0.ts'))
+    minion.report()
@@ -0,0 +1,163 @@
+"""
+Controller is responsible of adapting the number of segments downloaded at a time (the limit)
+to what the origin sustains, as TCP does with its window (AIMD):
+1. after every round, i.e. as many downloads as the limit, the round is judged,
+2. a round with errors (e.g. 429, timeouts) halves the limit,
+3. a round whose latency grew well above the best seen lately without any gain in throughput
+cuts the limit by a quarter, since the downloads only queue up at the origin,
+4. any other round raises the limit, doubling it until the first cut and by one afterwards.
+The limit always stays within the bounds given
+"""
+
+import logging
+import sys
+import threading
+import time
+
+
+class Controller:
+    _ERROR_RATE = 0.1
+    _LATENCY_FACTOR = 2
+    _LATENCY_DRIFT = 1.1
+    _THROUGHPUT_GAIN = 1.05
+
+    def __init__(self, con_logger: logging.Logger, min_limit: int = 2, max_limit: int = 64,
+                 limit: int = 8) -> None:
+        """
+        Welcoming the logger assigned and prepare the first round
+        :param con_logger: the logger assigned
+        :param min_limit: the min number of segments downloaded at a time
+        :param max_limit: the max number of segments downloaded at a time
+        :param limit: the number of segments downloaded at a time to start with
+        """
+        self._logger = con_logger
+        self._min_limit, self._max_limit = min_limit, max_limit
+        self._limit = min(max(limit, min_limit), max_limit)
+        self._in_flight = 0
+        self._slow_start = True
+        self._best_latency = self._last_throughput = None
+        self._cond = threading.Condition()
+        self._new_round()
+
+    @property
+    def limit(self) -> int:
+        """
+        :return: the current number of segments downloaded at a time
+        """
+        return self._limit
+
+    @property
+    def max_limit(self) -> int:
+        """
+        :return: the max number of segments downloaded at a time
+        """
+        return self._max_limit
+
+    def acquire(self) -> None:
+        """
+        Waiting until one more segment can be downloaded
+        """
+        with self._cond:
+            while self._in_flight >= self._limit:
+                self._cond.wait()
+            self._in_flight += 1
+
+    def try_acquire(self) -> bool:
+        """
+        Taking one more segment to download if the limit allows, without waiting, for whoever
+        must not be held up meanwhile, e.g. the workers of a scheduler shared among jobs
+        :return: whether the segment can be downloaded
+        """
+        with self._cond:
+            if self._in_flight >= self._limit:
+                return False
+            self._in_flight += 1
+            return True
+
+    def abandon(self) -> None:
+        """
+        Giving back a segment acquired but not downloaded, e.g. found in the cache,
+        which does not count toward the round
+        """
+        with self._cond:
+            self._in_flight -= 1
+            self._cond.notify_all()
+
+    def release(self, size: int, seconds: float, ok: bool) -> None:
+        """
+        Reporting a finished download, judging the round if it is complete
+        :param size: the number of bytes downloaded
+        :param seconds: the seconds the download took
+        :param ok: whether the download succeeded
+        """
+        with self._cond:
+            self._in_flight -= 1
+            self._count += 1
+            self._errors += not ok
+            self._bytes += size
+            self._latency += seconds
+            if self._count >= self._limit:
+                self._judge()
+            self._cond.notify_all()
+
+    def _judge(self) -> None:
+        """
+        Judging the round that just completed and adapting the limit accordingly
+        """
+        latency = self._latency / self._count
+        throughput = self._bytes / max(time.perf_counter() - self._started, 1e-6)
+        if self._errors / self._count > self._ERROR_RATE:
+            self._decrease(factor=0.5, reason='{}/{} failed'.format(self._errors, self._count))
+        elif self._best_latency and latency > self._best_latency * self._LATENCY_FACTOR \
+                and throughput <= self._last_throughput * self._THROUGHPUT_GAIN:
+            self._decrease(factor=0.75, reason='latency {:.3f}s, best {:.3f}s'.format(
+                latency, self._best_latency))
+        else:
+            self._increase(reason='{:.1f} MB/s'.format(throughput / 1e6))
+
+        if not self._errors:
+            self._best_latency = min(latency, (self._best_latency or latency) * self._LATENCY_DRIFT)
+        self._last_throughput = throughput
+        self._new_round()
+
+    def _increase(self, reason: str) -> None:
+        """
+        Raising the limit, by doubling it until the first cut and by one afterwards
+        :param reason: why the limit is raised
+        """
+        limit = min(self._limit * 2 if self._slow_start else self._limit + 1, self._max_limit)
+        if limit != self._limit:
+            self._logger.debug('Concurrency limit {} -> {}: {}'.format(self._limit, limit, reason))
+        self._limit = limit
+
+    def _decrease(self, factor: float, reason: str) -> None:
+        """
+        Cutting the limit, which ends the doubling
+        :param factor: what the limit is multiplied by
+        :param reason: why the limit is cut
+        """
+        limit = max(int(self._limit * factor), self._min_limit)
+        if limit != self._limit:
+            self._logger.debug('Concurrency limit {} -> {}: {}'.format(self._limit, limit, reason))
+        self._limit, self._slow_start = limit, False
+
+    def _new_round(self) -> None:
+        """
+        Resetting the measures of the round
+        """
+        self._count = self._errors = self._bytes = 0
+        self._latency = 0.0
+        self._started = time.perf_counter()
+
+
+# Demo
+if __name__ == '__main__':
+    logger = logging.getLogger(__name__)
+    logger.setLevel(logging.DEBUG)
+    logger.addHandler(logging.StreamHandler(sys.stdout))
+
+    minion = Controller(logger, min_limit=1, max_limit=16, limit=2)
+    for i in range(40):
+        minion.acquire()
+        minion.release(size=1024 * 1024, seconds=0.1, ok=i < 30)
+    print(minion.limit)
@@ -0,0 +1,405 @@
+"""
+Daemon is responsible of running jobs submitted over a local HTTP API in one long-running
+process, which keeps warm what every run from the command line sets up and throws away:
+the download scheduler and its workers, the connections kept alive to the origins and the keys
+fetched. A few jobs run at a time, the others wait in line. The API speaks JSON:
+1. POST /jobs with {"argv": [...]} submits a job, taking the arguments of master_engine,
+2. GET /jobs lists the jobs, GET /jobs/<id> shows one,
+3. DELETE /jobs/<id> cancels a job, whether it waits or runs,
+4. GET /jobs/<id>/progress streams the status of a job, one JSON line per change, until it ends.
+Only the latest jobs ended are remembered.
+Since a job writes files and runs tools, a web page must not be able to submit one behind the
+user's back: every request must carry the token of the daemon, requests from another origin
+are refused, and so are bodies other than JSON, which a page could post without a preflight.
+A job may only write under the root directory of the daemon and run the tools it knows
+"""
+
+import hmac
+import json
+import logging
+import os
+import queue
+import re
+import secrets
+import sys
+import threading
+import time
+from collections import OrderedDict
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Any, Dict, List, Optional, Tuple
+
+from .downloader import Downloader
+from .fetcher import Fetcher
+from .key_manager import KeyManager
+from .master_engine import MasterEngine
+from .parser import Parser
+from .scheduler import Scheduler
+
+
+class _Job:
+    __slots__ = ('id', 'argv', 'state', 'engine', 'code', 'submitted', 'started', 'finished')
+
+    def __init__(self, job_id: str, argv: List[str]) -> None:
+        """
+        A job submitted to the daemon
+        :param job_id: the id of the job
+        :param argv: the arguments of the job, as given to master_engine
+        """
+        self.id, self.argv = job_id, argv
+        self.state, self.engine, self.code = Daemon.QUEUED, None, None
+        self.submitted, self.started, self.finished = time.time(), None, None
+
+
+class _DaemonHandler(BaseHTTPRequestHandler):
+    """
+    Serving the API of the daemon, keeping connections alive except while streaming progress
+    """
+    protocol_version = 'HTTP/1.1'
+    _JOB_PATTERN = re.compile(r'^/jobs/(\w+)(/progress)?$')
+
+    def do_POST(self) -> None:
+        if self._refused(json_body=True):
+            return
+        if self.path != '/jobs':
+            self._reply(status=404, body={'error': 'Not found'})
+            return
+        try:
+            argv = json.loads(self.rfile.read(int(self.headers.get('Content-Length') or 0)))['argv']
+            if not isinstance(argv, list) or not all(isinstance(arg, str) for arg in argv):
+                raise ValueError('argv must be a list of strings')
+        except (KeyError, TypeError, ValueError) as err:
+            self._reply(status=400, body={'error': 'Invalid job: {}'.format(err)})
+            return
+        refusal = self.server.daemon.check(argv=argv)
+        if refusal:
+            self._reply(status=refusal[0], body={'error': 'Invalid job: {}'.format(refusal[1])})
+            return
+        self._reply(status=201, body=self.server.daemon.submit(argv=argv))
+
+    def do_GET(self) -> None:
+        if self._refused():
+            return
+        if self.path == '/jobs':
+            self._reply(status=200, body=self.server.daemon.statuses())
+            return
+        matched = self._JOB_PATTERN.match(self.path)
+        status = self.server.daemon.status(job_id=matched.group(1)) if matched else None
+        if status is None:
+            self._reply(status=404, body={'error': 'Not found'})
+        elif matched.group(2):
+            self._stream(job_id=matched.group(1))
+        else:
+            self._reply(status=200, body=status)
+
+    def do_DELETE(self) -> None:
+        if self._refused():
+            return
+        matched = self._JOB_PATTERN.match(self.path)
+        status = self.server.daemon.cancel(job_id=matched.group(1)) \
+            if matched and not matched.group(2) else None
+        if status is None:
+            self._reply(status=404, body={'error': 'Not found'})
+        else:
+            self._reply(status=202, body=status)
+
+    def _refused(self, json_body: bool = False) -> bool:
+        """
+        Refusing the request if it comes from another origin, lacks the token of the daemon,
+        or, when it must carry a JSON body, carries anything else; the connection is closed
+        as the body of a request refused is left unread
+        :param json_body: whether the request must carry a JSON body
+        :return: whether the request is refused, which is replied to
+        """
+        content_type = (self.headers.get('Content-Type') or '').split(';')[0].strip().lower()
+        if self.headers.get('Origin') is not None:
+            self._reply(status=403, body={'error': 'Cross-origin requests are refused'})
+        elif not self.server.daemon.authorized(authorization=self.headers.get('Authorization')):
+            self._reply(status=401, body={'error': 'Missing or wrong token'})
+        elif json_body and content_type != 'application/json':
+            self._reply(status=415, body={'error': 'Content-Type must be application/json'})
+        else:
+            return False
+        self.close_connection = True
+        return True
+
+    def _reply(self, status: int, body: Any) -> None:
+        """
+        Replying with a JSON body
+        :param status: the HTTP status code
+        :param body: what to encode as JSON
+        """
+        payload = json.dumps(body).encode()
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(payload)))
+        self.end_headers()
+        self.wfile.write(payload)
+
+    def _stream(self, job_id: str) -> None:
+        """
+        Streaming the status of a job, one JSON line per change, until the job ends
+        or the client goes away
+        :param job_id: the id of the job
+        """
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/x-ndjson')
+        self.send_header('Connection', 'close')
+        self.end_headers()
+        self.close_connection = True
+        last = None
+        while True:
+            status = self.server.daemon.wait_change(job_id=job_id, last=last)
+            if status is None:
+                return
+            if status != last:
+                try:
+                    self.wfile.write(json.dumps(status).encode() + b'\n')
+                    self.wfile.flush()
+                except OSError:
+                    return
+            if status.get('state') not in (Daemon.QUEUED, Daemon.RUNNING):
+                return
+            last = status
+
+    def log_message(self, *args) -> None:
+        pass
+
+
+class Daemon:
+    QUEUED, RUNNING, DONE, FAILED, CANCELLED = 'queued', 'running', 'done', 'failed', 'cancelled'
+    _HISTORY = 1024
+    _PROGRESS_INTERVAL = 0.5
+    # the tools a job submitted may ask for, those given to the daemon apply to every job
+    _TOOLS = {'dow_tool': ('builtin', 'aria2c'), 'dec_tool': ('builtin', 'openssl'),
+              'cat_tool': ('builtin', 'cat'), 'cov_tool': ('ffmpeg',)}
+    _PATHS = ('output_name', 'metrics', 'profile', 'cache_dir')
+
+    def __init__(self, dae_logger: logging.Logger, host: str = '127.0.0.1', port: int = 8765,
+                 max_conns: int = 32, host_conns: int = 8, jobs: int = 4,
+                 job_argv: List[str] = None, token: str = None, out_root: str = '.') -> None:
+        """
+        Welcoming the logger assigned, prepare the minions shared by the jobs
+        and start the workers running them
+        :param dae_logger: the logger assigned
+        :param host: the address to listen on, local only by default
+        :param port: the port to listen on
+        :param max_conns: the max number of fragments downloaded at a time by all jobs
+        :param host_conns: the max number of fragments downloaded at a time from each host
+        :param jobs: the max number of jobs run at a time
+        :param job_argv: the arguments applied to every job, e.g. ['-W', 'builtin']
+        :param token: the token the clients must send, a random one if None
+        :param out_root: the directory the files written by the jobs submitted must be under
+        """
+        self._logger = dae_logger
+        self._job_argv = job_argv or []
+        self._token = token or secrets.token_urlsafe(24)
+        self._out_root = os.path.realpath(out_root)
+        self._scheduler = Scheduler(sch_logger=dae_logger, max_conns=max_conns,
+                                    host_conns=host_conns)
+        self._fetcher = Fetcher(fet_logger=dae_logger)
+        self._key_manager = KeyManager(key_logger=dae_logger, fetcher=self._fetcher,
+                                       capacity=256)
+        self._session = Downloader.prepare_session(host_conns=host_conns)
+        self._jobs = OrderedDict()  # type: OrderedDict[str, _Job]
+        self._queue = queue.Queue()  # type: queue.Queue
+        self._cond = threading.Condition()
+        self._next_id = 0
+        for _ in range(jobs):
+            threading.Thread(target=self._work, daemon=True).start()
+
+        self._httpd = ThreadingHTTPServer((host, port), _DaemonHandler)
+        self._httpd.daemon_threads = True
+        self._httpd.daemon = self
+
+    @property
+    def url(self) -> str:
+        """
+        :return: the URL of the API, e.g. http://127.0.0.1:8765/
+        """
+        return 'http://{}:{}/'.format(*self._httpd.server_address)
+
+    @property
+    def token(self) -> str:
+        """
+        :return: the token the clients must send as 'Authorization: Bearer <token>'
+        """
+        return self._token
+
+    def serve(self) -> None:
+        """
+        Serving the API until interrupted
+        """
+        self._logger.warning('Daemon listening on {}, token {}, writing under {}'.format(
+            self.url, self._token, self._out_root))
+        try:
+            self._httpd.serve_forever()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            self._httpd.server_close()
+
+    def shutdown(self) -> None:
+        """
+        Stopping serving the API from another thread, the jobs running are left to end
+        """
+        self._httpd.shutdown()
+
+    def authorized(self, authorization: Optional[str]) -> bool:
+        """
+        :param authorization: the Authorization header of a request, None if missing
+        :return: whether it carries the token of the daemon
+        """
+        return hmac.compare_digest((authorization or '').encode(),
+                                   'Bearer {}'.format(self._token).encode())
+
+    def check(self, argv: List[str]) -> Optional[Tuple[int, str]]:
+        """
+        Checking the arguments of a job before it is submitted: they must parse, the files
+        the job writes must be under the root directory and the tools it runs must be known.
+        The arguments the daemon applies to every job are trusted
+        :param argv: the arguments of the job, as given to master_engine
+        :return: the HTTP status code and the reason the job is refused with, None if it is not
+        """
+        try:
+            args = Parser(par_logger=self._logger).check_args(argv=argv)
+        except SystemExit:
+            return 400, 'cannot parse {}'.format(argv)
+        for option, tools in self._TOOLS.items():
+            tool = getattr(args, option)
+            if tool is not None and tool not in tools:
+                return 403, 'tool {} is not allowed for --{}, only {}'.format(
+                    tool, option, ', '.join(tools))
+        for option in self._PATHS:
+            path = getattr(args, option)
+            if path is not None and os.path.commonpath([
+                    os.path.realpath(os.path.expanduser(path)), self._out_root]) != self._out_root:
+                return 403, '--{} {} is not under {}'.format(option, path, self._out_root)
+        return None
+
+    def submit(self, argv: List[str]) -> Dict[str, Any]:
+        """
+        Submitting a job, which waits in line for a worker
+        :param argv: the arguments of the job, as given to master_engine
+        :return: the status of the job
+        """
+        with self._cond:
+            self._next_id += 1
+            job = self._jobs[str(self._next_id)] = _Job(job_id=str(self._next_id), argv=argv)
+            self._prune()
+        self._queue.put(job)
+        self._logger.debug('Job {} submitted: {}'.format(job.id, argv))
+        return self._status(job=job)
+
+    def status(self, job_id: str) -> Optional[Dict[str, Any]]:
+        """
+        :param job_id: the id of the job
+        :return: the status of the job, None if it is unknown
+        """
+        with self._cond:
+            job = self._jobs.get(job_id)
+            return self._status(job=job) if job else None
+
+    def statuses(self) -> List[Dict[str, Any]]:
+        """
+        :return: the status of every job remembered, in the order they were submitted
+        """
+        with self._cond:
+            return [self._status(job=job) for job in self._jobs.values()]
+
+    def cancel(self, job_id: str) -> Optional[Dict[str, Any]]:
+        """
+        Cancelling a job: a job waiting never runs, a job running gives up its fragments
+        not started yet and aborts before its next stage
+        :param job_id: the id of the job
+        :return: the status of the job, None if it is unknown
+        """
+        with self._cond:
+            job = self._jobs.get(job_id)
+            if not job:
+                return None
+            if job.state == self.QUEUED:
+                job.state, job.finished = self.CANCELLED, time.time()
+            elif job.state == self.RUNNING:
+                job.engine.cancel()
+                job.state = self.CANCELLED
+            self._cond.notify_all()
+            self._logger.debug('Job {} cancelled'.format(job_id))
+            return self._status(job=job)
+
+    def wait_change(self, job_id: str, last: Dict[str, Any] = None) -> Optional[Dict[str, Any]]:
+        """
+        Waiting a little for the state of a job to change
+        :param job_id: the id of the job
+        :param last: the status seen last, None to return at once
+        :return: the status of the job, which may be unchanged, None if it is forgotten
+        """
+        with self._cond:
+            job = self._jobs.get(job_id)
+            if job and last and job.state == last.get('state'):
+                self._cond.wait(self._PROGRESS_INTERVAL)
+            return self._status(job=job) if job else None
+
+    def _work(self) -> None:
+        """
+        The loop of each worker: running the next job in line with the minions shared
+        """
+        while True:
+            job = self._queue.get()
+            with self._cond:
+                if job.state != self.QUEUED:
+                    continue
+                job.state, job.started = self.RUNNING, time.time()
+                job.engine = MasterEngine(scheduler=self._scheduler, fetcher=self._fetcher,
+                                          key_manager=self._key_manager, session=self._session)
+                self._cond.notify_all()
+
+            state, code = self.DONE, 0
+            try:
+                job.engine.assist(argv=job.argv + self._job_argv)
+            except SystemExit as err:
+                state, code = self.FAILED, err.code
+            except Exception as err:
+                self._logger.error('Job {} failed: {}'.format(job.id, err))
+                state, code = self.FAILED, str(err)
+            finally:
+                job.engine.close()
+
+            with self._cond:
+                if job.state != self.CANCELLED:
+                    job.state = state
+                job.code, job.finished = code, time.time()
+                self._cond.notify_all()
+            self._logger.debug('Job {} {}'.format(job.id, job.state))
+
+    def _status(self, job: _Job) -> Dict[str, Any]:
+        """
+        :param job: a job
+        :return: its id, arguments, state, progress of the current download, exit code
+        and timestamps
+        """
+        current, total = job.engine.progress() if job.engine else (0, 0)
+        return {'id': job.id, 'argv': job.argv, 'state': job.state, 'current': current,
+                'total': total, 'code': job.code, 'submitted': job.submitted,
+                'started': job.started, 'finished': job.finished}
+
+    def _prune(self) -> None:
+        """
+        Forgetting the earliest jobs ended beyond the history kept
+        """
+        ended = [job_id for job_id, job in self._jobs.items() if job.finished]
+        for job_id in ended[:max(len(ended) - self._HISTORY, 0)]:
+            del self._jobs[job_id]
+
+
+# Demo
+if __name__ == '__main__':
+    """
+    Check out README.md for demo
+    """
+    logger = logging.getLogger(__name__)
+    logger.addHandler(logging.StreamHandler(sys.stdout))
+
+    args, job_args = Parser(par_logger=logger).parse_daemon_args()
+    Daemon(logger, host=args.host, port=args.port, max_conns=args.max_conns,
+           host_conns=args.host_conns, jobs=args.jobs, job_argv=job_args, token=args.token,
+           out_root=args.out_root).serve()
@@ -1,31 +1,59 @@
 """
-Decrypter is responsible of decrypting the concatenated .ts file with openssl
+Decrypter is responsible of decrypting the concatenated .ts file with openssl,
+or each .ts file in place with the builtin engine, which streams every segment through
+AES-128-CBC in fixed-size chunks with its own initial vector, several segments at a time
 """
 import logging
+import os
+import shutil
 import subprocess as sp
 import sys
+import threadpool
+from typing import BinaryIO, Callable, Iterable, Iterator, List, Optional, Tuple
 
+from cryptography.hazmat.backends import default_backend
+from cryptography.hazmat.primitives import padding
+from cryptography.hazmat.primitives.ciphers import Cipher, algorithms, modes
 
-class Decrypter:
+from .abortable import Abortable
 
-    def __init__(self, dec_logger: logging.Logger) -> None:
+
+class Decrypter(Abortable):
+    BUILTIN_TOOL = 'builtin'
+    _CHUNK_SIZE = 256 * 1024
+
+    def __init__(self, dec_logger: logging.Logger, pool_size: int = None) -> None:
         """
         Welcoming the logger assigned and create a place holder for tool
         :param dec_logger: the logger assigned
+        :param pool_size: the number of segments the builtin engine decrypts at a time,
+        the number of CPUs by default
         """
-        self._tool = None
+        self._tool = self._pool = None
+        self._pool_size = pool_size or os.cpu_count()
         self._logger = dec_logger
 
     def check_tool(self, tool: str) -> None:
         """
-        Checking if the tool is available
+        Checking if the tool is available,
+        the builtin engine needs nothing but a thread pool
         :param tool: the tool assigned for decryption
         """
-        if sp.call(['which', tool], stdout=sp.DEVNULL):
-            self._logger.error("abort: Cannot access decryption tool {}".format(tool))
-            exit(2)
+        if tool == self.BUILTIN_TOOL:
+            self._pool = threadpool.ThreadPool(self._pool_size)
+        elif not shutil.which(tool):
+            self._abort(reason="Cannot access decryption tool {}".format(tool), code=2)
         self._tool = tool
 
+    def close(self) -> None:
+        """
+        Dismissing the threads of the builtin engine, so a long-running process running job
+        after job does not pile them up
+        """
+        if self._pool:
+            self._pool.dismissWorkers(len(self._pool.workers))
+            self._pool = None
+
     def decrypt(self, iv: str, key_bytes: bytes, encrypted_file: str, encryption_method: str,
                 out_name: str = None) -> None:
         """
@@ -37,18 +65,134 @@ class Decrypter:
         :param out_name: the desired output name of the decrypted file
         """
         if not (key_bytes and self._tool):
-            self._logger.error(
-                "abort: Files in M3U8 are encrypted but missing key_bytes {}".format(key_bytes))
-            exit(1)
+            self._abort(reason="Files in M3U8 are encrypted but missing key_bytes {}".format(
+                key_bytes), code=1)
+        dec_command = self._build_command(iv=iv, key_bytes=key_bytes,
+                                          encryption_method=encryption_method) \
+            + ['-in', encrypted_file, '-out', out_name]
+
+        sp.call(dec_command)
+        self._logger.debug('decryption command: {}'.format(' '.join(dec_command)))
+
+    def open_stream(self, iv: str, key_bytes: bytes, encryption_method: str,
+                    out_stream: BinaryIO) -> sp.Popen:
+        """
+        Starting the tool assigned to decrypt whatever is written to its stdin into out_stream,
+        so that decryption goes along with downloading
+        :param iv: initial vector
+        :param key_bytes: decryption key
+        :param encryption_method: the method in which the stream is encrypted
+        :param out_stream: where the decrypted stream goes, e.g. the stdin of the converter
+        :return: the decryption process, whose stdin takes the encrypted stream
+        """
+        if not (key_bytes and self._tool):
+            self._abort(reason="Files in M3U8 are encrypted but missing key_bytes {}".format(
+                key_bytes), code=1)
+        dec_command = self._build_command(iv=iv, key_bytes=key_bytes,
+                                          encryption_method=encryption_method)
+        self._logger.debug('decryption command: {}'.format(' '.join(dec_command)))
+        return sp.Popen(dec_command, stdin=sp.PIPE, stdout=out_stream)
+
+    def _build_command(self, iv: str, key_bytes: bytes, encryption_method: str) -> List[str]:
+        """
+        Building the decryption command, which reads stdin and writes stdout by default
+        :param iv: initial vector
+        :param key_bytes: decryption key
+        :param encryption_method: the method in which the file is encrypted
+        :return: the decryption command
+        """
         key_hex = self._convert_key(key_bytes=key_bytes)
-        dec_command = '{tool} {enc_method} -d -nosalt ' \
-                      '-K {key_hex} -iv {iv} -in {enc_file} -out {dec_file}' \
-            .format(tool=self._tool, enc_method=encryption_method,
-                    key_hex=key_hex, iv=iv, enc_file=encrypted_file,
-                    dec_file=out_name)
+        return [self._tool, encryption_method, '-d', '-nosalt', '-K', key_hex, '-iv', iv]
+
+    def decrypt_segments(self, segments: List[Tuple[str, str, bytes]],
+                         key_of: Callable[[str], Optional[bytes]]) -> List[str]:
+        """
+        Decrypting the segment files in place with the builtin engine, several at a time
+        :param segments: the path, key URI and initial vector of each segment file
+        :param key_of: what gives the key bytes of a key URI, None if it cannot be fetched
+        :return: the paths to the segment files which failed to decrypt, left as they were
+        """
+        if not self._pool:
+            self._abort(reason="Cannot access decryption tool {}".format(self.BUILTIN_TOOL), code=2)
+        failed = []
+
+        def on_decrypted(request: threadpool.WorkRequest, decrypted: bool) -> None:
+            if not decrypted:
+                failed.append(request.args[0])
+
+        dec_requests = threadpool.makeRequests(
+            self._decrypt_file, [((path, key_uri, iv, key_of), None)
+                                 for path, key_uri, iv in segments], on_decrypted)
+        [self._pool.putRequest(req) for req in dec_requests]
+        self._pool.wait()
+        self._logger.debug('Segments decrypted: {}'.format(len(segments) - len(failed)))
+        return failed
+
+    def decrypt_bytes(self, data: Optional[bytes], key_bytes: bytes,
+                      iv: bytes) -> Optional[bytes]:
+        """
+        Decrypting the content of a segment in memory with the builtin engine
+        :param data: the encrypted content, None if the segment is missing
+        :param key_bytes: decryption key, None if it cannot be fetched
+        :param iv: the initial vector of the segment
+        :return: the decrypted content, None if the segment is missing or cannot be decrypted
+        """
+        if data is None or key_bytes is None:
+            return None
+        view = memoryview(data)
+        chunks = (view[offset:offset + self._CHUNK_SIZE]
+                  for offset in range(0, len(view), self._CHUNK_SIZE))
+        try:
+            return b''.join(self._decrypt_chunks(chunks=chunks, key_bytes=key_bytes, iv=iv))
+        except ValueError as err:
+            self._logger.error('Failed to decrypt segment: {}'.format(err))
+            return None
+
+    def _decrypt_file(self, path: str, key_uri: str, iv: bytes,
+                      key_of: Callable[[str], Optional[bytes]]) -> bool:
+        """
+        Decrypting a segment file chunk by chunk into a temporary file, which replaces it
+        only once it is all decrypted, so a segment failing to decrypt is left as it was.
+        A file hard linked elsewhere (e.g. to the segment cache) is replaced, not overwritten
+        :param path: the path to the segment file
+        :param key_uri: the URI of the decryption key
+        :param iv: the initial vector of the segment
+        :param key_of: what gives the key bytes of a key URI, None if it cannot be fetched
+        :return: whether the segment is decrypted
+        """
+        key_bytes = key_of(key_uri)
+        if key_bytes is None:
+            self._logger.error('Failed to decrypt {}: cannot fetch key {}'.format(path, key_uri))
+            return False
+        tmp_path = path + '.dec'
+        try:
+            with open(path, 'rb') as segment, open(tmp_path, 'wb') as decrypted_file:
+                chunks = iter(lambda: segment.read(self._CHUNK_SIZE), b'')
+                for decrypted in self._decrypt_chunks(chunks=chunks, key_bytes=key_bytes, iv=iv):
+                    decrypted_file.write(decrypted)
+            os.replace(tmp_path, path)
+            return True
+        except Exception as err:
+            self._logger.error('Failed to decrypt {}: {}'.format(path, err))
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            return False
 
-        sp.call(dec_command.split(' '))
-        self._logger.debug('decryption command: {}'.format(dec_command))
+    @staticmethod
+    def _decrypt_chunks(chunks: Iterable[bytes], key_bytes: bytes, iv: bytes) -> Iterator[bytes]:
+        """
+        Decrypting a stream of AES-128-CBC encrypted chunks and stripping the PKCS7 padding
+        :param chunks: the encrypted chunks of one segment
+        :param key_bytes: decryption key
+        :param iv: the initial vector of the segment
+        :return: the decrypted chunks, which may be empty
+        """
+        decryptor = Cipher(algorithms.AES(key_bytes), modes.CBC(iv),
+                           backend=default_backend()).decryptor()
+        unpadder = padding.PKCS7(algorithms.AES.block_size).unpadder()
+        for chunk in chunks:
+            yield unpadder.update(decryptor.update(chunk))
+        yield unpadder.update(decryptor.finalize()) + unpadder.finalize()
 
     def _convert_key(self, key_bytes: bytes) -> str:
         """
@@ -74,3 +218,9 @@ if __name__ == '__main__':
         key_bytes=b'}}\x08\x90a\xaf\xe3\xfc\xfa\x9c\xd8\x15\xe6\xbb\xecC',
         out_name='decrypted.ts',
         encrypted_file='encrypted.ts', encryption_method='AES-128')
+
+    minion.check_tool(tool=Decrypter.BUILTIN_TOOL)
+    minion.decrypt_segments(
+        key_of=lambda key_uri: b'}}\x08\x90a\xaf\xe3\xfc\xfa\x9c\xd8\x15\xe6\xbb\xecC',
+        segments=[('0.ts', 'sample.key', (0).to_bytes(16, 'big')),
+                  ('1.ts', 'sample.key', (1).to_bytes(16, 'big'))])
@@ -1,72 +1,767 @@
 """
-Downloader is responsible of downloading the links specified in the .m3u file to out_dir with aria2c
+Downloader is responsible of downloading the links specified in the .m3u file to out_dir,
+either with an external tool (aria2c by default) or with the builtin engine, which fetches
+segments in-process over a shared keep-alive connection pool
 Multi-threads are used to save time, pool size is 8 by default
 """
 
 
+import io
+import os
+import queue
+import random
 import sys
+import threading
+import time
+import zlib
 import logging
 import threadpool
+import requests
+import shutil
 import subprocess as sp
 
-from typing import List
+from collections import deque
+from functools import partial
+from typing import Callable, Deque, List, Optional, Set, Tuple, TypeVar
+from urllib.parse import urlparse
+from requests.adapters import HTTPAdapter
 
+from .abortable import Abortable
 from .bcolours import BColours
+from .cache import SegmentCache
+from .controller import Controller
+from .journal import Journal
+from .metrics import Metrics
+from .mirrors import Mirrors
+from .planner import Planner
+from .scheduler import Scheduler
 
+T = TypeVar('T')
 
-class Downloader:
 
-    def __init__(self, dow_logger: logging.Logger, pool_size: int = 8) -> None:
+class Downloader(Abortable):
+    BUILTIN_TOOL = 'builtin'
+    _CHUNK_SIZE = 64 * 1024
+    _BACKOFF_BASE = 0.5
+    _BACKOFF_CAP = 30
+    _HEDGE_FACTOR = 1.5
+    _HEDGE_SAMPLES = 20
+
+    def __init__(self, dow_logger: logging.Logger, pool_size: int = 8,
+                 scheduler: Scheduler = None, metrics: Metrics = None,
+                 session: requests.Session = None) -> None:
         """
         Welcoming the logger assigned, prepare thread pool,
         and create several place holder for class variables
         :param dow_logger: the logger assigned
         :param pool_size: the size of the thread pool
+        :param scheduler: if given, the downloads run on the connections it shares among jobs
+        instead of a thread pool of their own
+        :param metrics: where the latency, size, retries and errors of the segments are measured
+        :param session: if given, the builtin engine downloads over its connections,
+        kept alive across jobs, instead of a session of its own
         """
         self._logger = dow_logger
-        self._pool = threadpool.ThreadPool(pool_size)
+        self._pool_size = pool_size
+        self._scheduler = scheduler
+        self._pool = None if scheduler else threadpool.ThreadPool(pool_size)
         self._crr_num = self._ttl_num = 0
-        self._tool = self._out_dir = None
+        self._tool = self._out_dir = self._session = self._on_segment = self._journal = None
+        self._shared_session = session
+        self._controller = self._cache = self._validator = self._mirrors = None
+        self._retries, self._timeout, self._hedge = 3, 60.0, False
+        self._coalesce_size = 8 * 1024 * 1024
+        self._failed: Set[int] = set()
+        self._durations: Deque[float] = deque(maxlen=200)
+        self._finish_lock = threading.Lock()
+        self._status_lock = threading.Lock()
+        self._cancelled = threading.Event()
+        self._metrics = metrics or Metrics(met_logger=dow_logger)
 
-    def check_tool(self, tool: str) -> None:
+    def check_tool(self, tool: str, host_conns: int = None, controller: Controller = None) -> None:
         """
-        Checking if the download tool is available
+        Checking if the download tool is available,
+        the builtin engine needs nothing but a connection pool
         :param tool: the tool assigned for downloading
+        :param host_conns: the max number of connections kept alive to each host
+        by the builtin engine, defaults to the size of the thread pool
+        :param controller: if given, it adapts the number of segments downloaded at a time,
+        and the thread pool grows to its max limit
+        """
+        pool_size = controller.max_limit if controller else self._pool_size
+        if self._pool and len(self._pool.workers) < pool_size:
+            self._pool.createWorkers(pool_size - len(self._pool.workers))
+        if tool == self.BUILTIN_TOOL:
+            self._session = self._shared_session \
+                or self.prepare_session(host_conns=host_conns or pool_size)
+        elif not shutil.which(tool):
+            self._abort(reason="Cannot access download tool {}".format(tool), code=2)
+        self._tool, self._controller = tool, controller
+
+    @staticmethod
+    def prepare_session(host_conns: int) -> requests.Session:
+        """
+        Create a session whose connections are kept alive and shared among threads
+        :param host_conns: the max number of connections opened to each host
+        :return: the session prepared
+        """
+        adapter = HTTPAdapter(pool_maxsize=host_conns, pool_block=True)
+        session = requests.Session()
+        session.mount('http://', adapter)
+        session.mount('https://', adapter)
+        return session
+
+    def set_retry_policy(self, retries: int = 3, timeout: float = 60.0,
+                         hedge: bool = False) -> None:
+        """
+        Setting how hard each segment is tried before it is given up
+        :param retries: the number of times a failed segment is tried again,
+        after a jittered exponential backoff
+        :param timeout: the max number of seconds each attempt may take
+        :param hedge: whether to request a segment again once it takes well longer than the p95
+        of its peers, taking whichever response completes first (builtin engine only)
         """
-        if sp.call(['which', tool], stdout=sp.DEVNULL):
-            self._logger.error("abort: Cannot access download tool {}".format(tool))
-            exit(2)
-        self._tool = tool
+        self._retries, self._timeout, self._hedge = retries, timeout, hedge
 
-    def download(self, links: List[str], out_dir: str = None) -> None:
+    def set_coalesce_size(self, coalesce_size: int) -> None:
+        """
+        Setting how large a request for adjacent byte ranges of the same link may grow
+        :param coalesce_size: the max number of bytes requested at a time, 0 not to coalesce
+        """
+        self._coalesce_size = coalesce_size
+
+    def set_cache(self, cache: SegmentCache) -> None:
+        """
+        Setting the segment cache looked up before the network and filled after each download
+        :param cache: the segment cache, None not to cache
+        """
+        self._cache = cache
+
+    def set_validator(self, validator: Callable[[int, bytes], Optional[str]]) -> None:
+        """
+        Setting what checks each segment as it lands, a corrupt segment counts as a failed
+        attempt and is fetched again
+        :param validator: what tells what is wrong with the content of the segment at a position,
+        None if nothing, no validation if None
+        """
+        self._validator = validator
+
+    def set_mirrors(self, mirrors: Mirrors) -> None:
+        """
+        Setting the mirrors the segments are downloaded from: the builtin engine routes each
+        attempt to the mirror performing best and fails over as one errors, an external tool
+        is given the link on every mirror
+        :param mirrors: the mirrors, None to download from the links in M3U8 only
+        """
+        self._mirrors = mirrors
+
+    def download(self, links: List[str], out_dir: str = None,
+                 on_segment: Callable[[int, Optional[bytes]], None] = None,
+                 journal: Journal = None, done: Set[int] = None,
+                 byteranges: List[Optional[Tuple[int, int]]] = None,
+                 sizes: List[Optional[int]] = None) -> Set[int]:
         """
         Download the given links to output directory
         :param links: the links to the file to download
         :param out_dir: the output directory
+        :param on_segment: if given, each segment is handed over to it as (index, content)
+        instead of being kept in out_dir, with None as content if it failed to download
+        :param journal: if given, each segment kept in out_dir is recorded once complete
+        :param done: the positions of the links already downloaded, which are skipped
+        :param byteranges: the (length, offset) of each link to download, None if all of it,
+        adjacent ranges of the same link are requested together (builtin engine only)
+        :param sizes: if given, the size of each link, the largest are downloaded first so that
+        none is left to the end to hold the download up, in order of the links otherwise
+        :return: the positions of the links failed to download even after retries
         """
-        self._out_dir, self._ttl_num = out_dir, len(links)
+        pending = [((index, link), None) for index, link in enumerate(links)
+                   if (not done or index not in done)
+                   and not (byteranges and byteranges[index])]
+        runs = [((link, indices, ranges), None) for link, indices, ranges
+                in self._coalesce(links=links, byteranges=byteranges, done=done)]
+        if sizes:
+            rank = {index: position for position, index in enumerate(Planner.order(sizes=sizes))}
+            pending.sort(key=lambda request: rank[request[0][0]])
+            runs.sort(key=lambda request: -sum(length for length, _ in request[0][2]))
+        self._out_dir, self._crr_num = out_dir, 0
+        self._ttl_num = len(pending) + sum(len(indices) for (_, indices, _), _ in runs)
+        self._on_segment, self._journal, self._failed = on_segment, journal, set()
+        if out_dir:
+            os.makedirs(out_dir, exist_ok=True)
 
-        download_requests = threadpool.makeRequests(self._download_thread, links)
-        [self._pool.putRequest(req) for req in download_requests]
-        self._pool.wait()
+        self._report_status(current=0, complete=self._ttl_num)
+        start = time.perf_counter()
+        if self._scheduler:
+            self._scheduler.run(tasks=[(urlparse(link).netloc,
+                                        partial(self._download_thread, index, link))
+                                       for (index, link), _ in pending]
+                                + [(urlparse(link).netloc,
+                                    partial(self._download_ranges, link, indices, ranges))
+                                   for (link, indices, ranges), _ in runs],
+                                admit=self._controller.try_acquire if self._controller else None)
+        else:
+            download_requests = threadpool.makeRequests(self._download_thread, pending) \
+                + threadpool.makeRequests(self._download_ranges, runs)
+            [self._pool.putRequest(req) for req in download_requests]
+            self._pool.wait()
+        self._metrics.count(name='download_seconds', value=time.perf_counter() - start)
+        self._metrics.set(name='download_bytes_per_second',
+                          value=self._metrics.value(name='download_bytes')
+                          / max(self._metrics.value(name='download_seconds'), 1e-6))
         print("Download complete")
+        return self._failed
+
+    def progress(self) -> Tuple[int, int]:
+        """
+        :return: the number of links finished and to download in the current download
+        """
+        with self._status_lock:
+            return self._crr_num, self._ttl_num
+
+    def cancel(self) -> None:
+        """
+        Giving up the links not started yet, in the current download and any later one,
+        e.g. once the next stage fails, they are reported as failed
+        """
+        self._cancelled.set()
 
-    def _download_thread(self, link) -> None:
+    def _download_thread(self, index: int, link: str) -> int:
         """
-        The download process for each thread, assuming using aria2c for now,
+        The download process for each thread, with the builtin engine or an external tool,
         keep reporting status
+        :param index: the position of the link in the playlist
+        :param link: the link to download from
+        :return: the number of bytes downloaded
+        """
+        if self._cancelled.is_set():
+            self._give_back()
+            self._failed.add(index)
+            self._advance(count=1)
+            return 0
+        if self._cache and self._from_cache(index=index, link=link):
+            self._give_back()
+            self._advance(count=1)
+            return 0
+        self._acquire()
+        start, content, size, ok = time.perf_counter(), None, 0, False
+        try:
+            if self._on_segment:
+                content = self._fetch_content(index=index, link=link)
+                size, ok = len(content or b''), content is not None
+            elif self._tool == self.BUILTIN_TOOL:
+                size = self._fetch(index=index, link=link)
+                size, ok = size or 0, size is not None
+            elif self._retry(link=link, attempt=lambda: self._call_checked(index=index,
+                                                                           link=link)):
+                target = self.target_path(link=link, out_dir=self._out_dir)
+                size, ok = os.path.getsize(target) if os.path.exists(target) else 0, True
+                if self._journal:
+                    self._journal.record_file(index=index, path=target)
+        except Exception as err:
+            # reported as failed like any other, so that nobody waits for the segment forever
+            self._logger.error('Failed to download {}: {}'.format(link, err))
+            content, ok = None, False
+        finally:
+            seconds = time.perf_counter() - start
+            if self._controller:
+                self._controller.release(size=size, seconds=seconds, ok=ok)
+            self._measure(size=size, seconds=seconds, ok=ok)
+
+        if not ok:
+            self._failed.add(index)
+        elif self._cache:
+            self._to_cache(link=link, content=content)
+        if self._on_segment:
+            self._on_segment(index, content)
+        self._advance(count=1)
+        return size
+
+    def _acquire(self) -> None:
+        """
+        Waiting for the controller to let one more segment download, unless the scheduler
+        already asked it before starting the download
+        """
+        if self._controller and not self._scheduler:
+            self._controller.acquire()
+
+    def _give_back(self) -> None:
+        """
+        Giving back to the controller what the scheduler acquired for a download
+        which is not going to happen, e.g. found in the cache
+        """
+        if self._controller and self._scheduler:
+            self._controller.abandon()
+
+    def _from_cache(self, index: int, link: str, byterange: Tuple[int, int] = None) -> bool:
+        """
+        Taking a segment from the cache instead of the network, into its target file or
+        handed over as its content
+        :param index: the position of the segment in the playlist
+        :param link: the link to the segment
+        :param byterange: the (length, offset) of the segment, None if all of the link
+        :return: whether the segment was in the cache
+        """
+        key = SegmentCache.key(link=link, byterange=byterange)
+        if self._on_segment:
+            content = self._cache.read(key=key)
+            if content is None:
+                return False
+            self._on_segment(index, content)
+        else:
+            target = self.target_path(link=link, out_dir=self._out_dir, byterange=byterange)
+            if self._cache.restore(key=key, target=target) is None:
+                return False
+            if self._journal:
+                self._journal.record_file(index=index, path=target)
+        self._metrics.count(name='cache_hits')
+        return True
+
+    def _to_cache(self, link: str, content: bytes = None,
+                  byterange: Tuple[int, int] = None) -> None:
+        """
+        Keeping a segment downloaded in the cache, linking its target file if it has one
+        :param link: the link to the segment
+        :param content: the content of the segment, None if kept in its target file
+        :param byterange: the (length, offset) of the segment, None if all of the link
+        """
+        key = SegmentCache.key(link=link, byterange=byterange)
+        if content is not None:
+            self._cache.store(key=key, data=content)
+        else:
+            self._cache.store(key=key, path=self.target_path(link=link, out_dir=self._out_dir,
+                                                             byterange=byterange))
+
+    def _coalesce(self, links: List[str], byteranges: List[Optional[Tuple[int, int]]] = None,
+                  done: Set[int] = None) -> List[Tuple[str, List[int], List[Tuple[int, int]]]]:
+        """
+        Grouping the byte ranges to download into runs, each run covering adjacent ranges of
+        the same link in order, and not exceeding the coalesce size unless a single range does
+        :param links: the links to the file to download
+        :param byteranges: the (length, offset) of each link to download, None if all of it
+        :param done: the positions of the links already downloaded, which are skipped
+        :return: the link, the positions and the byte ranges of each run
+        """
+        runs: List[Tuple[str, List[int], List[Tuple[int, int]]]] = []
+        size = 0
+        for index, (link, byterange) in enumerate(zip(links, byteranges or [])):
+            if not byterange or (done and index in done):
+                continue
+            if runs and runs[-1][0] == link and runs[-1][1][-1] == index - 1 \
+                    and sum(runs[-1][2][-1]) == byterange[1] \
+                    and size + byterange[0] <= self._coalesce_size:
+                runs[-1][1].append(index)
+                runs[-1][2].append(byterange)
+                size += byterange[0]
+            else:
+                runs.append((link, [index], [byterange]))
+                size = byterange[0]
+        if runs:
+            self._logger.debug('Byte ranges coalesced: {} into {} requests'.format(
+                sum(len(run[1]) for run in runs), len(runs)))
+        return runs
+
+    def _download_ranges(self, link: str, indices: List[int],
+                         byteranges: List[Tuple[int, int]]) -> int:
+        """
+        The download process of a run of adjacent byte ranges, requested at once with
+        the builtin engine and split into their segments, keep reporting status
         :param link: the link to download from
+        :param indices: the positions of the segments in the playlist
+        :param byteranges: the (length, offset) of each segment, adjacent in order
+        :return: the number of bytes downloaded
+        """
+        if self._cancelled.is_set():
+            self._give_back()
+            self._failed.update(indices)
+            self._advance(count=len(indices))
+            return 0
+        served = {index for index, byterange in zip(indices, byteranges)
+                  if self._cache and self._from_cache(index=index, link=link,
+                                                      byterange=byterange)}
+        if len(served) == len(indices):
+            self._give_back()
+            self._advance(count=len(indices))
+            return 0
+        self._acquire()
+        start, length = time.perf_counter(), sum(byterange[0] for byterange in byteranges)
+        content = None
+
+        def attempt() -> Optional[Tuple[Optional[bytes], int, int]]:
+            result = self._fetch_hedged(link=link, byterange=(length, byteranges[0][1]))
+            view, offset = memoryview(result[0]) if result else None, 0
+            for index, byterange in zip(indices, byteranges):
+                if result and index not in served and not self._valid(
+                        index=index, data=view[offset:offset + byterange[0]]):
+                    return None
+                offset += byterange[0]
+            return result
+
+        try:
+            result = self._retry(link=link, attempt=attempt)
+            content = result[0] if result else None
+        except Exception as err:
+            # reported as failed like any other, so that nobody waits for the segments forever
+            self._logger.error('Failed to download {}: {}'.format(link, err))
+        finally:
+            seconds = time.perf_counter() - start
+            if self._controller:
+                self._controller.release(size=length if content else 0, seconds=seconds,
+                                         ok=content is not None)
+            self._measure(size=length if content else 0, seconds=seconds,
+                          ok=content is not None, segments=len(indices))
+
+        offset = 0
+        for index, byterange in zip(indices, byteranges):
+            data = content[offset:offset + byterange[0]] if content is not None else None
+            offset += byterange[0]
+            if index in served:
+                continue
+            if data is None:
+                self._failed.add(index)
+            elif not self._on_segment:
+                self._keep(index=index, data=data, target=self.target_path(
+                    link=link, out_dir=self._out_dir, byterange=byterange))
+            if data is not None and self._cache:
+                self._to_cache(link=link, byterange=byterange,
+                               content=data if self._on_segment else None)
+            if self._on_segment:
+                self._on_segment(index, data)
+        self._advance(count=len(indices))
+        return length if content else 0
+
+    def _measure(self, size: int, seconds: float, ok: bool, segments: int = 1) -> None:
+        """
+        Measuring a finished download, a run of byte ranges requested at once counts as one
+        :param size: the number of bytes downloaded
+        :param seconds: the seconds the download took, including retries
+        :param ok: whether the download succeeded
+        :param segments: the number of segments downloaded
+        """
+        if ok:
+            self._metrics.observe(name='segment_seconds', value=seconds)
+            self._metrics.observe(name='segment_bytes', value=size, buckets=Metrics.SIZE_BUCKETS)
+            self._metrics.count(name='download_bytes', value=size)
+            self._metrics.count(name='segments_downloaded', value=segments)
+        else:
+            self._metrics.count(name='segments_failed', value=segments)
+        if self._controller:
+            self._metrics.set(name='concurrency_limit', value=self._controller.limit)
+
+    def _advance(self, count: int) -> None:
+        """
+        Counting the segments finished by a thread and reporting the status
+        :param count: the number of segments finished
+        """
+        with self._status_lock:
+            self._crr_num += count
+            self._report_status(current=self._crr_num, complete=self._ttl_num)
+
+    def _keep(self, index: int, data: bytes, target: str) -> None:
+        """
+        Keeping a segment split from a run in its target file and recording it,
+        the target is replaced rather than written over, as it may be linked to the cache
+        :param index: the position of the segment in the playlist
+        :param data: the content of the segment
+        :param target: the path to the target file
+        """
+        part_path = '{}.part'.format(target)
+        try:
+            with open(part_path, 'wb') as out_file:
+                out_file.write(data)
+            os.replace(part_path, target)
+        except OSError as err:
+            self._discard(path=part_path)
+            self._logger.error('Failed to keep {}: {}'.format(target, err))
+            self._failed.add(index)
+            return
+        if self._journal:
+            self._journal.record(index=index, length=len(data), checksum=zlib.crc32(data))
+
+    def _retry(self, link: str, attempt: Callable[[], Optional[T]]) -> Optional[T]:
+        """
+        Trying to download the link until it succeeds or the retries run out,
+        backing off exponentially with jitter between the attempts
+        :param link: the link to download from
+        :param attempt: one attempt to download the link, returning None if failed
+        :return: the result of the attempt succeeded, None if all failed
+        """
+        for tries in range(self._retries + 1):
+            if tries:
+                backoff = min(self._BACKOFF_CAP, self._BACKOFF_BASE * 2 ** (tries - 1))
+                backoff = backoff / 2 + random.uniform(0, backoff / 2)
+                self._logger.debug('Retrying {} in {:.1f}s'.format(link, backoff))
+                self._metrics.count(name='retries')
+                time.sleep(backoff)
+            result = attempt()
+            if result is not None:
+                return result
+            self._metrics.count(name='errors')
+        self._logger.error('Failed to download {} after {} attempts'.format(
+            link, self._retries + 1))
+        return None
+
+    def _call_tool(self, link: str) -> int:
+        """
+        Download the link with the external tool, assuming using aria2c for now
+        :param link: the link to download from
+        :return: the exit code of the tool
         """
-        self._report_status(current=self._crr_num, complete=self._ttl_num)
         command = '{} {}' \
                   ' --console-log-level=error' \
                   ' --download-result=hide' \
-                  ' --show-console-readout false'.format(self._tool, link)
+                  ' --allow-overwrite=true' \
+                  ' --timeout={:.0f}' \
+                  ' --show-console-readout false'.format(self._tool, link, self._timeout)
+        if self._mirrors:
+            # aria2c takes the link on each mirror as a source of the same file
+            command = command.replace(link, ' '.join(self._mirrors.urls(link=link)), 1)
+            command += ' --uri-selector=adaptive'
         if self._out_dir:
             command += ' --dir {}'.format(self._out_dir)
+        # the tool writes over the target, which may be linked to the segment cache
+        self._discard(path=self.target_path(link=link, out_dir=self._out_dir))
+
+        try:
+            return sp.call(command.split(), timeout=self._timeout)
+        except sp.TimeoutExpired:
+            self._logger.warning('Failed to download {}: {}s elapsed'.format(link, self._timeout))
+            return -1
+
+    def _fetch(self, index: int, link: str) -> Optional[int]:
+        """
+        Download the link over the shared connection pool,
+        streaming the body straight to its target file, and record it once complete
+        :param index: the position of the link in the playlist
+        :param link: the link to download from
+        :return: the number of bytes downloaded, None if failed
+        """
+        target = self.target_path(link=link, out_dir=self._out_dir)
+        result = self._retry(link=link, attempt=lambda: self._checked(
+            index=index, result=self._fetch_hedged(link=link, target=target), path=target))
+        if result is None:
+            return None
+        _, length, checksum = result
+        if self._journal:
+            self._journal.record(index=index, length=length, checksum=checksum)
+        return length
 
-        sp.call(command.split())
-        self._crr_num += 1
+    def _fetch_content(self, index: int, link: str) -> Optional[bytes]:
+        """
+        Download the link and return its content instead of keeping it in out_dir
+        :param index: the position of the link in the playlist
+        :param link: the link to download from
+        :return: the content downloaded, None if failed
+        """
+        if self._tool != self.BUILTIN_TOOL:
+            if not self._retry(link=link, attempt=lambda: self._call_checked(index=index,
+                                                                             link=link)):
+                return None
+            target = self.target_path(link=link, out_dir=self._out_dir)
+            try:
+                with open(target, 'rb') as in_file:
+                    content = in_file.read()
+                os.remove(target)
+                return content
+            except OSError as err:
+                self._logger.error('Failed to download {}: {}'.format(link, err))
+                return None
+
+        result = self._retry(link=link, attempt=lambda: self._checked(
+            index=index, result=self._fetch_hedged(link=link)))
+        return result[0] if result else None
+
+    def _call_checked(self, index: int, link: str) -> Optional[bool]:
+        """
+        One attempt to download the link with the external tool
+        :param index: the position of the link in the playlist
+        :param link: the link to download from
+        :return: True if the tool succeeded and the segment is valid, None otherwise
+        """
+        if self._call_tool(link=link) != 0:
+            return None
+        return self._valid(index=index,
+                           path=self.target_path(link=link, out_dir=self._out_dir)) or None
+
+    def _checked(self, index: int, result: Optional[T], path: str = None) -> Optional[T]:
+        """
+        Passing on the result of an attempt only if the segment it downloaded is valid
+        :param index: the position of the link in the playlist
+        :param result: the content (None if written to path), length and CRC32, None if failed
+        :param path: the path the content is written to, if any
+        :return: the result, None if failed or the segment is corrupt
+        """
+        if result is None or self._valid(index=index, data=result[0], path=path):
+            return result
+        return None
+
+    def _valid(self, index: int, data: bytes = None, path: str = None) -> bool:
+        """
+        Validating a segment as it lands
+        :param index: the position of the segment in the playlist
+        :param data: the content of the segment, read from path if None
+        :param path: the path to the segment file
+        :return: whether the segment is valid, always if there is no validator
+        """
+        if not self._validator:
+            return True
+        try:
+            if data is None:
+                with open(path, 'rb') as in_file:
+                    data = in_file.read()
+            reason = self._validator(index, data)
+        except OSError as err:
+            reason = str(err)
+        if reason:
+            self._logger.warning('Segment {} is corrupt: {}'.format(index, reason))
+            self._metrics.count(name='corrupt_segments')
+            return False
+        return True
+
+    def _fetch_hedged(self, link: str, target: str = None, byterange: Tuple[int, int] = None) \
+            -> Optional[Tuple[Optional[bytes], int, int]]:
+        """
+        Download the link once, requesting it again if it takes well longer than the p95
+        of the segments downloaded so far, and taking whichever response completes first
+        :param link: the link to download from
+        :param target: the path to write the content to, kept in memory if None
+        :param byterange: the (length, offset) to download, all of it if None
+        :return: the content (None if written to target), length and CRC32, None if failed
+        """
+        finished = threading.Event()
+        if not self._hedge:
+            return self._fetch_once(link=link, target=target, finished=finished,
+                                    byterange=byterange)
+
+        results: queue.Queue = queue.Queue()
+
+        def attempt(part: int) -> None:
+            results.put(self._fetch_once(link=link, target=target, finished=finished, part=part,
+                                         byterange=byterange))
+
+        threading.Thread(target=attempt, args=(0,), daemon=True).start()
+        try:
+            return results.get(timeout=self._hedge_delay())
+        except queue.Empty:
+            self._logger.debug('Hedging {}'.format(link))
+            self._metrics.count(name='hedges')
+        threading.Thread(target=attempt, args=(1,), daemon=True).start()
+        return results.get() or results.get()
+
+    def _hedge_delay(self) -> Optional[float]:
+        """
+        :return: the seconds after which a segment is requested again,
+        None until enough segments are downloaded to tell
+        """
+        durations = sorted(self._durations)
+        if len(durations) < self._HEDGE_SAMPLES:
+            return None
+        return durations[int(len(durations) * 0.95)] * self._HEDGE_FACTOR
+
+    def _fetch_once(self, link: str, target: str = None, finished: threading.Event = None,
+                    part: int = 0, byterange: Tuple[int, int] = None) \
+            -> Optional[Tuple[Optional[bytes], int, int]]:
+        """
+        One attempt to download the link within the timeout, writing to a part file of its own
+        which replaces the target only if no other attempt of the link has finished first
+        :param link: the link to download from
+        :param target: the path to write the content to, kept in memory if None
+        :param finished: set by the first attempt of the link that completes
+        :param part: the number of the attempt, naming its part file
+        :param byterange: the (length, offset) to download with a Range request, all if None
+        :return: the content (None if written to target), length and CRC32, None if failed
+        or beaten by another attempt
+        """
+        part_path = '{}.part{}'.format(target, part) if target else None
+        content, length, checksum = None, 0, 0
+        headers = {'Range': 'bytes={}-{}'.format(byterange[1], sum(byterange) - 1)} \
+            if byterange else {}
+        mirror, url = self._mirrors.pick(link=link) if self._mirrors else (-1, link)
+        start, abandoned = time.perf_counter(), False
+        try:
+            with self._session.get(url, stream=True, timeout=self._timeout,
+                                   headers=headers) as response:
+                response.raise_for_status()
+                # a server ignoring Range sends all of it, which is read up to the range
+                skip = byterange[1] if byterange and response.status_code != 206 else 0
+                with open(part_path, 'wb') if part_path else io.BytesIO() as out_file:
+                    for chunk in response.iter_content(chunk_size=self._CHUNK_SIZE):
+                        if finished.is_set():
+                            abandoned = True
+                            break
+                        if time.perf_counter() - start > self._timeout:
+                            raise requests.Timeout('{}s elapsed'.format(self._timeout))
+                        if skip:
+                            chunk, skip = chunk[skip:], max(skip - len(chunk), 0)
+                        if byterange:
+                            chunk = chunk[:byterange[0] - length]
+                        out_file.write(chunk)
+                        length, checksum = length + len(chunk), zlib.crc32(chunk, checksum)
+                        if byterange and length == byterange[0]:
+                            break
+                    if not part_path:
+                        content = out_file.getvalue()
+            if abandoned:
+                # beaten midway by another attempt, what it downloaded so far is no measure
+                self._discard(path=part_path)
+                if self._mirrors:
+                    self._mirrors.abandon(mirror=mirror)
+                return None
+            if byterange and length != byterange[0]:
+                raise requests.RequestException('{} of {} bytes in range'.format(
+                    length, byterange[0]))
+        except (requests.RequestException, OSError) as err:
+            self._logger.warning('Failed to download {}: {}'.format(url, err))
+            self._discard(path=part_path)
+            self._report_mirror(mirror=mirror, size=length, start=start, ok=False)
+            return None
+
+        self._report_mirror(mirror=mirror, size=length, start=start, ok=True)
+        with self._finish_lock:
+            if finished.is_set():
+                self._discard(path=part_path)
+                return None
+            finished.set()
+            if part_path:
+                os.replace(part_path, target)
+        self._durations.append(time.perf_counter() - start)
+        return content, length, checksum
+
+    def _report_mirror(self, mirror: int, size: int, start: float, ok: bool) -> None:
+        """
+        Reporting an attempt to the mirrors, if any
+        :param mirror: the mirror the attempt was routed to, -1 if none
+        :param size: the number of bytes downloaded
+        :param start: when the attempt started, by perf_counter
+        :param ok: whether the attempt succeeded
+        """
+        if self._mirrors:
+            self._mirrors.report(mirror=mirror, size=size, seconds=time.perf_counter() - start,
+                                 ok=ok)
+
+    @staticmethod
+    def _discard(path: str = None) -> None:
+        """
+        Removing the part file of an attempt failed or beaten
+        :param path: the path to the part file, None if kept in memory
+        """
+        if path and os.path.exists(path):
+            os.remove(path)
+
+    @staticmethod
+    def target_path(link: str, out_dir: str = None, byterange: Tuple[int, int] = None) -> str:
+        """
+        Naming the downloaded file after the last part of the link, as aria2c does,
+        followed by the first and last byte if only a range of it is downloaded
+        :param link: the link to download from
+        :param out_dir: the output directory
+        :param byterange: the (length, offset) downloaded, None if all of it
+        :return: the path to the downloaded file
+        """
+        file_name = os.path.basename(urlparse(link).path)
+        if byterange:
+            name, extension = os.path.splitext(file_name)
+            file_name = '{}_{}-{}{}'.format(name, byterange[1], sum(byterange) - 1, extension)
+        return os.path.join(out_dir, file_name) if out_dir else file_name
 
     @staticmethod
     def _report_status(current: int, complete: int) -> None:
@@ -101,6 +796,7 @@ if __name__ == '__main__':
     logger.setLevel(logging.DEBUG)
     logger.addHandler(logging.StreamHandler(sys.stdout))
     minion = Downloader(logger)
+    minion.check_tool(tool=Downloader.BUILTIN_TOOL)
 
     minion.download(links=['https://get.videolan.org/vlc/2.2.6/macosx/vlc-2.2.6.dmg',
                            'https://get.videolan.org/vlc/2.2.6/macosx/vlc-2.2.6.dmg',
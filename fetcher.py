@@ -1,30 +1,65 @@
 """
-A Fetcher that is responsible of fetching (i.e. requesting) contents (e.g. M3U8, Key)
+A Fetcher that is responsible of fetching (i.e. requesting) contents (e.g. M3U8, Key,
+the media initialization sections of fMP4, which are kept as many fragments share each)
 from given URL
 """
 
 import sys
+import threading
+import time
 import logging
 import requests
+from collections import OrderedDict
+from typing import Dict, Optional, Tuple
 
 
 class Fetcher:
+    _VALIDATORS = 1024
+    _INITS = 64
+    # seconds to connect, and to wait for each read, so a stalled server cannot hang a job
+    _TIMEOUT = (10, 30)
 
     def __init__(self, fet_logger: logging.Logger) -> None:
         """
-        Welcoming the logger assigned
+        Welcoming the logger assigned and prepare a session,
+        whose connections are kept alive across requests
         :param fet_logger: the logger assigned
         """
         self._logger = fet_logger
+        self._session = requests.Session()
+        self._validators: OrderedDict[str, Dict[str, str]] = OrderedDict()
+        self._inits: OrderedDict[Tuple[str, Optional[Tuple]], bytes] = OrderedDict()
+        self._inits_lock = threading.Lock()
 
-    def fetch_m3u(self, m3u_url: str) -> bytes:
+    def fetch_m3u(self, m3u_url: str, conditional: bool = False) -> Optional[bytes]:
         """
-        Fetching the content of M3U8 and return it
+        Fetching the content of M3U8 and return it,
+        remembering its ETag and Last-Modified for the conditional fetches to come
         :param m3u_url: the URL to M3U8 file
-        :return: the content of M3U8 in bytes
+        :param conditional: whether to ask the server for the content only if it has changed
+        since the last fetch
+        :return: the content of M3U8 in bytes, None if it has not changed
         """
-        m3u_content = requests.get(url=m3u_url).content
-        self._logger.debug('M3U8 content: {}'.format(m3u_content))
+        validators = self._validators.get(m3u_url, {})
+        headers = {}
+        if conditional and validators.get('ETag'):
+            headers['If-None-Match'] = validators.get('ETag')
+        if conditional and validators.get('Last-Modified'):
+            headers['If-Modified-Since'] = validators.get('Last-Modified')
+
+        response = self._session.get(url=m3u_url, headers=headers, timeout=self._TIMEOUT)
+        if conditional and response.status_code == requests.codes.not_modified:
+            self._logger.debug('M3U8 not modified')
+            return None
+        response.raise_for_status()
+        self._validators[m3u_url] = {name: response.headers.get(name)
+                                     for name in ('ETag', 'Last-Modified')
+                                     if response.headers.get(name)}
+        self._validators.move_to_end(m3u_url)
+        while len(self._validators) > self._VALIDATORS:
+            self._validators.popitem(last=False)
+        m3u_content = response.content
+        self._logger.debug('M3U8 content: {} bytes'.format(len(m3u_content)))
         return m3u_content
 
     def fetch_key(self, key_url: str=None) -> bytes:
@@ -34,10 +69,78 @@ class Fetcher:
         :return: the content of key in bytes
         """
         self._logger.debug('Key URL: {}'.format(key_url))
-        key_content = requests.get(url=key_url).content if key_url else None
+        if not key_url:
+            return None
+        response = self._session.get(url=key_url, timeout=self._TIMEOUT)
+        response.raise_for_status()
+        key_content = response.content
         self._logger.debug('Key content: {}'.format(key_content))
         return key_content
 
+    def fetch_init(self, init_url: str, byterange: Tuple[int, int] = None) -> bytes:
+        """
+        Fetching a media initialization section given by #EXT-X-MAP, once per URI and byte range,
+        the latest ones being kept for the jobs to come
+        :param init_url: the URL to the section
+        :param byterange: the (length, offset) of the section in the resource, None if all of it
+        :return: the content of the section in bytes
+        """
+        with self._inits_lock:
+            init_content = self._inits.get((init_url, byterange))
+            if init_content is not None:
+                self._inits.move_to_end((init_url, byterange))
+                return init_content
+
+        headers = {'Range': 'bytes={}-{}'.format(byterange[1], sum(byterange) - 1)} \
+            if byterange else {}
+        response = self._session.get(url=init_url, headers=headers, timeout=self._TIMEOUT)
+        response.raise_for_status()
+        init_content = response.content
+        if byterange and response.status_code != requests.codes.partial_content:
+            init_content = init_content[byterange[1]:sum(byterange)]
+        with self._inits_lock:
+            self._inits[(init_url, byterange)] = init_content
+            while len(self._inits) > self._INITS:
+                self._inits.popitem(last=False)
+        self._logger.debug('Init section {}: {} bytes'.format(init_url, len(init_content)))
+        return init_content
+
+    def size(self, url: str) -> Optional[int]:
+        """
+        Learning the size of the content of the URL without downloading it: from a HEAD request,
+        or from a Range request of its first byte if the server does not answer HEAD
+        :param url: the URL to size
+        :return: the size of the content in bytes, None if the server does not tell
+        """
+        response = self._session.head(url=url, allow_redirects=True, timeout=self._TIMEOUT)
+        length = response.headers.get('Content-Length')
+        if response.ok and length and 'Content-Encoding' not in response.headers:
+            return int(length)
+
+        with self._session.get(url=url, headers={'Range': 'bytes=0-0'}, stream=True,
+                               timeout=self._TIMEOUT) as response:
+            response.raise_for_status()
+            total = response.headers.get('Content-Range', '').rpartition('/')[2]
+            length = response.headers.get('Content-Length')
+        if response.status_code == requests.codes.partial_content and total.isdigit():
+            return int(total)
+        # a server ignoring Range answers with all of it
+        return int(length) if response.status_code == requests.codes.ok and length else None
+
+    def probe(self, url: str) -> Tuple[int, float]:
+        """
+        Downloading the content of the URL, e.g. a fragment, to measure the throughput
+        :param url: the URL to probe
+        :return: the size of the content in bytes and the seconds taken to download it
+        """
+        start = time.perf_counter()
+        response = self._session.get(url=url, timeout=self._TIMEOUT)
+        response.raise_for_status()
+        seconds = time.perf_counter() - start
+        self._logger.debug('Probed {}: {} bytes in {:.3f}s'.format(
+            url, len(response.content), seconds))
+        return len(response.content), seconds
+
 
 # Demo
 if __name__ == '__main__':
@@ -0,0 +1,150 @@
+"""
+Journal is responsible of recording which fragments of a job are completely downloaded,
+so that an interrupted job can be resumed by fetching only the missing or corrupt ones.
+The journal is a small binary file: a header identifying the playlist followed by one
+fixed-size record (index, byte length, CRC32, decrypted) per fragment, each appended in a single
+write. A fragment decrypted in place is recorded again, the record last valid on disk is kept
+"""
+
+import logging
+import os
+import struct
+import sys
+import threading
+import zlib
+from typing import List, Set, Tuple
+
+
+class Journal:
+    _MAGIC = b'M3UJ'
+    _VERSION = 2
+    _HEADER = struct.Struct('<4sII')
+    _RECORD = struct.Struct('<IQI?')
+    _CHUNK_SIZE = 1024 * 1024
+
+    def __init__(self, jou_logger: logging.Logger, path: str) -> None:
+        """
+        Welcoming the logger assigned and create a place holder for the journal file
+        :param jou_logger: the logger assigned
+        :param path: the path to the journal file
+        """
+        self._logger = jou_logger
+        self._path = path
+        self._fd = None
+        self._decrypted = set()  # type: Set[int]
+        self._lock = threading.Lock()
+
+    def start(self, links: List[str], segment_files: List[str], resume: bool = False) -> Set[int]:
+        """
+        Starting the journal of a job, if resuming, the fragments recorded are validated
+        against the disk and only the valid records are kept
+        :param links: the links of all fragments, identifying the job
+        :param segment_files: the path of each fragment on disk, in order
+        :param resume: whether to resume from the existing journal
+        :return: the positions of the fragments already downloaded and valid
+        """
+        fingerprint = zlib.crc32('\n'.join(links).encode())
+        valid = {}
+        if resume:
+            for index, length, checksum, decrypted in self._load(fingerprint=fingerprint):
+                if index < len(segment_files) \
+                        and self.checksum(path=segment_files[index]) == (length, checksum):
+                    valid[index] = (length, checksum, decrypted)
+            self._logger.debug('Fragments resumed: {}/{}'.format(len(valid), len(links)))
+        self._decrypted = {index for index, record in valid.items() if record[2]}
+
+        tmp_path = self._path + '.tmp'
+        os.makedirs(os.path.dirname(self._path) or '.', exist_ok=True)
+        with open(tmp_path, 'wb') as tmp_file:
+            tmp_file.write(self._HEADER.pack(self._MAGIC, self._VERSION, fingerprint))
+            for index, (length, checksum, decrypted) in sorted(valid.items()):
+                tmp_file.write(self._RECORD.pack(index, length, checksum, decrypted))
+        os.replace(tmp_path, self._path)
+        self._fd = os.open(self._path, os.O_WRONLY | os.O_APPEND)
+        return set(valid)
+
+    def decrypted(self) -> Set[int]:
+        """
+        :return: the positions of the fragments resumed which are already decrypted in place
+        """
+        return self._decrypted
+
+    def _load(self, fingerprint: int) -> List[Tuple[int, int, int, bool]]:
+        """
+        Loading the records of the existing journal, a torn record at the end is ignored
+        :param fingerprint: the fingerprint of the job to resume
+        :return: the (index, length, checksum, decrypted) of each fragment recorded
+        """
+        try:
+            with open(self._path, 'rb') as journal_file:
+                content = journal_file.read()
+        except FileNotFoundError:
+            self._logger.warning('No journal to resume from: {}'.format(self._path))
+            return []
+
+        if len(content) < self._HEADER.size \
+                or self._HEADER.unpack_from(content) != (self._MAGIC, self._VERSION, fingerprint):
+            self._logger.warning('Journal does not match the playlist: {}'.format(self._path))
+            return []
+
+        end = len(content) - (len(content) - self._HEADER.size) % self._RECORD.size
+        return list(self._RECORD.iter_unpack(content[self._HEADER.size:end]))
+
+    def record(self, index: int, length: int, checksum: int, decrypted: bool = False) -> None:
+        """
+        Recording a completely downloaded fragment
+        :param index: the position of the fragment in M3U8
+        :param length: the length of the fragment in bytes
+        :param checksum: the CRC32 of the fragment
+        :param decrypted: whether the fragment is decrypted in place since downloaded
+        """
+        with self._lock:
+            os.write(self._fd, self._RECORD.pack(index, length, checksum, decrypted))
+
+    def record_file(self, index: int, path: str, decrypted: bool = False) -> None:
+        """
+        Recording a completely downloaded fragment by reading it back from disk
+        :param index: the position of the fragment in M3U8
+        :param path: the path to the fragment
+        :param decrypted: whether the fragment is decrypted in place since downloaded
+        """
+        length, checksum = self.checksum(path=path)
+        if length >= 0:
+            self.record(index=index, length=length, checksum=checksum, decrypted=decrypted)
+
+    @classmethod
+    def checksum(cls, path: str) -> Tuple[int, int]:
+        """
+        Measuring the length and CRC32 of a file
+        :param path: the path to the file
+        :return: the length and CRC32 of the file, (-1, 0) if it cannot be read
+        """
+        length, checksum = 0, 0
+        try:
+            with open(path, 'rb') as in_file:
+                for chunk in iter(lambda: in_file.read(cls._CHUNK_SIZE), b''):
+                    length, checksum = length + len(chunk), zlib.crc32(chunk, checksum)
+        except OSError:
+            return -1, 0
+        return length, checksum
+
+    def remove(self) -> None:
+        """
+        Closing and removing the journal once the job is done
+        """
+        if self._fd is not None:
+            os.close(self._fd)
+            self._fd = None
+        if os.path.exists(self._path):
+            os.remove(self._path)
+
+
+# Demo
+if __name__ == '__main__':
+    logger = logging.getLogger(__name__)
+    logger.setLevel(logging.DEBUG)
+    logger.addHandler(logging.StreamHandler(sys.stdout))
+
+    minion = Journal(logger, path='out.journal')
+    print(minion.start(links=['01.ts', '02.ts'], segment_files=['01.ts', '02.ts'], resume=True))
+    minion.record_file(index=0, path='01.ts')
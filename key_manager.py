@@ -0,0 +1,147 @@
+"""
+KeyManager is responsible of providing the key bytes of each key URI in M3U8:
+1. the keys are kept in an LRU cache,
+2. concurrent requests for the same key share one fetch,
+3. a key failing to fetch fails the requests for it during a while, without fetching again, and
+4. once a key is used, the key of the next rotation is fetched in the background.
+One manager may serve many jobs, the rotations of the latest ones are remembered
+"""
+
+import logging
+import sys
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import Future
+from typing import Dict, List, Optional, Tuple
+
+import requests
+
+from .fetcher import Fetcher
+
+
+class KeyManager:
+    _ROTATIONS = 4096
+    _RETRY_AFTER = 60
+
+    def __init__(self, key_logger: logging.Logger, fetcher: Fetcher, capacity: int = 16) -> None:
+        """
+        Welcoming the logger assigned and the minion fetching the keys, and prepare the cache
+        :param key_logger: the logger assigned
+        :param fetcher: the minion fetching the keys
+        :param capacity: the max number of keys kept in the cache
+        """
+        self._logger = key_logger
+        self._fetcher = fetcher
+        self._capacity = capacity
+        self._cache: OrderedDict[str, bytes] = OrderedDict()
+        self._in_flight: Dict[str, Future] = {}
+        self._next_uris: OrderedDict[str, str] = OrderedDict()
+        self._failed: OrderedDict[str, Tuple[float, Future]] = OrderedDict()
+        self._lock = threading.Lock()
+
+    def schedule(self, uris: List[str]) -> None:
+        """
+        Learning the order in which the keys rotate
+        :param uris: the key URI of each segment in order, None for segments not encrypted
+        """
+        rotation = list(OrderedDict.fromkeys(uri for uri in uris if uri))
+        with self._lock:
+            self._next_uris.update(zip(rotation, rotation[1:]))
+            while len(self._next_uris) > self._ROTATIONS:
+                self._next_uris.popitem(last=False)
+        self._logger.debug('Key rotations scheduled: {}'.format(len(rotation)))
+
+    def get(self, uri: str) -> Optional[bytes]:
+        """
+        Getting the key bytes of the URI, waiting for the fetch if not cached,
+        and prefetching the key of the next rotation
+        :param uri: the key URI
+        :return: the key bytes, None if the key cannot be fetched
+        """
+        with self._lock:
+            key_bytes = self._cache.get(uri)
+            if key_bytes is not None:
+                self._cache.move_to_end(uri)
+        if key_bytes is None:
+            try:
+                key_bytes = self._acquire(uri=uri, background=False).result()
+            except requests.RequestException:
+                # logged once by the fetch, whoever waited for it is told the same way
+                return None
+
+        next_uri = self._next_uris.get(uri)
+        if next_uri:
+            self.prefetch(uri=next_uri)
+        return key_bytes
+
+    def prefetch(self, uri: str) -> None:
+        """
+        Fetching the key in the background if it is neither cached nor being fetched
+        :param uri: the key URI
+        """
+        self._acquire(uri=uri, background=True)
+
+    def _acquire(self, uri: str, background: bool) -> Future:
+        """
+        Joining the fetch of the key in flight, or starting one
+        :param uri: the key URI
+        :param background: whether to fetch in a background thread rather than this one
+        :return: the future of the key bytes
+        """
+        with self._lock:
+            if uri in self._cache:
+                future = Future()
+                future.set_result(self._cache[uri])
+                return future
+            future = self._in_flight.get(uri)
+            if future:
+                return future
+            retry_at, future = self._failed.get(uri, (0.0, None))
+            if future and time.monotonic() < retry_at:
+                return future
+            future = self._in_flight[uri] = Future()
+
+        if background:
+            threading.Thread(target=self._fetch, args=(uri, future), daemon=True).start()
+        else:
+            self._fetch(uri=uri, future=future)
+        return future
+
+    def _fetch(self, uri: str, future: Future) -> None:
+        """
+        Fetching the key, caching it and resolving the future of whoever waits for it
+        :param uri: the key URI
+        :param future: the future of the key bytes
+        """
+        try:
+            key_bytes = self._fetcher.fetch_key(key_url=uri)
+        except Exception as err:
+            self._logger.error('Failed to fetch key {}: {}'.format(uri, err))
+            future.set_exception(err)
+            with self._lock:
+                del self._in_flight[uri]
+                self._failed[uri] = (time.monotonic() + self._RETRY_AFTER, future)
+                self._failed.move_to_end(uri)
+                while len(self._failed) > self._capacity:
+                    self._failed.popitem(last=False)
+            return
+
+        with self._lock:
+            self._cache[uri] = key_bytes
+            while len(self._cache) > self._capacity:
+                self._cache.popitem(last=False)
+            del self._in_flight[uri]
+            self._failed.pop(uri, None)
+        future.set_result(key_bytes)
+
+
+# Demo
+if __name__ == '__main__':
+    logger = logging.getLogger(__name__)
+    logger.setLevel(logging.DEBUG)
+    logger.addHandler(logging.StreamHandler(sys.stdout))
+
+    minion = KeyManager(logger, fetcher=Fetcher(logger))
+    minion.schedule(uris=['http://sample.key', 'http://sample.key', 'http://sample2.key'])
+    print(minion.get(uri='http://sample.key'))
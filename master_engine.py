@@ -5,29 +5,60 @@ concatenate them
 """
 
 import logging
+import os
 import re
-import subprocess as sp
+import requests
 import sys
+import threading
 from argparse import Namespace
 from logging import Logger
-from typing import List, Dict
+from typing import Any, List, Dict, Optional, Set, Tuple
+from urllib.parse import urljoin
 
 from .allocator import Allocator
+from .assembler import Assembler
+from .cache import SegmentCache
+from .controller import Controller
 from .decrypter import Decrypter
 from .downloader import Downloader
 from .fetcher import Fetcher
+from .journal import Journal
+from .key_manager import KeyManager
+from .metrics import Metrics
+from .mirrors import Mirrors
 from .parser import Parser
+from .planner import Planner
+from .playlist import InitSection, Key, Segment
+from .recorder import Recorder
+from .scheduler import Scheduler
+from .selector import Selector
+from .validator import Validator
 
 
 class MasterEngine:
 
-    def __init__(self) -> None:
+    def __init__(self, scheduler: Scheduler = None, fetcher: Fetcher = None,
+                 key_manager: KeyManager = None, session: requests.Session = None) -> None:
         """
         Prepare the minions, the dictionary for the content of M3U8 and an indicator of encryption
+        :param scheduler: if given, the fragments are downloaded on the connections it shares
+        among the jobs of a batch
+        :param fetcher: if given, the playlists and keys are fetched by this minion shared
+        among jobs, whose connections are kept alive
+        :param key_manager: if given, the keys are cached by this minion shared among jobs
+        :param session: if given, the fragments are downloaded over this session shared
+        among jobs, whose connections are kept alive
         """
-        self._prepare_minions()
+        self._prepare_minions(scheduler=scheduler, fetcher=fetcher, key_manager=key_manager,
+                              session=session)
         self._m3u_dict = {}
-        self._encrypted = False
+        self._encrypted = self._dec_segments = self._validates = False
+        self._fmp4 = self._trimmed = False
+        self._cancelled = threading.Event()
+        self._scheduler, self._session = scheduler, session
+        self._clip_start = 0.0
+        self._rendition_jobs = []  # type: List[Dict[str, Any]]
+        self._abort_reason = None  # type: Optional[str]
 
     @staticmethod
     def _prepare_logger() -> Logger:
@@ -36,127 +67,810 @@ class MasterEngine:
         :return: logger
         """
         logger = logging.getLogger(__name__)
-        logger.addHandler(logging.StreamHandler(sys.stdout))
+        if not logger.handlers:
+            logger.addHandler(logging.StreamHandler(sys.stdout))
         return logger
 
-    def _prepare_minions(self) -> None:
+    def _prepare_minions(self, scheduler: Scheduler = None, fetcher: Fetcher = None,
+                         key_manager: KeyManager = None, session: requests.Session = None) -> None:
         """
         Call out the minions and send logger minion to monitor
+        :param scheduler: the scheduler shared among jobs, if any
+        :param fetcher: the fetcher shared among jobs, if any
+        :param key_manager: the key manager shared among jobs, if any
+        :param session: the download session shared among jobs, if any
         """
         self._log_minion = self._prepare_logger()
         self._par_minion = Parser(par_logger=self._log_minion)
-        self._fet_minion = Fetcher(fet_logger=self._log_minion)
-        self._dow_minion = Downloader(dow_logger=self._log_minion)
+        self._fet_minion = fetcher or Fetcher(fet_logger=self._log_minion)
+        self._met_minion = Metrics(met_logger=self._log_minion)
+        self._dow_minion = Downloader(dow_logger=self._log_minion, scheduler=scheduler,
+                                      metrics=self._met_minion, session=session)
         self._dec_minion = Decrypter(dec_logger=self._log_minion)
         self._alc_minion = Allocator(alc_logger=self._log_minion)
+        self._key_minion = key_manager or KeyManager(key_logger=self._log_minion,
+                                                     fetcher=self._fet_minion)
+        self._sel_minion = Selector(sel_logger=self._log_minion,
+                                    fetcher=self._fet_minion, parser=self._par_minion)
+        self._rec_minion = Recorder(rec_logger=self._log_minion,
+                                    fetcher=self._fet_minion, parser=self._par_minion)
+        self._val_minion = Validator(val_logger=self._log_minion)
+        self._pla_minion = Planner(pla_logger=self._log_minion, fetcher=self._fet_minion)
+        self._cac_minion = self._mir_minion = None
 
-    def assist(self) -> None:
+    def assist(self, argv: List[str] = None) -> None:
         """
         Parses M3U, downloads all files and convert to one playable MP4 file
+        :param argv: the command line arguments, those of the process if None
+        """
+        args = self._par_minion.parse_args(argv=argv)
+        self._met_minion.set_profile_dir(profile_dir=args.profile)
+        if args.metrics:
+            self._met_minion.start_exporting(path=args.metrics, fmt=args.metrics_format,
+                                             interval=args.metrics_interval)
+        try:
+            self._assist(args=args)
+        finally:
+            self._stop_renditions()
+            if self._cac_minion:
+                self._cac_minion.report()
+            if self._mir_minion:
+                self._mir_minion.summarize()
+            if args.metrics:
+                self._met_minion.stop_exporting(path=args.metrics, fmt=args.metrics_format)
+
+    def progress(self) -> Tuple[int, int]:
+        """
+        :return: the number of fragments finished and to download in the current download
+        """
+        return self._dow_minion.progress()
+
+    def abort_reason(self) -> Optional[str]:
+        """
+        :return: why the job aborted, recorded by the engine or the minion that called exit(),
+        or None if it did not abort
+        """
+        if self._abort_reason:
+            return self._abort_reason
+        for minion in (self._alc_minion, self._dec_minion, self._dow_minion, self._pla_minion,
+                       self._sel_minion):
+            if minion.abort_reason:
+                return minion.abort_reason
+        return None
+
+    def cancel(self) -> None:
+        """
+        Cancelling the job from another thread: the fragments not started yet are given up
+        and the job aborts before its next stage
+        """
+        self._cancelled.set()
+        self._dow_minion.cancel()
+        for job in self._rendition_jobs:
+            job['engine'].cancel()
+
+    def close(self) -> None:
+        """
+        Releasing the threads of the job once it is over, for processes running job after job
+        """
+        self._dec_minion.close()
+        for job in self._rendition_jobs:
+            job['engine'].close()
+
+    def _check_cancelled(self) -> None:
+        """
+        Aborting the job if it has been cancelled
+        """
+        if self._cancelled.is_set():
+            self._abort(reason='Job cancelled', code=1)
+
+    def _abort(self, reason: str, code: int) -> None:
+        """
+        Recording why the job aborts, so that callers need not parse the log, then exiting
+        :param reason: why the job aborts
+        :param code: the exit code
+        """
+        self._abort_reason = reason
+        self._log_minion.error('abort: {}'.format(reason))
+        exit(code)
+
+    def _assist(self, args: Namespace) -> None:
+        """
+        Running the job the args describe, stage by stage
+        :param args: args parsed
         """
-        args = self._par_minion.parse_args()
         m3u_url = args.m3u_url[0]
-        m3u_prefix = args.m3u_prefix[0]
         out_file = args.output_name
         out_dir = re.match("(.*)/(.*).mp4", out_file).group(1)
 
-        self._m3u_dict = self._parse_m3u(m3u_url=m3u_url)
-        key_bytes = self._parse_key(prefix=m3u_prefix,
-                                    key_uri=self._m3u_dict.get('enc').get('uri').strip('"'))
+        # the prefix is prepended to the URIs in M3U8, so it is a directory even without a '/'
+        m3u_prefix = args.m3u_prefix[0] if args.m3u_prefix else None
+        if m3u_prefix and not m3u_prefix.endswith('/'):
+            m3u_prefix += '/'
+
+        self._m3u_dict = self._parse_m3u(m3u_url=m3u_url, prefix=m3u_prefix)
+        renditions = []
+        if self._m3u_dict.get('variants'):
+            with self._met_minion.stage(name='select'):
+                m3u_url, self._m3u_dict, renditions = self._select_variant(
+                    master_url=m3u_url, prefix=m3u_prefix, args=args)
+        if args.start is not None or args.end is not None:
+            self._clip(start=args.start or 0.0, end=args.end, live=args.live)
+        with self._met_minion.stage(name='key'):
+            key_bytes = self._parse_key()
         self._check_tools(args=args)
-        self._download(prefix=m3u_prefix, out_dir=out_dir)
-        self._finish_up(out_dir=out_dir, final_name=out_file, key_bytes=key_bytes)
+        if args.mirrors:
+            self._set_mirrors(base=urljoin(m3u_prefix or m3u_url, '.'), mirrors=args.mirrors,
+                              split=args.split_mirrors)
+        if renditions and args.live:
+            self._log_minion.warning('Renditions are not recorded live, only the variant is')
+        elif renditions:
+            self._start_renditions(renditions=renditions, args=args, out_dir=out_dir)
+        if args.live:
+            with self._met_minion.stage(name='record'):
+                self._record(m3u_url=m3u_url, prefix=m3u_prefix, out_dir=out_dir,
+                             final_name=out_file, max_duration=args.max_duration,
+                             window=args.window)
+            self._convert(dec_name=out_file[:-3] + 'ts', final_name=out_file)
+            return
+        if args.pipeline and renditions:
+            self._log_minion.warning('Renditions are muxed in from files, the pipeline is off')
+        elif args.pipeline:
+            if args.resume:
+                self._log_minion.warning('Pipeline keeps no fragments on disk, nothing to resume')
+            with self._met_minion.stage(name='pipeline'):
+                self._pipeline(out_dir=out_dir, final_name=out_file,
+                               key_bytes=key_bytes, window=args.window, plan=args.plan)
+            return
+        journal = Journal(jou_logger=self._log_minion, path='{}.journal'.format(out_file[:-4]))
+        with self._met_minion.stage(name='download'):
+            self._download(out_dir=out_dir, journal=journal, resume=args.resume,
+                           copies=self._copies(args=args) if args.plan else 0)
+        self._finish_up(out_dir=out_dir, final_name=out_file, key_bytes=key_bytes,
+                        remove_inputs=args.remove_fragments, journal=journal)
+        journal.remove()
 
-    def _parse_m3u(self, m3u_url: str) -> Dict[str, List[str]]:
+    def _parse_m3u(self, m3u_url: str, prefix: str = None) -> Dict[str, Any]:
         """
         Scrape, parse and store the content of M3U file indicated by the m3u_url into a dictionary
         detect if it is encrypted
         :param m3u_url: the url to the m3u file
+        :param prefix: the prefix of URIs in M3U8, the m3u_url if None
         :return: the content of M3U file in a Dictionary
         """
-        m3u_bytes = self._fet_minion.fetch_m3u(m3u_url=m3u_url)
-        m3u_dict = self._par_minion.parse_m3u(contents_bytes=m3u_bytes)
-        self._encrypted = m3u_dict.get('enc') is not None
+        with self._met_minion.stage(name='fetch'):
+            m3u_bytes = self._fet_minion.fetch_m3u(m3u_url=m3u_url)
+        with self._met_minion.stage(name='parse'):
+            m3u_dict = self._par_minion.parse_m3u(contents_bytes=m3u_bytes,
+                                                  m3u_url=prefix or m3u_url)
+        self._encrypted = self._first_key(m3u_dict=m3u_dict) is not None
 
-        self._log_minion.debug('M3U parsed: {}'.format(m3u_dict))
         self._log_minion.debug("M3U8 content Encrypted: {}".format(self._encrypted))
         return m3u_dict
 
-    def _parse_key(self, prefix: str, key_uri: str) -> bytes:
+    def _select_variant(self, master_url: str, prefix: str,
+                        args: Namespace) -> Tuple[str, Dict[str, Any], List[Dict[str, Any]]]:
+        """
+        Selecting a variant stream of the master playlist as the args indicate
+        :param master_url: the url to the master playlist
+        :param prefix: the prefix of URIs in the variant M3U8, its own url if None
+        :param args: args parsed, may contain the criteria of selection
+        :return: the url to the playlist of the variant selected, its content in a Dictionary
+        and the alternate renditions selected along with it
+        """
+        m3u_url, variant, m3u_dict = self._sel_minion.select(
+            master_url=master_url, variants=self._m3u_dict.get('variants'),
+            by=args.variant_by, codec=args.codec, max_bandwidth=args.max_bandwidth,
+            base_url=prefix)
+        renditions = self._sel_minion.renditions(
+            master_url=master_url, variant=variant, renditions=self._m3u_dict.get('renditions'),
+            pick=args.renditions, languages=args.languages)
+        self._encrypted = self._first_key(m3u_dict=m3u_dict) is not None
+
+        self._log_minion.debug('Variant M3U selected: {}'.format(m3u_url))
+        return m3u_url, m3u_dict, renditions
+
+    def _start_renditions(self, renditions: List[Dict[str, Any]], args: Namespace,
+                          out_dir: str) -> None:
+        """
+        Starting a job for each alternate rendition, run by an engine of its own sharing
+        the minions of this one, so that the renditions download while the variant does
+        :param renditions: the renditions selected
+        :param args: args parsed, applied to the renditions too
+        :param out_dir: the output directory, each rendition gets a directory of its own in it
+        """
+        for position, rendition in enumerate(renditions):
+            job = {'rendition': rendition, 'result': None,
+                   'engine': MasterEngine(scheduler=self._scheduler, fetcher=self._fet_minion,
+                                          key_manager=self._key_minion, session=self._session)}
+            # WebVTT fragments are not MPEG-TS
+            rendition_args = Namespace(**dict(vars(args), validate=args.validate
+                                              and rendition['type'] != 'SUBTITLES'))
+            rendition_dir = os.path.join(out_dir, '{}_{}'.format(rendition['type'].lower(),
+                                                                 position))
+            job['thread'] = threading.Thread(target=self._run_rendition, daemon=True,
+                                             args=(job, rendition_args, rendition_dir))
+            job['thread'].start()
+            self._rendition_jobs.append(job)
+
+    def _run_rendition(self, job: Dict[str, Any], args: Namespace, out_dir: str) -> None:
+        """
+        Running the job of an alternate rendition, keeping its result in the job
+        :param job: the rendition, its engine and where to keep the result
+        :param args: args parsed for the rendition
+        :param out_dir: the output directory of the rendition
+        """
+        rendition = job['rendition']
+        try:
+            job['result'] = job['engine']._assist_rendition(
+                m3u_url=rendition['uri'], args=args, out_dir=out_dir,
+                subtitles=rendition['type'] == 'SUBTITLES')
+        except SystemExit:
+            pass
+        except Exception as err:
+            self._log_minion.error('Rendition {} failed: {}'.format(rendition['name'], err))
+
+    def _assist_rendition(self, m3u_url: str, args: Namespace, out_dir: str,
+                          subtitles: bool = False) -> Tuple[str, float]:
+        """
+        Running the job of an alternate rendition up to the conversion,
+        which muxes it in along with the variant
+        :param m3u_url: the url to the media playlist of the rendition
+        :param args: args parsed for the rendition
+        :param out_dir: the output directory of the rendition
+        :param subtitles: whether the rendition is made of WebVTT fragments
+        :return: the path to the file of the rendition and the seconds its first fragment starts at
+        """
+        self._m3u_dict = self._parse_m3u(m3u_url=m3u_url)
+        if args.start is not None or args.end is not None:
+            self._clip(start=args.start or 0.0, end=args.end)
+        with self._met_minion.stage(name='key'):
+            key_bytes = self._parse_key()
+        self._check_tools(args=args)
+        final_name = os.path.join(out_dir, 'rendition.mp4')
+        journal = Journal(jou_logger=self._log_minion, path='{}.journal'.format(final_name[:-4]))
+        with self._met_minion.stage(name='download'):
+            self._download(out_dir=out_dir, journal=journal, resume=args.resume,
+                           copies=self._copies(args=args, convert=False) if args.plan else 0)
+        if subtitles:
+            if self._encrypted and self._dec_segments:
+                self._decrypt_segments(out_dir=out_dir, journal=journal)
+            path = '{}.vtt'.format(final_name[:-4])
+            with self._met_minion.stage(name='concatenate'):
+                self._alc_minion.merge_subtitles(input_files=self._segment_files(out_dir=out_dir),
+                                                 merged_name=path)
+        else:
+            path = self._finish_up(out_dir=out_dir, final_name=final_name, key_bytes=key_bytes,
+                                   remove_inputs=args.remove_fragments, convert=False,
+                                   journal=journal)
+        journal.remove()
+        return path, self._clip_start
+
+    def _join_renditions(self) -> List[Dict[str, Any]]:
+        """
+        Waiting for the jobs of the alternate renditions to finish
+        :return: the path to the file, the type and the seconds after the variant each rendition
+        starts at, for the conversion to mux them in
+        """
+        renditions = []
+        for job in self._rendition_jobs:
+            job['thread'].join()
+            rendition = job['rendition']
+            if job['result'] is None:
+                self._abort(reason='Rendition {} ({}) failed'.format(
+                    rendition['name'], rendition['type'].lower()), code=1)
+            path, start = job['result']
+            renditions.append({'path': path, 'type': rendition['type'],
+                               'offset': start - self._clip_start})
+        return renditions
+
+    def _stop_renditions(self) -> None:
+        """
+        Cancelling the jobs of the alternate renditions still running, e.g. once the job aborts,
+        and waiting for them to stop
+        """
+        for job in self._rendition_jobs:
+            if job['thread'].is_alive():
+                job['engine'].cancel()
+                job['thread'].join()
+
+    def _clip(self, start: float, end: float = None, live: bool = False) -> None:
         """
-        Parsing the key bytes from the URL (prefix+key_uri) and return it
-        :param prefix: prefix of key URL
-        :param key_uri: the suffix of key URL
+        Keeping only the fragments covering the clip, by the durations given by #EXTINF,
+        and having the conversion trim them to the clip exactly. Each fragment keeps its key
+        and media sequence number, so it is decrypted as it would be in the whole playlist
+        :param start: the seconds where the clip starts
+        :param end: the seconds where the clip ends, the end of the playlist if None
+        :param live: whether the playlist is recorded live, which cannot be clipped
+        """
+        if live:
+            self._abort(reason='--start/--end clip a VOD playlist, '
+                               '--max_duration limits a live recording', code=2)
+        if end is not None and end <= start:
+            self._abort(reason='The clip ends at {}s, before it starts at {}s'
+                               .format(end, start), code=2)
+        clip, elapsed, offset = [], 0.0, 0.0
+        for segment in self._m3u_dict.get('segments'):
+            if elapsed + segment.duration > start and (end is None or elapsed < end):
+                if not clip:
+                    offset = start - elapsed
+                clip.append(segment)
+            elapsed += segment.duration
+        if not clip:
+            self._abort(reason='The clip starts at {}s, beyond the {:.1f}s of M3U8'
+                               .format(start, elapsed), code=2)
+
+        self._m3u_dict = dict(self._m3u_dict, segments=clip)
+        self._clip_start = start - offset
+        self._trimmed = bool(offset) or end is not None
+        self._encrypted = self._first_key(m3u_dict=self._m3u_dict) is not None
+        self._alc_minion.set_trim(start=offset,
+                                  duration=None if end is None else end - start)
+        self._log_minion.debug('Clip covered by fragments {} to {}, trimmed from {:.3f}s'
+                               .format(clip[0].sequence, clip[-1].sequence, offset))
+
+    @staticmethod
+    def _first_key(m3u_dict: Dict[str, Any]) -> Optional[Key]:
+        """
+        Finding the key of the first encrypted segment
+        :param m3u_dict: the content of M3U file in a Dictionary
+        :return: the key, None if no segment is encrypted
+        """
+        return next((segment.key for segment in m3u_dict.get('segments') if segment.key), None)
+
+    def _parse_key(self) -> bytes:
+        """
+        Parsing the key bytes from the URL of the key in M3U8 and return it
         :return: decryption key in bytes if encryption is detected else None
         """
-        if self._encrypted and not self._m3u_dict.get('enc').get('uri'):
-            self._log_minion.error(
-                msg="abort: Files in M3U8 are encrypted but cannot access key uri")
-            exit(1)
+        key = self._first_key(m3u_dict=self._m3u_dict)
+        if not self._encrypted:
+            return None
+        if not key.uri:
+            self._abort(reason='Files in M3U8 are encrypted but cannot access key uri', code=1)
 
-        return self._fet_minion.fetch_key(key_url=prefix + key_uri) if self._encrypted else None
+        self._key_minion.schedule(uris=[segment.key.uri if segment.key else None
+                                        for segment in self._m3u_dict.get('segments')])
+        key_bytes = self._key_minion.get(uri=key.uri)
+        if key_bytes is None:
+            self._abort(reason="Cannot fetch the key {}".format(key.uri), code=1)
+        return key_bytes
 
     def _check_tools(self, args: Namespace) -> None:
         """
         Checking if all tools are available
         :param args: args parsed, may contain specified tools
         """
-        self._dow_minion.check_tool(tool=args.dow_tool[0] if args.dow_tool else 'aria2c')
-        self._alc_minion.check_tool(conversion_tool=args.cov_tool[0] if args.cov_tool else 'ffmpeg',
-                                    concatenation_tool=args.cat_tool[0] if args.cat_tool else 'cat')
-        if self._encrypted:
-            self._dec_minion.check_tool(tool=args.dec_method[0] if args.dec_tool else 'openssl')
+        controller = Controller(con_logger=self._log_minion, min_limit=args.min_inflight,
+                                max_limit=args.max_inflight) if args.adaptive else None
+        self._dow_minion.check_tool(tool=args.dow_tool if args.dow_tool else 'aria2c',
+                                    host_conns=args.host_conns, controller=controller)
+        self._dow_minion.set_retry_policy(retries=args.retries, timeout=args.timeout,
+                                          hedge=args.hedge)
+        self._dow_minion.set_coalesce_size(coalesce_size=args.coalesce_size * 1024 * 1024)
+        if args.cache_dir:
+            self._cac_minion = SegmentCache.shared(cac_logger=self._log_minion,
+                                                   cache_dir=os.path.expanduser(args.cache_dir),
+                                                   capacity=args.cache_size * 1024 * 1024)
+            self._dow_minion.set_cache(cache=self._cac_minion)
+        self._fmp4 = any(segment.init for segment in self._m3u_dict.get('segments'))
+        if args.validate and self._fmp4:
+            self._log_minion.warning('Fragments in M3U8 are not MPEG-TS, they are not validated')
+        elif args.validate:
+            self._dow_minion.set_validator(validator=self._validate)
+            self._validates = True
+        if args.dow_tool != Downloader.BUILTIN_TOOL and any(self._byteranges()):
+            self._abort(reason="Fragments in M3U8 are byte ranges, which only the builtin "
+                               "download tool supports", code=2)
+        self._alc_minion.check_tool(conversion_tool=args.cov_tool if args.cov_tool else 'ffmpeg',
+                                    concatenation_tool=args.cat_tool if args.cat_tool else 'cat')
+        if self._encrypted or (args.live and args.dec_tool == Decrypter.BUILTIN_TOOL):
+            self._dec_minion.check_tool(tool=args.dec_tool if args.dec_tool else 'openssl')
+            self._dec_segments = args.dec_tool == Decrypter.BUILTIN_TOOL
+            if args.live and not self._dec_segments:
+                self._abort(reason="Live M3U8 is encrypted, which only the builtin decryption "
+                                   "tool can record", code=2)
+            if not self._dec_segments and len({segment.key.uri for segment in
+                                               self._m3u_dict.get('segments') if segment.key}) > 1:
+                self._abort(reason="Keys rotate in M3U8, which only the builtin decryption tool "
+                                   "supports", code=2)
+            if not self._dec_segments and self._fmp4:
+                self._abort(reason="Fragments in M3U8 are fMP4 and encrypted, which only the "
+                                   "builtin decryption tool supports", code=2)
+
+    def _set_mirrors(self, base: str, mirrors: List[str], split: bool) -> None:
+        """
+        Routing the downloads of the fragments among their mirrors
+        :param base: the prefix of the fragments in M3U8
+        :param mirrors: the prefixes of the mirrors, resolved as the m3u_prefix is
+        :param split: whether to spread the fragments among the mirrors by their score
+        """
+        self._mir_minion = Mirrors(mir_logger=self._log_minion, base=base,
+                                   mirrors=[urljoin(mirror, '.') for mirror in mirrors],
+                                   split=split)
+        self._dow_minion.set_mirrors(mirrors=self._mir_minion)
 
-    def _download(self, prefix: str, out_dir: str = None) -> None:
+    def _download(self, out_dir: str = None, journal: Journal = None,
+                  resume: bool = False, copies: int = 0) -> None:
         """
-        Start downloading files indicated by (prefix + M3U8_URLs)
-        :param prefix: prefix of URLs in M3U8
+        Start downloading files indicated by M3U8_URLs
         :param out_dir: output directory
+        :param journal: the journal recording the files downloaded
+        :param resume: whether to skip the files the journal shows to be downloaded and intact
+        :param copies: if not 0, the fragments are sized first, the free space is checked for
+        as many copies of the video and the largest fragments are downloaded first
         :return:
         """
-        self._dow_minion.download(
-            links=[prefix + link for link in self._m3u_dict.get('links')],
-            out_dir=out_dir)
+        self._check_cancelled()
+        links = self._links()
+        done = journal.start(links=links,
+                             segment_files=self._segment_files(out_dir=out_dir),
+                             resume=resume) if journal else None
+        sizes = self._plan(out_dir=out_dir, copies=copies, done=done) if copies else None
+        failed = self._dow_minion.download(links=links, out_dir=out_dir, journal=journal,
+                                           done=done, byteranges=self._byteranges(),
+                                           sizes=sizes)
+        if failed:
+            self._abort(reason="{} fragments failed to download, run again with --resume to "
+                               "fetch only those".format(len(failed)), code=1)
+
+    def _plan(self, out_dir: str, copies: int, done: Set[int] = None) -> List[Optional[int]]:
+        """
+        Sizing the fragments before downloading them and aborting unless out_dir has room
+        for what the job keeps on disk at most, the fragments already downloaded aside
+        :param out_dir: output directory
+        :param copies: the max number of copies of the video the job keeps on disk at a time
+        :param done: the positions of the fragments already downloaded
+        :return: the size of each fragment, None if unknown
+        """
+        with self._met_minion.stage(name='plan'):
+            sizes = self._pla_minion.sizes(links=self._links(), byteranges=self._byteranges())
+        downloaded = sum(size or 0 for index, size in enumerate(sizes) if done and index in done)
+        self._pla_minion.check_space(path=out_dir,
+                                     required=Planner.total(sizes=sizes) * copies - downloaded)
+        return sizes
+
+    def _copies(self, args: Namespace, convert: bool = True) -> int:
+        """
+        Counting the copies of the video the job keeps on disk at most: the fragments, unless
+        removed as they are concatenated, the concatenated file, the file decrypted by an
+        external tool and the MP4
+        :param args: args parsed
+        :param convert: whether the job converts to MP4
+        :return: the number of copies
+        """
+        removed = args.remove_fragments and args.cat_tool == Allocator.BUILTIN_TOOL
+        return (not removed) + 1 + (self._encrypted and not self._dec_segments) + convert
+
+    def _pipeline(self, out_dir: str, final_name: str, key_bytes: bytes, window: int,
+                  plan: bool = False) -> None:
+        """
+        Downloading, decrypting and converting at the same time:
+        the fragments are assembled in order as they arrive and streamed through the
+        decryption tool into the conversion tool, so no stage waits for the previous one to end.
+        The only full-size file written is the MP4, which is removed if any stage fails:
+        once a tool exits early, the fragments not downloaded yet are given up
+        :param out_dir: output directory
+        :param final_name: the final MP4 name
+        :param key_bytes: the decryption key
+        :param window: the max number of fragments waiting for their turn in memory
+        :param plan: whether to size the fragments first and check the free space for the MP4,
+        they are still downloaded in order for the assembly
+        """
+        self._check_cancelled()
+        if plan:
+            self._plan(out_dir=out_dir, copies=1)
+        inits = self._fetch_inits(segments=self._m3u_dict.get('segments'))
+        # fMP4 fragments following their init section play as they are, no conversion needed
+        converter = None if self._fmp4 and not self._trimmed \
+            else self._alc_minion.open_converter(out_mp4=final_name)
+        decrypter = None
+        if self._encrypted and not self._dec_segments:
+            iv, encryption_method = self._decryption_params()
+            decrypter = self._dec_minion.open_stream(iv=iv, key_bytes=key_bytes,
+                                                     encryption_method=encryption_method,
+                                                     out_stream=converter.stdin)
+            converter.stdin.close()
+
+        if converter is None:
+            os.makedirs(out_dir, exist_ok=True)
+        sink = decrypter.stdin if decrypter else \
+            converter.stdin if converter else open(final_name, 'wb')
+        assembler = Assembler(asm_logger=self._log_minion, sink=sink, window=window)
+        undecrypted = set()
+
+        def on_segment(index: int, data: bytes) -> None:
+            key = self._m3u_dict.get('segments')[index].key
+            if self._dec_segments and key and data is not None:
+                try:
+                    data = self._dec_minion.decrypt_bytes(
+                        data=data, key_bytes=self._key_minion.get(uri=key.uri),
+                        iv=self._segment_iv(index=index))
+                except Exception as err:
+                    self._log_minion.error('Failed to decrypt segment {}: {}'.format(index, err))
+                    data = None
+                if data is None:
+                    undecrypted.add(index)
+            init = self._init_before(index=index)
+            if init and data is not None:
+                data = inits[(init.uri, init.byterange)] + data
+            assembler.put(index=index, data=data)
+            if assembler.error:
+                self._dow_minion.cancel()
+
+        failed = self._dow_minion.download(links=self._links(), out_dir=out_dir,
+                                           on_segment=on_segment, byteranges=self._byteranges())
+        self._log_minion.debug('Fragments assembled: {}'.format(assembler.close()))
+
+        dec_code = decrypter.wait() if decrypter else 0
+        cov_code = converter.wait() if converter else 0
+        failed |= undecrypted
+        if cov_code or dec_code or assembler.error or failed:
+            self._remove_output(final_name=final_name)
+            if cov_code:
+                reason = 'Conversion tool exited with {}'.format(cov_code)
+            elif dec_code:
+                reason = 'Decryption tool exited with {}'.format(dec_code)
+            elif assembler.error:
+                reason = 'Failed to stream the fragments: {}'.format(assembler.error)
+            else:
+                reason = '{} fragments failed to download or decrypt'.format(len(failed))
+            self._abort(reason='{}, {} is removed'.format(reason, final_name), code=1)
+        self._log_minion.debug('Alrighty!')
+
+    def _remove_output(self, final_name: str) -> None:
+        """
+        Removing what the conversion tool left of a failed output, so that it is not
+        mistaken for a complete video
+        :param final_name: the final MP4 name
+        """
+        if os.path.exists(final_name):
+            os.remove(final_name)
+            self._log_minion.debug('File removed: {}'.format(final_name))
+
+    def _record(self, m3u_url: str, prefix: str, out_dir: str, final_name: str,
+                max_duration: float = None, window: int = 16) -> None:
+        """
+        Recording a live playlist: the new fragments of each reload are downloaded, decrypted
+        and appended in order to a growing .ts file until the playlist ends
+        or the duration limit is reached
+        :param m3u_url: the url to the media playlist
+        :param prefix: the prefix of URIs in M3U8, the m3u_url if None
+        :param out_dir: output directory
+        :param final_name: the final MP4 name
+        :param max_duration: the max number of seconds to record, until the playlist ends if None
+        :param window: the max number of fragments waiting for their turn in memory
+        """
+        recorded_name = final_name[:-3] + 'ts'
+        first_dict, self._m3u_dict = self._m3u_dict, dict(self._m3u_dict, segments=[])
+        segments = self._m3u_dict.get('segments')
+        os.makedirs(out_dir, exist_ok=True)
+        inits = {}
+
+        with open(recorded_name, 'wb') as recorded_file:
+            assembler = Assembler(asm_logger=self._log_minion, sink=recorded_file, window=window)
+
+            def on_segment(index: int, data: bytes) -> None:
+                key = segments[index].key
+                if key and data is not None:
+                    data = self._decrypt_live(index=index, data=data)
+                init = self._init_before(index=index)
+                if init and data is not None:
+                    data = inits[(init.uri, init.byterange)] + data
+                assembler.put(index=index, data=data)
+
+            for batch in self._rec_minion.record(m3u_url=m3u_url, m3u_dict=first_dict,
+                                                 base_url=prefix, max_duration=max_duration):
+                if self._cancelled.is_set():
+                    break
+                offset = len(segments)
+                segments.extend(batch)
+                inits.update(self._fetch_inits(segments=batch))
+                if self._validates:
+                    self._dow_minion.set_validator(
+                        validator=lambda index, data, first=offset: self._validate(
+                            index=first + index, data=data))
+                self._key_minion.schedule(uris=[segment.key.uri if segment.key else None
+                                                for segment in segments])
+                self._dow_minion.download(
+                    links=[segment.uri for segment in batch], out_dir=out_dir,
+                    on_segment=lambda index, data: on_segment(index=offset + index, data=data),
+                    byteranges=[segment.byterange for segment in batch])
+            self._log_minion.debug('Fragments recorded: {}'.format(assembler.close()))
+        if assembler.error:
+            self._abort(reason='Failed to record {}: {}'.format(recorded_name, assembler.error),
+                        code=1)
+        self._check_cancelled()
+
+    def _decrypt_live(self, index: int, data: bytes) -> Optional[bytes]:
+        """
+        Decrypting a recorded fragment with its own key and initial vector
+        :param index: the position of the fragment in the recording
+        :param data: the encrypted content of the fragment
+        :return: the decrypted content, None if it cannot be decrypted
+        """
+        if not self._dec_segments:
+            self._log_minion.error('Segment {} is encrypted, which only the builtin decryption '
+                                   'tool can record live'.format(index))
+            return None
+        try:
+            return self._dec_minion.decrypt_bytes(
+                data=data, key_bytes=self._key_minion.get(
+                    uri=self._m3u_dict.get('segments')[index].key.uri),
+                iv=self._segment_iv(index=index))
+        except Exception as err:
+            self._log_minion.error('Failed to decrypt segment {}: {}'.format(index, err))
+            return None
 
-    def _finish_up(self, out_dir: str, final_name: str, key_bytes: bytes) -> None:
+    def _finish_up(self, out_dir: str, final_name: str, key_bytes: bytes,
+                   remove_inputs: bool = False, convert: bool = True,
+                   journal: Journal = None) -> str:
         """
         Finish up by combining the files, decrypting and converting to MP4
         :param out_dir: the output directory
         :param final_name: the final MP4 name
         :param key_bytes: the decryption key
+        :param remove_inputs: whether to remove each .ts file once it is concatenated
+        :param convert: whether to convert, or to stop at the decrypted .ts file
+        :param journal: the journal recording the files downloaded, and decrypted in place
+        :return: the name of the decrypted .ts file
+        """
+        self._check_cancelled()
+        if self._encrypted and self._dec_segments:
+            with self._met_minion.stage(name='decrypt'):
+                self._decrypt_segments(out_dir=out_dir, journal=journal)
+        downloaded_files = self._segment_files(out_dir=out_dir)
+        if self._fmp4:
+            downloaded_files = self._with_inits(files=downloaded_files, out_dir=out_dir)
+        with self._met_minion.stage(name='concatenate'):
+            concatenated_name = self._concatenate(in_names=downloaded_files,
+                                                  final_name=final_name,
+                                                  remove_inputs=remove_inputs)
+        with self._met_minion.stage(name='decrypt'):
+            decrypted_name = self._decrypt(cat_name=concatenated_name,
+                                           key_bytes=key_bytes,
+                                           final_name=final_name)
+
+        if convert:
+            self._convert(dec_name=decrypted_name, final_name=final_name)
+        return decrypted_name
+
+    def _fetch_inits(self, segments: List[Segment]) -> Dict[Tuple[str, Any], bytes]:
         """
-        downloaded_files = self._collect_file_names(out_dir=out_dir)
-        concatenated_name = self._concatenate(in_names=downloaded_files, final_name=final_name)
-        decrypted_name = self._decrypt(cat_name=concatenated_name,
-                                       key_bytes=key_bytes,
-                                       final_name=final_name)
+        Fetching the media initialization sections of fMP4 fragments, each once
+        :param segments: the fragments
+        :return: the content of each section by its URI and byte range
+        """
+        inits = {}
+        for init in {(segment.init.uri, segment.init.byterange)
+                     for segment in segments if segment.init}:
+            try:
+                inits[init] = self._fet_minion.fetch_init(init_url=init[0], byterange=init[1])
+            except requests.RequestException as err:
+                self._abort(reason='Cannot fetch init section {}: {}'.format(init[0], err),
+                            code=1)
+        return inits
 
-        self._convert(dec_name=decrypted_name, final_name=final_name)
+    def _init_before(self, index: int) -> Optional[InitSection]:
+        """
+        The media initialization section to put before a fragment of fMP4 for the fragments
+        to make up a playable file: the section of the first fragment and of each fragment
+        whose section differs from that of the previous one
+        :param index: the position of the fragment in M3U8
+        :return: the section to put before the fragment, None if none
+        """
+        segments = self._m3u_dict.get('segments')
+        init = segments[index].init
+        previous = segments[index - 1].init if index else None
+        if init and (previous is None
+                     or (init.uri, init.byterange) != (previous.uri, previous.byterange)):
+            return init
+        return None
 
-    def _collect_file_names(self, out_dir: str) -> List[str]:
+    def _with_inits(self, files: List[str], out_dir: str) -> List[str]:
         """
-        Collecting the names of the downloaded .ts files
+        Writing the media initialization sections of fMP4 fragments to out_dir
+        and putting them where they belong among the fragment files
+        :param files: the fragment files, in the order of M3U8
+        :param out_dir: output directory
+        :return: the files to concatenate, in order
+        """
+        inits = self._fetch_inits(segments=self._m3u_dict.get('segments'))
+        in_names = []
+        for index, segment_file in enumerate(files):
+            init = self._init_before(index=index)
+            if init:
+                init_name = os.path.join(out_dir, 'init_{}.mp4'.format(index))
+                with open(init_name, 'wb') as init_file:
+                    init_file.write(inits[(init.uri, init.byterange)])
+                in_names.append(init_name)
+            in_names.append(segment_file)
+        return in_names
+
+    def _decrypt_segments(self, out_dir: str, journal: Journal = None) -> None:
+        """
+        Decrypting each downloaded fragment in place with its own key and initial vector,
+        aborting if any fails to, rather than assembling a corrupt video. The fragments
+        are recorded again once decrypted, so that a resumed job neither downloads
+        nor decrypts them again
+        :param out_dir: output directory, where the .ts files are stored
+        :param journal: the journal recording the files downloaded, and decrypted in place
+        """
+        segments = self._m3u_dict.get('segments')
+        decrypted = journal.decrypted() if journal else set()
+        encrypted = {segment_file: index for index, (segment, segment_file) in enumerate(
+                     zip(segments, self._segment_files(out_dir=out_dir)))
+                     if segment.key and index not in decrypted}
+        failed = self._dec_minion.decrypt_segments(
+            key_of=self._key_minion.get,
+            segments=[(segment_file, segments[index].key.uri, self._segment_iv(index=index))
+                      for segment_file, index in encrypted.items()])
+        if journal:
+            for segment_file in set(encrypted) - set(failed):
+                journal.record_file(index=encrypted[segment_file], path=segment_file,
+                                    decrypted=True)
+        if failed:
+            self._abort(reason="{} fragments failed to decrypt, e.g. {}".format(
+                len(failed), failed[0]), code=1)
+
+    def _validate(self, index: int, data: bytes) -> Optional[str]:
+        """
+        Validating a fragment as it lands, decrypting it in memory first if it is encrypted,
+        whichever decryption tool is used afterwards
+        :param index: the position of the fragment in M3U8
+        :param data: the content of the fragment as downloaded
+        :return: what is wrong with the fragment, None if nothing
+        """
+        key = self._m3u_dict.get('segments')[index].key
+        if key:
+            try:
+                data = self._dec_minion.decrypt_bytes(
+                    data=data, key_bytes=self._key_minion.get(uri=key.uri),
+                    iv=self._segment_iv(index=index))
+            except Exception as err:
+                return 'cannot get key: {}'.format(err)
+            if data is None:
+                return 'cannot be decrypted'
+        return self._val_minion.check(data=data)
+
+    def _segment_files(self, out_dir: str) -> List[str]:
+        """
+        Listing the downloaded .ts files in the order of M3U8
         :param out_dir: output directory, where the .ts files are stored
         :return: the names of the .ts files
         """
-        file_names = sp.Popen(['ls', out_dir], stdout=sp.PIPE)
+        return [Downloader.target_path(link=segment.uri, out_dir=out_dir,
+                                       byterange=segment.byterange)
+                for segment in self._m3u_dict.get('segments')]
 
-        downloaded_files = ["{}/{}".format(out_dir, str(name, 'utf-8'))[:-1]
-                            for name in file_names.stdout.readlines()]
-        self._log_minion.debug('Downloaded Files: {}'.format(downloaded_files))
-        return downloaded_files
+    def _links(self) -> List[str]:
+        """
+        Listing the URLs of all segments in M3U8
+        :return: the URLs of all segments
+        """
+        return [segment.uri for segment in self._m3u_dict.get('segments')]
+
+    def _byteranges(self) -> List[Optional[Tuple[int, int]]]:
+        """
+        Listing the byte ranges of all segments in M3U8
+        :return: the (length, offset) of each segment, None if it is the whole resource
+        """
+        return [segment.byterange for segment in self._m3u_dict.get('segments')]
 
-    def _concatenate(self, in_names: List[str], final_name: str) -> str:
+    def _concatenate(self, in_names: List[str], final_name: str,
+                     remove_inputs: bool = False) -> str:
         """
         Concatenating all .ts files into one
-        :param in_names: the names of all .ts files
+        :param in_names: the names of all .ts files, in order
         :param final_name: the final name in .mp4
+        :param remove_inputs: whether to remove each .ts file once it is concatenated
         :return: the name of the concatenated file
         """
-        concatenated_name = '{}_en.ts'.format(final_name[:-4]) if self._encrypted else \
+        concatenated_name = '{}_en.ts'.format(final_name[:-4]) \
+            if self._encrypted and not self._dec_segments else \
             '{}'.format(final_name[:-4])
 
-        self._alc_minion.concatenate(input_files=in_names, concatenated_name=concatenated_name)
+        self._alc_minion.concatenate(input_files=in_names, concatenated_name=concatenated_name,
+                                     remove_inputs=remove_inputs)
         self._log_minion.debug('File concatenated: {}'.format(concatenated_name))
         return concatenated_name
 
@@ -169,20 +883,53 @@ class MasterEngine:
         :return: the name of the decrypted file
         """
         decrypted_file_name = final_name[:-3] + 'ts'
+        if not self._encrypted or self._dec_segments:
+            return cat_name
 
-        if self._encrypted:
-            self._dec_minion.decrypt(
-                iv=self._m3u_dict.get('enc').get('iv')[2:],
-                key_bytes=key_bytes,
-                encrypted_file=cat_name,
-                out_name=decrypted_file_name,
-                encryption_method=self._m3u_dict.get('enc').get('method').lower() + '-cbc')
+        iv, encryption_method = self._decryption_params()
+        self._dec_minion.decrypt(
+            iv=iv,
+            key_bytes=key_bytes,
+            encrypted_file=cat_name,
+            out_name=decrypted_file_name,
+            encryption_method=encryption_method)
 
         self._log_minion.debug('File decrypted: {}'.format(decrypted_file_name))
-        return decrypted_file_name if self._encrypted else cat_name
+        return decrypted_file_name
+
+    def _decryption_params(self) -> Tuple[str, str]:
+        """
+        Reading the decryption parameters from the key info in M3U8
+        :return: the initial vector in hex and the encryption method, e.g. aes-128-cbc
+        """
+        return self._segment_iv(index=0).hex(), \
+            self._first_key(m3u_dict=self._m3u_dict).method.lower() + '-cbc'
+
+    def _segment_iv(self, index: int) -> bytes:
+        """
+        The initial vector of a fragment, given by the key info in M3U8 or,
+        if omitted, derived from the media sequence number of the fragment
+        :param index: the position of the fragment in M3U8
+        :return: the initial vector in bytes
+        """
+        segment = self._m3u_dict.get('segments')[index]
+        key = segment.key or self._first_key(m3u_dict=self._m3u_dict)
+        return key.iv or segment.sequence.to_bytes(16, 'big')
 
     def _convert(self, dec_name: str, final_name: str):
-        self._alc_minion.convert(in_ts=dec_name, out_mp4=final_name)
+        renditions = self._join_renditions()
+        if self._fmp4 and not self._trimmed and not renditions:
+            # fMP4 fragments following their init section play as they are
+            os.replace(dec_name, final_name)
+            self._log_minion.debug('fMP4 assembled without conversion: {}'.format(final_name))
+            return
+        with self._met_minion.stage(name='convert'):
+            code = self._alc_minion.convert(in_ts=dec_name, out_mp4=final_name,
+                                            renditions=renditions)
+        if code:
+            self._remove_output(final_name=final_name)
+            self._abort(reason='Conversion tool exited with {}, {} is kept to convert '
+                               'again'.format(code, dec_name), code=1)
         self._log_minion.debug('Alrighty!')
 
 
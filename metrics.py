@@ -0,0 +1,224 @@
+"""
+Metrics is responsible of measuring where the time of a job goes:
+the wall time of each stage (on the monotonic clock), counters (e.g. retries, errors, bytes),
+gauges (e.g. throughput) and histograms (e.g. the latency and size of each segment).
+Every update takes one short lock, so the minions may update them from any thread.
+The metrics are exported as JSON or in the Prometheus text format, at the end of the job and
+periodically, and each stage can be profiled with cProfile on demand
+"""
+
+import bisect
+import cProfile
+import json
+import logging
+import os
+import sys
+import threading
+import time
+from contextlib import contextmanager
+from typing import Any, Dict, Iterator, List, Tuple
+
+
+class Metrics:
+    JSON_FORMAT = 'json'
+    PROMETHEUS_FORMAT = 'prometheus'
+    LATENCY_BUCKETS = (0.01, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+    SIZE_BUCKETS = (16 * 1024, 64 * 1024, 256 * 1024, 1024 * 1024, 4 * 1024 * 1024,
+                    16 * 1024 * 1024, 64 * 1024 * 1024)
+    _PREFIX = 'm3u_'
+
+    def __init__(self, met_logger: logging.Logger) -> None:
+        """
+        Welcoming the logger assigned and prepare the empty metrics
+        :param met_logger: the logger assigned
+        """
+        self._logger = met_logger
+        self._profile_dir = None
+        self._counters: Dict[str, float] = {}
+        self._gauges: Dict[str, float] = {}
+        self._histograms: Dict[str, Tuple[Tuple[float, ...], List[int], List[float]]] = {}
+        self._stages: Dict[str, float] = {}
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._exporter = None
+
+    def set_profile_dir(self, profile_dir: str) -> None:
+        """
+        Profiling each stage from now on
+        :param profile_dir: where each stage is profiled into <stage>.prof, None not to profile
+        """
+        self._profile_dir = profile_dir
+
+    def count(self, name: str, value: float = 1) -> None:
+        """
+        Adding to a counter
+        :param name: the name of the counter, e.g. retries
+        :param value: how much to add
+        """
+        with self._lock:
+            self._counters[name] = self._counters.get(name, 0) + value
+
+    def set(self, name: str, value: float) -> None:
+        """
+        Setting a gauge
+        :param name: the name of the gauge, e.g. concurrency_limit
+        :param value: the current value
+        """
+        with self._lock:
+            self._gauges[name] = value
+
+    def observe(self, name: str, value: float,
+                buckets: Tuple[float, ...] = LATENCY_BUCKETS) -> None:
+        """
+        Observing a value into a histogram
+        :param name: the name of the histogram, e.g. segment_seconds
+        :param value: the value observed
+        :param buckets: the upper bounds of the buckets, used when the histogram is new
+        """
+        with self._lock:
+            histogram = self._histograms.get(name)
+            if histogram is None:
+                histogram = self._histograms[name] = (buckets, [0] * (len(buckets) + 1), [0.0])
+            histogram[1][bisect.bisect_left(histogram[0], value)] += 1
+            histogram[2][0] += value
+
+    def value(self, name: str) -> float:
+        """
+        :param name: the name of a counter or a gauge
+        :return: its current value, 0 if never updated
+        """
+        with self._lock:
+            return self._counters.get(name, self._gauges.get(name, 0))
+
+    @contextmanager
+    def stage(self, name: str) -> Iterator[None]:
+        """
+        Timing a stage of the job, and profiling it if asked to.
+        Only the thread running the stage is profiled, and a stage is not profiled
+        if another profiler is already active
+        :param name: the name of the stage, e.g. download
+        """
+        profiler = self._start_profiler(name=name) if self._profile_dir else None
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            seconds = time.perf_counter() - start
+            with self._lock:
+                self._stages[name] = self._stages.get(name, 0.0) + seconds
+            self._logger.debug('Stage {} took {:.3f}s'.format(name, seconds))
+            if profiler:
+                profiler.disable()
+                profiler.dump_stats(os.path.join(self._profile_dir, '{}.prof'.format(name)))
+
+    def _start_profiler(self, name: str) -> cProfile.Profile:
+        """
+        Starting to profile a stage
+        :param name: the name of the stage
+        :return: the profiler, None if another profiler is already active
+        """
+        os.makedirs(self._profile_dir, exist_ok=True)
+        profiler = cProfile.Profile()
+        try:
+            profiler.enable()
+        except ValueError as err:
+            self._logger.warning('Stage {} is not profiled: {}'.format(name, err))
+            return None
+        return profiler
+
+    def export(self, fmt: str = JSON_FORMAT) -> str:
+        """
+        Exporting a snapshot of the metrics
+        :param fmt: json or prometheus
+        :return: the metrics in the format
+        """
+        with self._lock:
+            snapshot = {
+                'stages': dict(self._stages),
+                'counters': dict(self._counters),
+                'gauges': dict(self._gauges),
+                'histograms': {name: {'buckets': dict(zip([str(bound) for bound in buckets]
+                                                          + ['+Inf'], counts)),
+                                      'sum': total[0], 'count': sum(counts)}
+                               for name, (buckets, counts, total) in self._histograms.items()}}
+        if fmt == self.PROMETHEUS_FORMAT:
+            return self._to_prometheus(snapshot=snapshot)
+        return json.dumps(snapshot, indent=2)
+
+    def _to_prometheus(self, snapshot: Dict[str, Any]) -> str:
+        """
+        Formatting a snapshot in the Prometheus text format, with cumulative buckets
+        :param snapshot: the metrics exported
+        :return: the metrics as text
+        """
+        lines = ['# TYPE {}stage_seconds gauge'.format(self._PREFIX)]
+        lines += ['{}stage_seconds{{stage="{}"}} {}'.format(self._PREFIX, stage, seconds)
+                  for stage, seconds in sorted(snapshot.get('stages').items())]
+        for name, value in sorted(snapshot.get('counters').items()):
+            lines += ['# TYPE {}{}_total counter'.format(self._PREFIX, name),
+                      '{}{}_total {}'.format(self._PREFIX, name, value)]
+        for name, value in sorted(snapshot.get('gauges').items()):
+            lines += ['# TYPE {}{} gauge'.format(self._PREFIX, name),
+                      '{}{} {}'.format(self._PREFIX, name, value)]
+        for name, histogram in sorted(snapshot.get('histograms').items()):
+            lines.append('# TYPE {}{} histogram'.format(self._PREFIX, name))
+            cumulative = 0
+            for bound, count in histogram.get('buckets').items():
+                cumulative += count
+                lines.append('{}{}_bucket{{le="{}"}} {}'.format(self._PREFIX, name, bound,
+                                                                cumulative))
+            lines += ['{}{}_sum {}'.format(self._PREFIX, name, histogram.get('sum')),
+                      '{}{}_count {}'.format(self._PREFIX, name, histogram.get('count'))]
+        return '\n'.join(lines) + '\n'
+
+    def dump(self, path: str, fmt: str = JSON_FORMAT) -> None:
+        """
+        Writing a snapshot of the metrics to a file, replacing it at once
+        :param path: the path to the file
+        :param fmt: json or prometheus
+        """
+        tmp_path = path + '.tmp'
+        try:
+            with open(tmp_path, 'w') as out_file:
+                out_file.write(self.export(fmt=fmt))
+            os.replace(tmp_path, path)
+        except OSError as err:
+            self._logger.warning('Failed to export metrics to {}: {}'.format(path, err))
+
+    def start_exporting(self, path: str, fmt: str = JSON_FORMAT, interval: float = 10) -> None:
+        """
+        Writing a snapshot of the metrics to a file periodically in the background
+        :param path: the path to the file
+        :param fmt: json or prometheus
+        :param interval: the seconds between two snapshots
+        """
+        def export_periodically() -> None:
+            while not self._stop.wait(interval):
+                self.dump(path=path, fmt=fmt)
+
+        self._exporter = threading.Thread(target=export_periodically, daemon=True)
+        self._exporter.start()
+
+    def stop_exporting(self, path: str, fmt: str = JSON_FORMAT) -> None:
+        """
+        Stopping the periodical export and writing the final snapshot
+        :param path: the path to the file
+        :param fmt: json or prometheus
+        """
+        self._stop.set()
+        if self._exporter:
+            self._exporter.join()
+        self.dump(path=path, fmt=fmt)
+
+
+# Demo
+if __name__ == '__main__':
+    logger = logging.getLogger(__name__)
+    logger.setLevel(logging.DEBUG)
+    logger.addHandler(logging.StreamHandler(sys.stdout))
+
+    minion = Metrics(logger)
+    with minion.stage(name='download'):
+        minion.observe(name='segment_seconds', value=0.2)
+        minion.count(name='retries')
+    print(minion.export(fmt=Metrics.PROMETHEUS_FORMAT))
@@ -0,0 +1,154 @@
+"""
+Mirrors is responsible of routing the downloads of the fragments among several mirrors serving
+the same fragments under different prefixes, e.g. CDNs performing differently per region:
+1. the throughput and error rate of each mirror are measured as it serves (moving averages),
+2. each download goes to the best mirror (throughput discounted by errors), or with split on,
+to a mirror drawn in proportion to its score, so that the mirrors add up their bandwidth,
+3. a mirror not measured yet is tried first, and
+4. a mirror failing is left out for a while, growing with its consecutive failures,
+so the downloads fail over to the others, unless all of them are failing
+"""
+
+import logging
+import random
+import sys
+import threading
+import time
+from typing import List, Optional, Tuple
+
+
+class Mirrors:
+    _ALPHA = 0.2
+    _COOLDOWN = 5
+    _COOLDOWN_CAP = 60
+
+    def __init__(self, mir_logger: logging.Logger, base: str, mirrors: List[str],
+                 split: bool = False) -> None:
+        """
+        Welcoming the logger assigned and prepare the measures of each mirror
+        :param mir_logger: the logger assigned
+        :param base: the prefix of the links in M3U8, e.g. http://cdn1.sample.com/video/
+        :param mirrors: the prefixes serving the same fragments, e.g. http://cdn2.sample.com/video/
+        :param split: whether to spread the downloads among the mirrors by their score
+        rather than sending them all to the best one
+        """
+        self._logger = mir_logger
+        self._prefixes = [base] + [mirror for mirror in mirrors if mirror != base]
+        self._split = split
+        count = len(self._prefixes)
+        self._throughput: List[Optional[float]] = [None] * count
+        self._error_rate = [0.0] * count
+        self._in_flight = [0] * count
+        self._failures = [0] * count
+        self._down_until = [0.0] * count
+        self._requests, self._errors, self._bytes = [0] * count, [0] * count, [0] * count
+        self._lock = threading.Lock()
+
+    def urls(self, link: str) -> List[str]:
+        """
+        :param link: the link to a fragment in M3U8
+        :return: the link to the fragment on each mirror, only the link if not under the base
+        """
+        if not link.startswith(self._prefixes[0]):
+            return [link]
+        return [prefix + link[len(self._prefixes[0]):] for prefix in self._prefixes]
+
+    def pick(self, link: str) -> Tuple[int, str]:
+        """
+        Picking the mirror to download a fragment from
+        :param link: the link to the fragment in M3U8
+        :return: the mirror picked, -1 if none as the link is not under the base,
+        and the link to the fragment on it
+        """
+        if not link.startswith(self._prefixes[0]):
+            return -1, link
+        with self._lock:
+            now = time.monotonic()
+            candidates = [mirror for mirror in range(len(self._prefixes))
+                          if self._down_until[mirror] <= now] \
+                or [min(range(len(self._prefixes)), key=lambda mirror: self._down_until[mirror])]
+            unmeasured = [mirror for mirror in candidates if self._throughput[mirror] is None]
+            if unmeasured:
+                mirror = min(unmeasured, key=lambda candidate: self._in_flight[candidate])
+            elif self._split:
+                mirror = random.choices(candidates,
+                                        weights=[self._score(mirror=candidate) or 1e-9
+                                                 for candidate in candidates])[0]
+            else:
+                mirror = max(candidates, key=lambda candidate: self._score(mirror=candidate))
+            self._in_flight[mirror] += 1
+        return mirror, self._prefixes[mirror] + link[len(self._prefixes[0]):]
+
+    def _score(self, mirror: int) -> float:
+        """
+        :param mirror: a mirror measured
+        :return: its throughput discounted by its error rate
+        """
+        return self._throughput[mirror] * (1 - self._error_rate[mirror])
+
+    def report(self, mirror: int, size: int, seconds: float, ok: bool) -> None:
+        """
+        Reporting a finished download from a mirror
+        :param mirror: the mirror picked, -1 if none
+        :param size: the number of bytes downloaded
+        :param seconds: the seconds the download took
+        :param ok: whether the download succeeded
+        """
+        if mirror < 0:
+            return
+        with self._lock:
+            self._in_flight[mirror] -= 1
+            self._requests[mirror] += 1
+            self._error_rate[mirror] += self._ALPHA * ((not ok) - self._error_rate[mirror])
+            if ok:
+                self._bytes[mirror] += size
+                throughput = size / max(seconds, 1e-6)
+                previous = self._throughput[mirror]
+                self._throughput[mirror] = throughput if previous is None \
+                    else previous + self._ALPHA * (throughput - previous)
+                self._failures[mirror] = 0
+                return
+            self._errors[mirror] += 1
+            self._failures[mirror] += 1
+            cooldown = min(self._COOLDOWN * 2 ** (self._failures[mirror] - 1),
+                           self._COOLDOWN_CAP)
+            self._down_until[mirror] = time.monotonic() + cooldown
+        self._logger.debug('Mirror {} failing, left out for {}s'.format(self._prefixes[mirror],
+                                                                        cooldown))
+
+    def abandon(self, mirror: int) -> None:
+        """
+        Reporting a download from a mirror given up midway as another attempt of the same
+        fragment finished first, which tells nothing of the mirror
+        :param mirror: the mirror picked, -1 if none
+        """
+        if mirror < 0:
+            return
+        with self._lock:
+            self._in_flight[mirror] -= 1
+
+    def summarize(self) -> None:
+        """
+        Reporting what each mirror served
+        """
+        with self._lock:
+            for mirror, prefix in enumerate(self._prefixes):
+                self._logger.warning('Mirror {}: {} requests, {} errors, {} bytes, {:.1f} MB/s'
+                                     .format(prefix, self._requests[mirror], self._errors[mirror],
+                                             self._bytes[mirror],
+                                             (self._throughput[mirror] or 0) / 1e6))
+
+
+# Demo
+if __name__ == '__main__':
+    logger = logging.getLogger(__name__)
+    logger.setLevel(logging.DEBUG)
+    logger.addHandler(logging.StreamHandler(sys.stdout))
+
+    minion = Mirrors(logger, base='http://cdn1.sample.com/video/',
+                     mirrors=['http://cdn2.sample.com/video/'])
+    for i in range(10):
+        picked, url = minion.pick(link='http://cdn1.sample.com/video/{}.ts'.format(i))
+        minion.report(mirror=picked, size=1024 * 1024, seconds=0.1 if picked else 0.5, ok=True)
+        print(url)
+    minion.summarize()
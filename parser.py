@@ -1,21 +1,33 @@
 """
 A parser that is responsible of:
 1. parse command line arguments,
-2. parse links/key info from the bytes of responded .m3u,
+2. parse segments/key info from the bytes of responded .m3u,
 3. parse key bytes from the the bytes of responded .key
 """
 
+import io
 import logging
 import re
 import sys
-from argparse import ArgumentParser, Namespace
-from typing import List, Dict, Any
+from argparse import ArgumentParser, ArgumentTypeError, Namespace
+from typing import List, Dict, Any, Optional, Tuple
+from urllib.parse import urljoin
+
+from .playlist import InitSection, Key, Segment
 
 
 class Parser:
-    _KEY_HEADER = '#EXT-X-KEY:'
-    _ENC_PATTERN_1 = r'#EXT-X-KEY:METHOD=(?P<method>.*),URI=(?P<uri>.*)'
-    _ENC_PATTERN_2 = r'#EXT-X-KEY:METHOD=(?P<method>.*),URI=(?P<uri>.*),IV=(?P<iv>.+)'
+    _EXTINF_TAG = '#EXTINF'
+    _BYTERANGE_TAG = '#EXT-X-BYTERANGE'
+    _KEY_TAG = '#EXT-X-KEY'
+    _MAP_TAG = '#EXT-X-MAP'
+    _DISCONTINUITY_TAG = '#EXT-X-DISCONTINUITY'
+    _MEDIA_SEQUENCE_TAG = '#EXT-X-MEDIA-SEQUENCE'
+    _TARGET_DURATION_TAG = '#EXT-X-TARGETDURATION'
+    _ENDLIST_TAG = '#EXT-X-ENDLIST'
+    _STREAM_INF_TAG = '#EXT-X-STREAM-INF'
+    _MEDIA_TAG = '#EXT-X-MEDIA'
+    _ATTRIBUTE_PATTERN = re.compile(r'([A-Z0-9-]+)=("[^"]*"|[^,]*)')
 
     def __init__(self, par_logger: logging.Logger) -> None:
         """
@@ -24,19 +36,45 @@ class Parser:
         """
         self._logger = par_logger
         self.arg_parser = ArgumentParser(description="parses the cml arguments")
+        self._arguments_added = False
 
-    def parse_args(self) -> Namespace:
+    def parse_args(self, argv: List[str] = None) -> Namespace:
         """
         Parsing arguments and return them
+        :param argv: the arguments to parse, those of the process if None
+        :return: the arguments in a Namespace
+        """
+        args = self.check_args(argv=argv)
+        self._logger.setLevel(level=logging.DEBUG if args.verbose else logging.WARN)
+        self._logger.debug('Arguments parsed: {}'.format(args))
+
+        return args
+
+    def check_args(self, argv: List[str] = None) -> Namespace:
+        """
+        Parsing arguments without applying the verbosity they ask for to the logger,
+        e.g. to validate a job before it runs along with others sharing the logger
+        :param argv: the arguments to parse, those of the process if None
         :return: the arguments in a Namespace
         """
+        if not self._arguments_added:
+            self._add_arguments()
+            self._arguments_added = True
+        return self.arg_parser.parse_args(argv)
+
+    def _add_arguments(self) -> None:
+        """
+        Adding the arguments of a job to the command line argument parser
+        """
         self.arg_parser.add_argument(
             'm3u_url', nargs=1, type=str,
             help="the url to the .m3u file, e.g. http://sample.m3u")
 
         self.arg_parser.add_argument(
             '--m3u_prefix', '-P', nargs=1, type=str,
-            help="the prefix of each url in the .m3u file")
+            help="the prefix of each url in the .m3u file, i.e. the URL they are relative to, "
+                 "a '/' is added if it does not end with one, "
+                 "the URL of the .m3u file will be used as default")
 
         self.arg_parser.add_argument(
             '--output_name', '-O', nargs='?', type=str,
@@ -49,13 +87,166 @@ class Parser:
 
         self.arg_parser.add_argument(
             '--dow_tool', '-W', nargs='?', type=str,
-            help="Coming soon: "
-                 "the tool for downloading, e.g. aria2c, which will be used as default")
+            help="the tool for downloading, e.g. aria2c, which will be used as default, "
+                 "or builtin, which downloads in-process over a shared connection pool")
+
+        self.arg_parser.add_argument(
+            '--host_conns', nargs='?', type=int,
+            help="the max number of connections kept alive to each host "
+                 "by the builtin download tool, e.g. 8, which will be used as default")
+
+        self.arg_parser.add_argument(
+            '--retries', nargs='?', type=int, default=3,
+            help="the number of times a fragment failed to download is tried again, "
+                 "e.g. 3, which will be used as default")
+
+        self.arg_parser.add_argument(
+            '--timeout', nargs='?', type=float, default=60,
+            help="the max number of seconds each attempt to download a fragment may take, "
+                 "e.g. 60, which will be used as default")
+
+        self.arg_parser.add_argument(
+            '--hedge', action="store_true", default=False,
+            help="Whether to request a fragment again once it takes well longer than most, "
+                 "taking whichever response completes first (builtin download tool only)")
+
+        self.arg_parser.add_argument(
+            '--coalesce_size', nargs='?', type=int, default=8,
+            help="the max number of MB requested at a time when fragments are adjacent byte "
+                 "ranges of one file, e.g. 8, which will be used as default, 0 not to merge them")
+
+        self.arg_parser.add_argument(
+            '--validate', action="store_true", default=False,
+            help="Whether to check each MPEG-TS fragment as it lands (whole packets, sync bytes, "
+                 "continuity counters) and fetch the corrupt ones again")
+
+        self.arg_parser.add_argument(
+            '--cache_dir', nargs='?', type=str, default=None,
+            help="the directory of the segment cache shared by jobs, looked up before the "
+                 "network and linked into out_dir, e.g. ~/.cache/m3u, no cache if omitted")
+
+        self.arg_parser.add_argument(
+            '--cache_size', nargs='?', type=int, default=2048,
+            help="the max number of MB kept in the segment cache, the least recently used "
+                 "segments are evicted beyond it, e.g. 2048, which will be used as default")
+
+        self.arg_parser.add_argument(
+            '--plan', action="store_true", default=False,
+            help="Whether to size the fragments first (HEAD requests), abort unless out_dir "
+                 "has room for the job, and download the largest fragments first")
+
+        self.arg_parser.add_argument(
+            '--mirrors', nargs='+', type=str, default=None,
+            help="the prefixes of mirrors serving the same fragments as the m3u_prefix, each "
+                 "fragment is downloaded from the mirror performing best and fails over to the "
+                 "others, e.g. http://cdn2.sample.com/video/ http://cdn3.sample.com/video/")
+
+        self.arg_parser.add_argument(
+            '--split_mirrors', action="store_true", default=False,
+            help="Whether to spread the fragments among the mirrors by their throughput and "
+                 "error rate, adding up their bandwidth, rather than to use the best one only")
+
+        self.arg_parser.add_argument(
+            '--metrics', nargs='?', type=str, default=None,
+            help="the path to export the timing of each stage, the latency and size of fragments, "
+                 "retries and errors to, at the end of the job and periodically, e.g. metrics.json")
+
+        self.arg_parser.add_argument(
+            '--metrics_format', nargs='?', type=str, default='json',
+            choices=['json', 'prometheus'],
+            help="the format of the metrics exported, e.g. json, which will be used as default")
+
+        self.arg_parser.add_argument(
+            '--metrics_interval', nargs='?', type=float, default=10,
+            help="the seconds between two exports of the metrics, "
+                 "e.g. 10, which will be used as default")
+
+        self.arg_parser.add_argument(
+            '--profile', nargs='?', type=str, default=None,
+            help="the directory to profile each stage into with cProfile, as <stage>.prof, "
+                 "e.g. profiles")
+
+        self.arg_parser.add_argument(
+            '--adaptive', action="store_true", default=False,
+            help="Whether to adapt the number of fragments downloaded at a time to the measured "
+                 "throughput, latency and errors, within --min_inflight and --max_inflight")
+
+        self.arg_parser.add_argument(
+            '--min_inflight', nargs='?', type=int, default=2,
+            help="the min number of fragments downloaded at a time in adaptive mode, "
+                 "e.g. 2, which will be used as default")
+
+        self.arg_parser.add_argument(
+            '--max_inflight', nargs='?', type=int, default=64,
+            help="the max number of fragments downloaded at a time in adaptive mode, "
+                 "e.g. 64, which will be used as default")
+
+        self.arg_parser.add_argument(
+            '--variant_by', nargs='?', type=str, default='bandwidth',
+            choices=['bandwidth', 'resolution', 'probe'],
+            help="how to select the variant stream of a master playlist: the max bandwidth, "
+                 "the max resolution, or the best throughput to bandwidth ratio measured by "
+                 "downloading the first fragment of each variant, bandwidth is used as default")
+
+        self.arg_parser.add_argument(
+            '--codec', nargs='?', type=str,
+            help="only select the variant streams whose codecs contain this, e.g. avc1")
+
+        self.arg_parser.add_argument(
+            '--max_bandwidth', nargs='?', type=int,
+            help="only select the variant streams whose bandwidth in bit/s is at most this")
+
+        self.arg_parser.add_argument(
+            '--renditions', nargs='?', type=str, default='default',
+            choices=['default', 'all', 'none'],
+            help="which alternate audio and subtitle renditions (#EXT-X-MEDIA) of the variant "
+                 "selected to download along with it and mux into the output: the default one "
+                 "of each group, which will be used as default, all of them, or none")
+
+        self.arg_parser.add_argument(
+            '--languages', nargs='+', type=str, default=None,
+            help="only download the renditions in these languages, e.g. en fr")
+
+        self.arg_parser.add_argument(
+            '--resume', action="store_true", default=False,
+            help="Whether to resume an interrupted job, "
+                 "downloading only the fragments missing or corrupt according to its journal")
+
+        self.arg_parser.add_argument(
+            '--pipeline', action="store_true", default=False,
+            help="Whether to decrypt and convert the fragments while they are being downloaded, "
+                 "instead of one stage after another")
+
+        self.arg_parser.add_argument(
+            '--window', nargs='?', type=int, default=16,
+            help="the max number of fragments held in memory while waiting for their turn "
+                 "in the pipeline, e.g. 16, which will be used as default")
+
+        self.arg_parser.add_argument(
+            '--live', action="store_true", default=False,
+            help="Whether to record a live playlist, reloading it every target duration and "
+                 "appending the new fragments to the output until it ends")
+
+        self.arg_parser.add_argument(
+            '--max_duration', nargs='?', type=float,
+            help="the max number of seconds of a live playlist to record, "
+                 "until the playlist ends if omitted")
+
+        self.arg_parser.add_argument(
+            '--start', nargs='?', type=self._seconds, default=None,
+            help="where the clip to download starts in a VOD playlist, in seconds or [HH:]MM:SS, "
+                 "e.g. 1:02:30, only the fragments covering the clip are downloaded, "
+                 "from the start if omitted")
+
+        self.arg_parser.add_argument(
+            '--end', nargs='?', type=self._seconds, default=None,
+            help="where the clip to download ends in a VOD playlist, in seconds or [HH:]MM:SS, "
+                 "e.g. 1:04:30, until the end if omitted")
 
         self.arg_parser.add_argument(
             '--dec_tool', '-D', nargs='?', type=str,
-            help="Coming soon: "
-                 "the tool for decryption, e.g. openssl, which will be used as default")
+            help="the tool for decryption, e.g. openssl, which will be used as default, "
+                 "or builtin, which decrypts each fragment in-process with its own IV")
 
         self.arg_parser.add_argument(
             '--cov_tool', '-C', nargs='?', type=str,
@@ -65,60 +256,321 @@ class Parser:
 
         self.arg_parser.add_argument(
             '--cat_tool', '-T', nargs='?', type=str,
-            help="Coming soon: "
-                 "the tool to concat all fragment files in M3U8 to one, "
-                 "e.g. cat, which will be used as default")
+            help="the tool to concat all fragment files in M3U8 to one, "
+                 "e.g. cat, which will be used as default, "
+                 "or builtin, which appends the fragments in kernel space where possible")
 
-        args = self.arg_parser.parse_args()
-        self._logger.setLevel(level=logging.DEBUG if args.verbose else logging.WARN)
-        self._logger.debug('Arguments parsed: {}'.format(args))
+        self.arg_parser.add_argument(
+            '--remove_fragments', action="store_true", default=False,
+            help="Whether to remove each fragment file as soon as the builtin concatenation tool "
+                 "has appended it, so that the disk holds about one copy of the video at a time")
+
+    @staticmethod
+    def _seconds(value: str) -> float:
+        """
+        Parsing a point in time given in seconds or [HH:]MM:SS(.fff)
+        :param value: the point in time, e.g. 90 or 1:30
+        :return: the number of seconds
+        """
+        try:
+            seconds = 0.0
+            for part in value.split(':'):
+                seconds = seconds * 60 + float(part)
+        except ValueError:
+            raise ArgumentTypeError('invalid time: {}'.format(value))
+        if seconds < 0 or value.count(':') > 2:
+            raise ArgumentTypeError('invalid time: {}'.format(value))
+        return seconds
+
+    def parse_batch_args(self, argv: List[str] = None) -> Tuple[Namespace, List[str]]:
+        """
+        Parsing the arguments of a batch, the ones it does not know are left to every job
+        :param argv: the arguments to parse, those of the process if None
+        :return: the arguments of the batch in a Namespace and those left to the jobs
+        """
+        batch_parser = ArgumentParser(description="runs the jobs listed in a manifest, "
+                                                  "the other arguments apply to every job")
+        batch_parser.add_argument(
+            'manifest', nargs=1, type=str,
+            help="the path to the manifest, listing one job per line: "
+                 "<m3u_url> <output_name.mp4> [m3u_prefix]")
+
+        batch_parser.add_argument(
+            '--max_conns', nargs='?', type=int, default=32,
+            help="the max number of fragments downloaded at a time by all jobs together, "
+                 "e.g. 32, which will be used as default")
+
+        batch_parser.add_argument(
+            '--host_conns', nargs='?', type=int, default=8,
+            help="the max number of fragments downloaded at a time from each host "
+                 "by all jobs together, e.g. 8, which will be used as default")
+
+        batch_parser.add_argument(
+            '--jobs', nargs='?', type=int, default=4,
+            help="the max number of jobs run at a time, e.g. 4, which will be used as default")
+
+        args, job_argv = batch_parser.parse_known_args(argv)
+        self._logger.debug('Batch arguments parsed: {} {}'.format(args, job_argv))
+        return args, job_argv + ['--host_conns', str(args.host_conns)]
+
+    def parse_daemon_args(self, argv: List[str] = None) -> Tuple[Namespace, List[str]]:
+        """
+        Parsing the arguments of the daemon, the ones it does not know are left to every job
+        :param argv: the arguments to parse, those of the process if None
+        :return: the arguments of the daemon in a Namespace and those left to the jobs
+        """
+        daemon_parser = ArgumentParser(description="runs the jobs submitted over a local HTTP "
+                                                   "API, the other arguments apply to every job")
+        daemon_parser.add_argument(
+            '--host', nargs='?', type=str, default='127.0.0.1',
+            help="the address to listen on, e.g. 127.0.0.1, which will be used as default")
+
+        daemon_parser.add_argument(
+            '--port', nargs='?', type=int, default=8765,
+            help="the port to listen on, e.g. 8765, which will be used as default")
+
+        daemon_parser.add_argument(
+            '--max_conns', nargs='?', type=int, default=32,
+            help="the max number of fragments downloaded at a time by all jobs together, "
+                 "e.g. 32, which will be used as default")
+
+        daemon_parser.add_argument(
+            '--host_conns', nargs='?', type=int, default=8,
+            help="the max number of fragments downloaded at a time from each host "
+                 "by all jobs together, e.g. 8, which will be used as default")
 
+        daemon_parser.add_argument(
+            '--jobs', nargs='?', type=int, default=4,
+            help="the max number of jobs run at a time, e.g. 4, which will be used as default")
+
+        daemon_parser.add_argument(
+            '--token', nargs='?', type=str, default=None,
+            help="the token the clients must send as 'Authorization: Bearer <token>', "
+                 "a random one is generated and logged if omitted")
+
+        daemon_parser.add_argument(
+            '--out_root', nargs='?', type=str, default='.',
+            help="the directory the files of the jobs (output, metrics, profile, cache) "
+                 "must be under, e.g. ., the working directory, which will be used as default")
+
+        args, job_argv = daemon_parser.parse_known_args(argv)
+        self._logger.debug('Daemon arguments parsed: {} {}'.format(args, job_argv))
+        return args, job_argv + ['--host_conns', str(args.host_conns)]
+
+    def parse_benchmark_args(self, argv: List[str] = None) -> Namespace:
+        """
+        Parsing the arguments of the benchmark
+        :param argv: the arguments to parse, those of the process if None
+        :return: the arguments of the benchmark in a Namespace
+        """
+        benchmark_parser = ArgumentParser(description="measures how fast the tools and whole "
+                                                      "jobs run on synthetic input")
+        benchmark_parser.add_argument(
+            '--suite', nargs='?', type=str, default='all', choices=['tools', 'e2e', 'all'],
+            help="the benchmarks to run: the tools one by one, whole jobs end to end or both, "
+                 "e.g. all, which will be used as default")
+
+        benchmark_parser.add_argument(
+            '--configs', nargs='*', type=str, default=None,
+            choices=['plain', 'encrypted', 'rotating', 'latency', 'flaky', 'pipeline'],
+            help="the configurations of the end-to-end suite to run, all if omitted")
+
+        benchmark_parser.add_argument(
+            '--repeat', nargs='?', type=int, default=3,
+            help="the number of runs of each benchmark, the best one is reported, "
+                 "e.g. 3, which will be used as default")
+
+        benchmark_parser.add_argument(
+            '--out', nargs='?', type=str, default=None,
+            help="the path to save the results of the end-to-end suite to, e.g. results.json")
+
+        benchmark_parser.add_argument(
+            '--baseline', nargs='?', type=str, default=None,
+            help="the path to the results saved by an earlier run to compare with, "
+                 "exiting with 1 on regressions, e.g. baseline.json")
+
+        benchmark_parser.add_argument(
+            '--tolerance', nargs='?', type=float, default=0.1,
+            help="the share by which a measure may get worse before it is reported as "
+                 "a regression, e.g. 0.1, which will be used as default")
+
+        args = benchmark_parser.parse_args(argv)
+        self._logger.debug('Benchmark arguments parsed: {}'.format(args))
         return args
 
-    def parse_m3u(self, contents_bytes: bytes) -> Dict[str, Any]:
+    def parse_m3u(self, contents_bytes: bytes, m3u_url: str = None) -> Dict[str, Any]:
         """
-        Parsing the byte content of the M3U8 file to a dictionary
+        Parsing the byte content of the M3U8 file to a dictionary in a single pass,
+        line by line without decoding the whole content at once
         :param contents_bytes: the content of M3U8 in bytes
-        :return: the dictionary containing info of M3U8
+        :param m3u_url: the URL which the URIs in M3U8 are relative to, left as they are if None
+        :return: the dictionary containing info of M3U8: the segments of a media playlist,
+        the variants of a master playlist, the first media sequence number, the target duration
+        whether the playlist ends (i.e. #EXT-X-ENDLIST) and the alternate renditions
+        of a master playlist
         """
-        enc_dict, links = {}, []
-        content_list = str(contents_bytes, 'utf-8').split('\n')
+        segments, variants, prefixes = [], [], {}  # type: List[Segment], List[Dict], Dict
+        renditions = []  # type: List[Dict]
+        media_sequence = sequence = 0
+        duration, byterange, discontinuity, range_end = 0.0, None, False, 0
+        target_duration, endlist, key, init, stream_inf = None, False, None, None, None
 
-        for content in content_list:
-            if not content:
+        for line in io.BytesIO(contents_bytes):
+            line = line.strip()
+            if not line:
                 continue
-            if self._KEY_HEADER in content:
-                enc_dict = self._parse_key_line(key_line=content)
+            line = line.decode('utf-8')
 
-            self._parse_links(link_line=content, links=links)
+            if line[0] != '#':
+                if stream_inf is not None:
+                    variants.append(dict(stream_inf, uri=line))
+                    stream_inf = None
+                    continue
+                prefix, name = self._split_uri(uri=line, m3u_url=m3u_url, prefixes=prefixes)
+                segments.append(Segment(prefix=prefix, name=name, duration=duration,
+                                        sequence=sequence, byterange=byterange,
+                                        discontinuity=discontinuity, key=key, init=init))
+                sequence += 1
+                duration, byterange, discontinuity = 0.0, None, False
+                continue
+
+            tag, _, value = line.partition(':')
+            if tag == self._EXTINF_TAG:
+                duration = float(value.partition(',')[0])
+            elif tag == self._BYTERANGE_TAG:
+                byterange = self._parse_byterange(byterange=value, range_end=range_end)
+                range_end = byterange[0] + byterange[1]
+            elif tag == self._KEY_TAG:
+                key = self._parse_key(key_attributes=value, m3u_url=m3u_url, key=key)
+            elif tag == self._MAP_TAG:
+                init = self._parse_map(map_attributes=value, m3u_url=m3u_url)
+            elif tag == self._DISCONTINUITY_TAG:
+                discontinuity = True
+            elif tag == self._MEDIA_SEQUENCE_TAG:
+                media_sequence = sequence = int(value)
+            elif tag == self._TARGET_DURATION_TAG:
+                target_duration = int(value)
+            elif tag == self._ENDLIST_TAG:
+                endlist = True
+            elif tag == self._STREAM_INF_TAG:
+                stream_inf = self._parse_stream_inf(stream_inf_attributes=value)
+            elif tag == self._MEDIA_TAG:
+                renditions.append(self._parse_media(media_attributes=value))
 
-        self._logger.debug("M3U8 Links = {links}\nM3U8 Enc_dict={enc_dict}"
-                           .format(links=links, enc_dict=enc_dict))
+        self._logger.debug("M3U8 Segments = {} (sequence {} onwards)\nM3U8 Variants={}"
+                           .format(len(segments), media_sequence, variants))
 
-        return {'links': links, 'enc': enc_dict}
+        return {'segments': segments, 'variants': variants, 'media_sequence': media_sequence,
+                'target_duration': target_duration, 'endlist': endlist, 'renditions': renditions}
 
-    def _parse_key_line(self, key_line: str) -> Dict[str, str]:
+    @staticmethod
+    def _resolve(uri: str, m3u_url: str = None) -> str:
         """
-        Parsing the line containing key information and return the information in a dictionary
-        :param key_line: the line containing key info
-        :return: the dictionary of key and other info might be useful for decryption
+        Resolving a URI in M3U8
+        :param uri: the URI, absolute or relative to M3U8
+        :param m3u_url: the URL to M3U8, the URI is left as it is if None
+        :return: the resolved URL
         """
-        enc_pattern = self._ENC_PATTERN_2 if 'IV' in key_line else self._ENC_PATTERN_1
+        return urljoin(m3u_url, uri) if m3u_url else uri
 
-        enc_dict = re.match(enc_pattern, key_line).groupdict()
-        self._logger.debug('enc_dict parsed: {}'.format(enc_dict))
-        return enc_dict
+    def _split_uri(self, uri: str, m3u_url: str, prefixes: Dict[str, str]) -> Tuple[str, str]:
+        """
+        Resolving a segment URI and splitting it at the last '/' of its path,
+        the prefix is resolved only once and shared among the segments in the same directory
+        :param uri: the segment URI
+        :param m3u_url: the URL to M3U8
+        :param prefixes: the resolved prefixes seen so far, keyed by the unresolved ones
+        :return: the resolved prefix and the rest of the URL
+        """
+        path, question_mark, query = uri.partition('?')
+        directory, slash, name = path.rpartition('/')
+        prefix = prefixes.get(directory + slash)
+        if prefix is None:
+            prefix = prefixes[directory + slash] = self._resolve(
+                uri=directory + slash or '.', m3u_url=m3u_url) if m3u_url else directory + slash
+        return prefix, name + question_mark + query
+
+    @staticmethod
+    def _parse_byterange(byterange: str, range_end: int) -> Tuple[int, int]:
+        """
+        Parsing a byte range, e.g. 1024@2048
+        :param byterange: the byte range in the format of <length>[@<offset>]
+        :param range_end: the end of the previous byte range, where the range starts if no offset
+        :return: the (length, offset) of the byte range
+        """
+        length, at, offset = byterange.strip('"').partition('@')
+        return int(length), int(offset) if at else range_end
+
+    def _parse_key(self, key_attributes: str, m3u_url: str, key: Optional[Key]) -> Optional[Key]:
+        """
+        Parsing the key info given by #EXT-X-KEY
+        :param key_attributes: the attribute list of the key
+        :param m3u_url: the URL to M3U8
+        :param key: the key in effect so far, kept if the new one is not of identity format
+        :return: the key in effect from now on, None if not encrypted
+        """
+        attributes = self._parse_attributes(attribute_list=key_attributes)
+        if attributes.get('KEYFORMAT', 'identity') != 'identity':
+            return key
+        if attributes.get('METHOD') == 'NONE':
+            return None
+        iv = attributes.get('IV')
+        return Key(method=attributes.get('METHOD'),
+                   uri=self._resolve(uri=attributes.get('URI'), m3u_url=m3u_url)
+                   if attributes.get('URI') else None,
+                   iv=int(iv, 16).to_bytes(16, 'big') if iv else None,
+                   key_format=attributes.get('KEYFORMAT'))
+
+    def _parse_map(self, map_attributes: str, m3u_url: str) -> InitSection:
+        """
+        Parsing the media initialization section given by #EXT-X-MAP
+        :param map_attributes: the attribute list of the section
+        :param m3u_url: the URL to M3U8
+        :return: the media initialization section
+        """
+        attributes = self._parse_attributes(attribute_list=map_attributes)
+        byterange = attributes.get('BYTERANGE')
+        return InitSection(uri=self._resolve(uri=attributes.get('URI'), m3u_url=m3u_url),
+                           byterange=self._parse_byterange(byterange=byterange, range_end=0)
+                           if byterange else None)
+
+    def _parse_stream_inf(self, stream_inf_attributes: str) -> Dict[str, Any]:
+        """
+        Parsing the description of a variant stream in a master playlist
+        :param stream_inf_attributes: the attribute list following #EXT-X-STREAM-INF
+        :return: the bandwidth in bit/s, the resolution in (width, height), the codecs,
+        and the groups of the audio and subtitle renditions of the variant, all but the bandwidth
+        may be None
+        """
+        attributes = self._parse_attributes(attribute_list=stream_inf_attributes)
+        resolution = attributes.get('RESOLUTION')
+        return {'bandwidth': int(attributes.get('BANDWIDTH', 0)),
+                'resolution': tuple(int(n) for n in resolution.lower().split('x'))
+                if resolution else None,
+                'codecs': attributes.get('CODECS'), 'audio': attributes.get('AUDIO'),
+                'subtitles': attributes.get('SUBTITLES')}
+
+    def _parse_media(self, media_attributes: str) -> Dict[str, Any]:
+        """
+        Parsing the description of an alternate rendition in a master playlist
+        :param media_attributes: the attribute list following #EXT-X-MEDIA
+        :return: the type (e.g. AUDIO), group, name, language and URI of the rendition,
+        the URI left unresolved and None if the rendition is carried in the variant stream,
+        and whether it is the default one of its group
+        """
+        attributes = self._parse_attributes(attribute_list=media_attributes)
+        return {'type': attributes.get('TYPE'), 'group_id': attributes.get('GROUP-ID'),
+                'name': attributes.get('NAME'), 'language': attributes.get('LANGUAGE'),
+                'uri': attributes.get('URI'), 'default': attributes.get('DEFAULT') == 'YES'}
 
-    def _parse_links(self, link_line: str, links: List[str]) -> None:
+    def _parse_attributes(self, attribute_list: str) -> Dict[str, str]:
         """
-        Parsing the lines containing the links to all files in M3U8 and store it to a list
-        :param link_line: the line containing links to download
-        :param links: all links parsed
+        Parsing an attribute list, e.g. BANDWIDTH=1280000,CODECS="avc1.4d401f,mp4a.40.2"
+        :param attribute_list: the attribute list following a tag
+        :return: the value of each attribute, quotes stripped
         """
-        if link_line[0] == '#':
-            return
-        self._logger.debug('Link parsed: {}'.format(link_line))
-        links.append(link_line)
+        return {name: value.strip().strip('"')
+                for name, value in self._ATTRIBUTE_PATTERN.findall(attribute_list)}
 
 
 # Demo
@@ -128,4 +580,5 @@ if __name__ == '__main__':
     logger.addHandler(logging.StreamHandler(sys.stdout))
 
     minion = Parser(par_logger=logger)
-    print(minion.parse_m3u(contents_bytes=b'Test\n'))
+    print(minion.parse_m3u(contents_bytes=b'#EXTINF:10.0,\nTest.ts\n',
+                           m3u_url='http://sample.m3u8'))
@@ -0,0 +1,117 @@
+"""
+Planner is responsible of learning the size of the fragments before they are downloaded:
+1. the sizes are asked for concurrently with HEAD requests (or Range requests of one byte),
+those of byte ranges being known already,
+2. the free space of the output directory is checked against what the job keeps on disk at most,
+so that a job does not fill the disk halfway through, and
+3. the fragments are ordered largest first, so that no large fragment is left to the end
+to become the critical path of the download
+"""
+
+import logging
+import os
+import shutil
+import sys
+import threadpool
+from typing import List, Optional, Tuple
+
+from .abortable import Abortable
+from .fetcher import Fetcher
+
+
+class Planner(Abortable):
+    _MARGIN = 1.05
+
+    def __init__(self, pla_logger: logging.Logger, fetcher: Fetcher, pool_size: int = 16) -> None:
+        """
+        Welcoming the logger assigned and the minion asking for the sizes
+        :param pla_logger: the logger assigned
+        :param fetcher: the minion asking the servers for the sizes
+        :param pool_size: the max number of sizes asked for at a time
+        """
+        self._logger = pla_logger
+        self._fetcher = fetcher
+        self._pool_size = pool_size
+
+    def sizes(self, links: List[str],
+              byteranges: List[Optional[Tuple[int, int]]] = None) -> List[Optional[int]]:
+        """
+        Learning the size of each fragment, asking for each link once
+        :param links: the links to the fragments
+        :param byteranges: the (length, offset) of each fragment, None if all of the link
+        :return: the size of each fragment in bytes, None if the server does not tell
+        """
+        byteranges = byteranges or [None] * len(links)
+        urls = list({link: None for link, byterange in zip(links, byteranges)
+                     if not byterange})
+        known = {}
+
+        def size(url: str) -> None:
+            try:
+                known[url] = self._fetcher.size(url=url)
+            except Exception as err:
+                self._logger.debug('Cannot size {}: {}'.format(url, err))
+
+        if urls:
+            pool = threadpool.ThreadPool(min(self._pool_size, len(urls)))
+            [pool.putRequest(req) for req in threadpool.makeRequests(size, urls)]
+            pool.wait()
+            pool.dismissWorkers(len(pool.workers))
+
+        sizes = [byterange[0] if byterange else known.get(link)
+                 for link, byterange in zip(links, byteranges)]
+        unknown = sizes.count(None)
+        if unknown:
+            self._logger.warning('Sizes of {} of {} fragments unknown, estimated from the others'
+                                 .format(unknown, len(sizes)))
+        self._logger.debug('Fragments sized: {} bytes in total'.format(self.total(sizes=sizes)))
+        return sizes
+
+    @staticmethod
+    def total(sizes: List[Optional[int]]) -> int:
+        """
+        :param sizes: the size of each fragment, None if unknown
+        :return: the total size, the unknown sizes taken as the mean of the known ones
+        """
+        known = [size for size in sizes if size is not None]
+        return int(sum(known) * len(sizes) / len(known)) if known else 0
+
+    def check_space(self, path: str, required: int) -> None:
+        """
+        Checking that the file system of the path has room for what the job keeps on disk,
+        with a margin for the containers and the journal
+        :param path: the output directory, which may not exist yet
+        :param required: the max number of bytes the job keeps on disk at a time
+        """
+        existing = os.path.abspath(path or '.')
+        while not os.path.exists(existing):
+            existing = os.path.dirname(existing)
+        free = shutil.disk_usage(existing).free
+        required = int(required * self._MARGIN)
+        self._logger.debug('Disk space: {} bytes required, {} bytes free'.format(required, free))
+        if required > free:
+            self._abort(reason='The job needs about {:.0f} MB in {}, {:.0f} MB is free'.format(
+                required / 1e6, path, free / 1e6), code=2)
+
+    @staticmethod
+    def order(sizes: List[Optional[int]]) -> List[int]:
+        """
+        :param sizes: the size of each fragment, None if unknown
+        :return: the positions of the fragments, the largest first,
+        the unknown ones taken as the mean of the known ones
+        """
+        mean = Planner.total(sizes=sizes) / max(len(sizes), 1)
+        return sorted(range(len(sizes)),
+                      key=lambda index: -(sizes[index] if sizes[index] is not None else mean))
+
+
+# Demo
+if __name__ == '__main__':
+    logger = logging.getLogger(__name__)
+    logger.setLevel(logging.DEBUG)
+    logger.addHandler(logging.StreamHandler(sys.stdout))
+
+    minion = Planner(logger, fetcher=Fetcher(logger))
+    fragment_sizes = minion.sizes(links=['http://sample.com/0.ts', 'http://sample.com/1.ts'])
+    minion.check_space(path='out', required=Planner.total(sizes=fragment_sizes) * 3)
+    print(minion.order(sizes=fragment_sizes))
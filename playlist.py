@@ -0,0 +1,82 @@
+"""
+The records parsed from a media playlist: one compact Segment per fragment,
+sharing the Key and InitSection in effect and the (interned) URL prefix with its neighbours
+"""
+
+from typing import Optional, Tuple
+
+
+class Key:
+    __slots__ = ('method', 'uri', 'iv', 'key_format')
+
+    def __init__(self, method: str, uri: str = None, iv: bytes = None,
+                 key_format: str = None) -> None:
+        """
+        The key info given by #EXT-X-KEY
+        :param method: the encryption method, e.g. AES-128
+        :param uri: the resolved URL to the key
+        :param iv: the initial vector, None if derived from the media sequence number
+        :param key_format: the format of the key, None for identity
+        """
+        self.method = method
+        self.uri = uri
+        self.iv = iv
+        self.key_format = key_format
+
+    def __repr__(self) -> str:
+        return 'Key({}, {}, iv={})'.format(self.method, self.uri,
+                                           self.iv.hex() if self.iv else None)
+
+
+class InitSection:
+    __slots__ = ('uri', 'byterange')
+
+    def __init__(self, uri: str, byterange: Tuple[int, int] = None) -> None:
+        """
+        The media initialization section given by #EXT-X-MAP
+        :param uri: the resolved URL to the section
+        :param byterange: the (length, offset) of the section in the resource, None if all of it
+        """
+        self.uri = uri
+        self.byterange = byterange
+
+    def __repr__(self) -> str:
+        return 'InitSection({}, {})'.format(self.uri, self.byterange)
+
+
+class Segment:
+    __slots__ = ('prefix', 'name', 'duration', 'sequence', 'byterange', 'discontinuity',
+                 'key', 'init')
+
+    def __init__(self, prefix: str, name: str, duration: float, sequence: int,
+                 byterange: Optional[Tuple[int, int]] = None, discontinuity: bool = False,
+                 key: Optional[Key] = None, init: Optional[InitSection] = None) -> None:
+        """
+        A media segment, i.e. a fragment, of the playlist
+        :param prefix: the resolved URL up to the last '/' of the path, shared among segments
+        :param name: the rest of the URL
+        :param duration: the duration given by #EXTINF in seconds
+        :param sequence: the media sequence number
+        :param byterange: the (length, offset) given by #EXT-X-BYTERANGE, None if all of it
+        :param discontinuity: whether #EXT-X-DISCONTINUITY precedes the segment
+        :param key: the key in effect, None if not encrypted
+        :param init: the media initialization section in effect, None if none
+        """
+        self.prefix = prefix
+        self.name = name
+        self.duration = duration
+        self.sequence = sequence
+        self.byterange = byterange
+        self.discontinuity = discontinuity
+        self.key = key
+        self.init = init
+
+    @property
+    def uri(self) -> str:
+        """
+        :return: the resolved URL to the segment
+        """
+        return self.prefix + self.name
+
+    def __repr__(self) -> str:
+        return 'Segment({}, {}, #{})'.format(self.uri, self.duration, self.sequence)
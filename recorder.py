@@ -0,0 +1,149 @@
+"""
+Recorder is responsible of following a live (or event) playlist until it ends:
+the playlist is reloaded on the schedule given by its target duration, conditionally so
+that an unchanged playlist is not downloaded again, and only the segments whose media sequence
+number is newer than the last one seen are handed over, in batches, to whoever records them.
+The playlist is reloaded in a thread of its own, so recording a batch never delays the next reload
+"""
+
+import logging
+import queue
+import sys
+import threading
+import time
+from typing import Any, Dict, Iterator, List
+
+from .fetcher import Fetcher
+from .parser import Parser
+from .playlist import Segment
+
+
+class Recorder:
+    _DEFAULT_TARGET_DURATION = 6
+
+    def __init__(self, rec_logger: logging.Logger, fetcher: Fetcher, parser: Parser) -> None:
+        """
+        Welcoming the logger assigned and the minions fetching and parsing the playlist
+        :param rec_logger: the logger assigned
+        :param fetcher: the minion reloading the playlist
+        :param parser: the minion parsing the playlist
+        """
+        self._logger = rec_logger
+        self._fetcher = fetcher
+        self._parser = parser
+
+    def record(self, m3u_url: str, m3u_dict: Dict[str, Any], base_url: str = None,
+               max_duration: float = None) -> Iterator[List[Segment]]:
+        """
+        Following the playlist and yielding the new segments of each reload,
+        until #EXT-X-ENDLIST or the duration limit is reached
+        :param m3u_url: the URL to the media playlist
+        :param m3u_dict: the content of the playlist loaded for the first time
+        :param base_url: the URL the URIs in the playlist are relative to, m3u_url if None
+        :param max_duration: the max number of seconds to record, unlimited if None
+        :return: the batches of new segments, in order
+        """
+        batches = queue.Queue()  # type: queue.Queue
+        stop = threading.Event()
+        poller = threading.Thread(target=self._poll, daemon=True, kwargs=dict(
+            m3u_url=m3u_url, m3u_dict=m3u_dict, base_url=base_url, max_duration=max_duration,
+            batches=batches, stop=stop))
+        poller.start()
+        try:
+            for batch in iter(batches.get, None):
+                yield batch
+        finally:
+            stop.set()
+            poller.join()
+
+    def _poll(self, m3u_url: str, m3u_dict: Dict[str, Any], base_url: str,
+              max_duration: float, batches: queue.Queue, stop: threading.Event) -> None:
+        """
+        Reloading the playlist and queueing its new segments until it ends or is stopped.
+        As RFC 8216 asks, the next reload is a target duration after the start of a reload
+        that found new segments, and half of it after one that found none
+        :param m3u_url: the URL to the media playlist
+        :param m3u_dict: the content of the playlist loaded for the first time
+        :param base_url: the URL the URIs in the playlist are relative to
+        :param max_duration: the max number of seconds to record, unlimited if None
+        :param batches: where the batches of new segments are queued, ending with None
+        :param stop: set once nothing more should be queued
+        """
+        last_sequence, recorded = None, 0.0
+        started = time.monotonic()
+        try:
+            while True:
+                segments = m3u_dict.get('segments')
+                new = [segment for segment in segments
+                       if last_sequence is None or segment.sequence > last_sequence]
+                if new and last_sequence is not None and new[0].sequence > last_sequence + 1:
+                    self._logger.warning('Segments {} to {} left the live window before they '
+                                         'were seen'.format(last_sequence + 1, new[0].sequence - 1))
+                if max_duration is not None:
+                    new = self._clip(segments=new, duration=max_duration - recorded)
+                if new:
+                    batches.put(new)
+                    last_sequence = new[-1].sequence
+                    recorded += sum(segment.duration for segment in new)
+                    self._logger.debug('Segments queued: {} up to #{}, {:.1f}s recorded'.format(
+                        len(new), last_sequence, recorded))
+
+                if m3u_dict.get('endlist') \
+                        or (max_duration is not None and recorded >= max_duration):
+                    return
+                target_duration = m3u_dict.get('target_duration') or self._DEFAULT_TARGET_DURATION
+                interval = target_duration if new else target_duration / 2
+                if stop.wait(max(interval - (time.monotonic() - started), 0)):
+                    return
+
+                started = time.monotonic()
+                m3u_dict = self._reload(m3u_url=m3u_url, base_url=base_url) or \
+                    dict(m3u_dict, segments=[])
+        finally:
+            batches.put(None)
+
+    def _reload(self, m3u_url: str, base_url: str = None) -> Dict[str, Any]:
+        """
+        Reloading the playlist if it has changed
+        :param m3u_url: the URL to the media playlist
+        :param base_url: the URL the URIs in the playlist are relative to
+        :return: the content of the playlist in a dictionary, None if unchanged or unavailable
+        """
+        try:
+            m3u_bytes = self._fetcher.fetch_m3u(m3u_url=m3u_url, conditional=True)
+        except Exception as err:
+            self._logger.warning('Failed to reload M3U8, retrying later: {}'.format(err))
+            return None
+        if m3u_bytes is None:
+            return None
+        return self._parser.parse_m3u(contents_bytes=m3u_bytes, m3u_url=base_url or m3u_url)
+
+    @staticmethod
+    def _clip(segments: List[Segment], duration: float) -> List[Segment]:
+        """
+        Keeping the segments that start within the duration left
+        :param segments: the new segments
+        :param duration: the number of seconds left to record
+        :return: the segments kept
+        """
+        clipped = []
+        for segment in segments:
+            if duration <= 0:
+                break
+            clipped.append(segment)
+            duration -= segment.duration
+        return clipped
+
+
+# Demo
+if __name__ == '__main__':
+    logger = logging.getLogger(__name__)
+    logger.setLevel(logging.DEBUG)
+    logger.addHandler(logging.StreamHandler(sys.stdout))
+
+    fet_minion, par_minion = Fetcher(logger), Parser(logger)
+    live = 'http://sample.m3u8'
+    minion = Recorder(logger, fetcher=fet_minion, parser=par_minion)
+    for new_segments in minion.record(m3u_url=live, max_duration=60, m3u_dict=par_minion.parse_m3u(
+            contents_bytes=fet_minion.fetch_m3u(m3u_url=live), m3u_url=live)):
+        print(new_segments)
@@ -0,0 +1,266 @@
+"""
+Runner is responsible of running jobs from asyncio code, e.g. a service driving many jobs at once
+in one process, rather than forking the command line per job and scraping its output:
+1. a job is described by a JobConfig rather than command line arguments,
+2. a job is awaitable, reports its progress to a callback on the event loop and can be cancelled,
+3. a job that aborts raises JobError (JobCancelled once cancelled) instead of exiting the process.
+Each job runs its MasterEngine on a worker thread, so the blocking stages (requests, the tools run
+as subprocesses) never block the event loop, and the jobs share one scheduler, fetcher, key cache
+and session, as the daemon's do, so the threads and connections stay bounded however many run
+"""
+
+import asyncio
+import logging
+import sys
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, List, Tuple
+
+from .downloader import Downloader
+from .fetcher import Fetcher
+from .key_manager import KeyManager
+from .master_engine import MasterEngine
+from .parser import Parser
+from .scheduler import Scheduler
+
+
+class JobError(Exception):
+
+    def __init__(self, message: str, code: int = 1) -> None:
+        """
+        A job aborted
+        :param message: why the job aborted, as logged
+        :param code: the exit code the command line would have exited with
+        """
+        super().__init__(message)
+        self.code = code
+
+
+class JobCancelled(JobError):
+    pass
+
+
+class JobConfig:
+    __slots__ = ('m3u_url', 'output_name', 'm3u_prefix', 'dow_tool', 'dec_tool', 'cat_tool',
+                 'cov_tool', 'pipeline', 'resume', 'start', 'end', 'extra_args')
+
+    def __init__(self, m3u_url: str, output_name: str = './out/out.mp4', m3u_prefix: str = None,
+                 dow_tool: str = None, dec_tool: str = None, cat_tool: str = None,
+                 cov_tool: str = None, pipeline: bool = False, resume: bool = False,
+                 start: float = None, end: float = None, extra_args: List[str] = None) -> None:
+        """
+        The description of a job, as given by the command line arguments of the same names
+        :param m3u_url: the url to the .m3u file
+        :param output_name: the name of the output file, e.g. ./out/out.mp4
+        :param m3u_prefix: the prefix of each url in the .m3u file, the URL of the .m3u if None
+        :param dow_tool: the download tool, e.g. builtin, aria2c if None
+        :param dec_tool: the decryption tool, e.g. builtin, openssl if None
+        :param cat_tool: the concatenation tool, e.g. builtin, cat if None
+        :param cov_tool: the conversion tool, ffmpeg if None
+        :param pipeline: whether to download, decrypt and convert at the same time
+        :param resume: whether to resume an interrupted job
+        :param start: the seconds where the clip to download starts, the start if None
+        :param end: the seconds where the clip to download ends, the end if None
+        :param extra_args: the other command line arguments, e.g. ['--plan', '--validate']
+        """
+        self.m3u_url, self.output_name, self.m3u_prefix = m3u_url, output_name, m3u_prefix
+        self.dow_tool, self.dec_tool = dow_tool, dec_tool
+        self.cat_tool, self.cov_tool = cat_tool, cov_tool
+        self.pipeline, self.resume = pipeline, resume
+        self.start, self.end = start, end
+        self.extra_args = extra_args or []
+
+    def to_argv(self) -> List[str]:
+        """
+        :return: the command line arguments of the job
+        """
+        argv = [self.m3u_url, '-O', self.output_name]
+        for option, value in (('-P', self.m3u_prefix), ('-W', self.dow_tool),
+                              ('-D', self.dec_tool), ('-T', self.cat_tool),
+                              ('-C', self.cov_tool), ('--start', self.start),
+                              ('--end', self.end)):
+            if value is not None:
+                argv += [option, str(value)]
+        argv += ['--pipeline'] if self.pipeline else []
+        argv += ['--resume'] if self.resume else []
+        return argv + self.extra_args
+
+
+class Job:
+    _PROGRESS_INTERVAL = 0.5
+
+    def __init__(self, config: JobConfig, engine: MasterEngine, executor: ThreadPoolExecutor,
+                 on_progress: Callable[[int, int], None] = None) -> None:
+        """
+        A job running on a worker thread, awaited on the event loop
+        :param config: the description of the job
+        :param engine: the engine running the job
+        :param executor: the worker threads
+        :param on_progress: if given, called on the event loop with the number of fragments
+        finished and to download whenever they change
+        """
+        self.config = config
+        self._engine = engine
+        self._on_progress = on_progress
+        self._cancelled = threading.Event()
+        self._task = asyncio.get_running_loop().create_task(self._run(executor=executor))
+
+    def __await__(self):
+        """
+        Awaiting the job, cancelling the awaiting (e.g. asyncio.wait_for timing out)
+        cancels the job
+        :return: the name of the output file
+        """
+        return self._task.__await__()
+
+    def done(self) -> bool:
+        """
+        :return: whether the job has ended, succeeded or not
+        """
+        return self._task.done()
+
+    def progress(self) -> Tuple[int, int]:
+        """
+        :return: the number of fragments finished and to download in the current download
+        """
+        return self._engine.progress()
+
+    def cancel(self) -> None:
+        """
+        Cancelling the job: the fragments not started yet are given up, the job aborts
+        before its next stage and awaiting it raises JobCancelled
+        """
+        self._cancelled.set()
+        self._engine.cancel()
+
+    async def _run(self, executor: ThreadPoolExecutor) -> str:
+        """
+        Running the job on a worker thread, reporting its progress meanwhile
+        :param executor: the worker threads
+        :return: the name of the output file
+        """
+        loop = asyncio.get_running_loop()
+        assisting = loop.run_in_executor(executor, self._assist)
+        watching = loop.create_task(self._watch())
+        try:
+            return await asyncio.shield(assisting)
+        except asyncio.CancelledError:
+            # the worker cannot be interrupted, it is told to stop and waited for
+            self.cancel()
+            await asyncio.gather(assisting, return_exceptions=True)
+            raise
+        finally:
+            watching.cancel()
+            if self._on_progress:
+                self._on_progress(*self.progress())
+
+    async def _watch(self) -> None:
+        """
+        Reporting the progress of the job whenever it changes
+        """
+        last = None
+        while self._on_progress:
+            await asyncio.sleep(self._PROGRESS_INTERVAL)
+            progress = self.progress()
+            if progress != last:
+                last = progress
+                self._on_progress(*progress)
+
+    def _assist(self) -> str:
+        """
+        Running the job on the current thread, turning its exit, or whatever it fails with,
+        into JobError
+        :return: the name of the output file
+        """
+        try:
+            self._engine.assist(argv=self.config.to_argv())
+        except SystemExit as err:
+            code = err.code if isinstance(err.code, int) else 1
+            if self._cancelled.is_set():
+                raise JobCancelled(message='Job cancelled', code=code) from None
+            raise JobError(message=self._engine.abort_reason()
+                           or 'Job exited with {}'.format(err.code), code=code) from None
+        except Exception as err:
+            if self._cancelled.is_set():
+                raise JobCancelled(message='Job cancelled') from err
+            raise JobError(message=str(err)) from err
+        finally:
+            self._engine.close()
+        return self.config.output_name
+
+
+class AsyncRunner:
+
+    def __init__(self, run_logger: logging.Logger, max_conns: int = 32, host_conns: int = 8,
+                 jobs: int = 64) -> None:
+        """
+        Welcoming the logger assigned and prepare the minions shared by the jobs
+        :param run_logger: the logger assigned
+        :param max_conns: the max number of fragments downloaded at a time by all jobs
+        :param host_conns: the max number of fragments downloaded at a time from each host
+        :param jobs: the max number of jobs run at a time, the others wait for a worker
+        """
+        self._logger = run_logger
+        self._scheduler = Scheduler(sch_logger=run_logger, max_conns=max_conns,
+                                    host_conns=host_conns)
+        self._fetcher = Fetcher(fet_logger=run_logger)
+        self._key_manager = KeyManager(key_logger=run_logger, fetcher=self._fetcher,
+                                       capacity=256)
+        self._session = Downloader.prepare_session(host_conns=host_conns)
+        self._executor = ThreadPoolExecutor(max_workers=jobs, thread_name_prefix='job')
+
+    def submit(self, config: JobConfig,
+               on_progress: Callable[[int, int], None] = None) -> Job:
+        """
+        Submitting a job, which starts as soon as a worker is free; to be called on the event loop
+        :param config: the description of the job
+        :param on_progress: if given, called on the event loop with the number of fragments
+        finished and to download whenever they change
+        :return: the job, to await
+        """
+        try:
+            # checked only, the verbosity of a job is not applied to the logger of the runner
+            Parser(par_logger=self._logger).check_args(argv=config.to_argv())
+        except SystemExit as err:
+            raise JobError(message='Invalid job: {}'.format(config.to_argv()),
+                           code=err.code if isinstance(err.code, int) else 2) from None
+        engine = MasterEngine(scheduler=self._scheduler, fetcher=self._fetcher,
+                              key_manager=self._key_manager, session=self._session)
+        return Job(config=config, engine=engine, executor=self._executor,
+                   on_progress=on_progress)
+
+    async def run(self, config: JobConfig,
+                  on_progress: Callable[[int, int], None] = None) -> str:
+        """
+        Running a job to its end
+        :param config: the description of the job
+        :param on_progress: if given, called with the number of fragments finished and to download
+        :return: the name of the output file
+        """
+        return await self.submit(config=config, on_progress=on_progress)
+
+    def close(self) -> None:
+        """
+        Releasing the workers once the jobs submitted have ended
+        """
+        self._executor.shutdown(wait=True)
+        self._session.close()
+
+
+# Demo
+if __name__ == '__main__':
+    logger = logging.getLogger(__name__)
+    logger.addHandler(logging.StreamHandler(sys.stdout))
+
+    async def main() -> None:
+        runner = AsyncRunner(run_logger=logger)
+        jobs = [runner.submit(config=JobConfig(m3u_url='http://sample{}.m3u8'.format(i),
+                                               output_name='./out{}/out.mp4'.format(i),
+                                               dow_tool='builtin'),
+                              on_progress=lambda current, total: print(current, total))
+                for i in range(3)]
+        for result in await asyncio.gather(*jobs, return_exceptions=True):
+            print(result)
+        runner.close()
+
+    asyncio.run(main())
@@ -0,0 +1,136 @@
+"""
+Scheduler is responsible of running the downloads of many jobs on one shared set of connections:
+at most max_conns downloads are in flight in total and at most host_conns to each host,
+and the jobs take turns, so that a job with many segments does not starve the others.
+The bytes downloaded are counted to report the aggregate throughput
+"""
+
+import logging
+import sys
+import threading
+import time
+from collections import Counter, deque
+from typing import Callable, Deque, List, Optional, Tuple
+
+
+class _Job:
+    __slots__ = ('tasks', 'remaining', 'admit')
+
+    def __init__(self, tasks: List[Tuple[str, Callable[[], int]]],
+                 admit: Callable[[], bool] = None) -> None:
+        """
+        The downloads of one job waiting for their turn
+        :param tasks: the host and the download of each segment, in order
+        :param admit: if given, what tells whether the job may start one more download now
+        """
+        self.tasks = deque(tasks)
+        self.remaining = len(tasks)
+        self.admit = admit
+
+
+class Scheduler:
+
+    def __init__(self, sch_logger: logging.Logger, max_conns: int = 32,
+                 host_conns: int = 8) -> None:
+        """
+        Welcoming the logger assigned and start the workers shared by all jobs
+        :param sch_logger: the logger assigned
+        :param max_conns: the max number of downloads in flight in total
+        :param host_conns: the max number of downloads in flight to each host
+        """
+        self._logger = sch_logger
+        self._host_conns = host_conns
+        self._jobs: Deque[_Job] = deque()
+        self._active: Counter = Counter()
+        self._cond = threading.Condition()
+        self._bytes, self._started = 0, None
+        for _ in range(max_conns):
+            threading.Thread(target=self._work, daemon=True).start()
+
+    def run(self, tasks: List[Tuple[str, Callable[[], int]]],
+            admit: Callable[[], bool] = None) -> None:
+        """
+        Running the downloads of a job along with those of the other jobs,
+        blocking until all of them are done
+        :param tasks: the host and the download of each segment, in order,
+        each download returns the number of bytes downloaded
+        :param admit: if given, asked before each download of the job is started, without
+        blocking, e.g. to throttle the job; the job is passed over in its turn while it says no,
+        so that no worker shared with the other jobs is held waiting for it
+        """
+        if not tasks:
+            return
+        job = _Job(tasks=tasks, admit=admit)
+        with self._cond:
+            if self._started is None:
+                self._started = time.perf_counter()
+            self._jobs.append(job)
+            self._cond.notify_all()
+            while job.remaining:
+                self._cond.wait()
+
+    def _work(self) -> None:
+        """
+        The loop of each worker: taking the next download whose host has a free connection,
+        from the jobs in turn, and running it
+        """
+        while True:
+            with self._cond:
+                picked = self._pick()
+                while picked is None:
+                    self._cond.wait()
+                    picked = self._pick()
+                job, host, task = picked
+                self._active[host] += 1
+
+            size = 0
+            try:
+                size = task() or 0
+            except Exception as err:
+                self._logger.error('Download to {} failed: {}'.format(host, err))
+
+            with self._cond:
+                self._active[host] -= 1
+                self._bytes += size
+                job.remaining -= 1
+                self._cond.notify_all()
+
+    def _pick(self) -> Optional[Tuple[_Job, str, Callable[[], int]]]:
+        """
+        Picking the first download of the next job in turn whose host has a free connection
+        and which admits it, the job picked goes to the back of the line
+        :return: the job, the host and the download picked, None if nothing can run now
+        """
+        for _ in range(len(self._jobs)):
+            job = self._jobs[0]
+            self._jobs.rotate(-1)
+            host, task = job.tasks[0]
+            if self._active[host] < self._host_conns and (not job.admit or job.admit()):
+                job.tasks.popleft()
+                if not job.tasks:
+                    self._jobs.remove(job)
+                return job, host, task
+        return None
+
+    def report(self) -> Tuple[int, float]:
+        """
+        Reporting the aggregate throughput of all jobs so far
+        :return: the number of bytes downloaded and the seconds since the first job started
+        """
+        with self._cond:
+            size = self._bytes
+            seconds = time.perf_counter() - self._started if self._started else 0.0
+        self._logger.warning('Downloaded {} bytes in {:.1f}s ({:.1f} MB/s)'.format(
+            size, seconds, size / max(seconds, 1e-6) / 1e6))
+        return size, seconds
+
+
+# Demo
+if __name__ == '__main__':
+    logger = logging.getLogger(__name__)
+    logger.setLevel(logging.DEBUG)
+    logger.addHandler(logging.StreamHandler(sys.stdout))
+
+    minion = Scheduler(logger, max_conns=4, host_conns=2)
+    minion.run(tasks=[('sample.com', lambda: time.sleep(0.1) or 1024) for _ in range(8)])
+    minion.report()
@@ -0,0 +1,178 @@
+"""
+Selector is responsible of selecting one variant stream of a master playlist,
+by bandwidth, by resolution, or by the throughput measured from where we are,
+and the alternate audio and subtitle renditions going with it.
+The playlists of the candidate variants are fetched concurrently
+"""
+
+import logging
+import sys
+import threadpool
+from typing import Any, Dict, List, Optional, Tuple
+from urllib.parse import urljoin
+
+from .abortable import Abortable
+from .fetcher import Fetcher
+from .parser import Parser
+
+
+class Selector(Abortable):
+
+    def __init__(self, sel_logger: logging.Logger, fetcher: Fetcher, parser: Parser,
+                 pool_size: int = 8) -> None:
+        """
+        Welcoming the logger assigned and the minions fetching and parsing the variant playlists
+        :param sel_logger: the logger assigned
+        :param fetcher: the minion fetching the variant playlists and probing fragments
+        :param parser: the minion parsing the variant playlists
+        :param pool_size: the max number of variant playlists fetched at a time
+        """
+        self._logger = sel_logger
+        self._fetcher = fetcher
+        self._parser = parser
+        self._pool_size = pool_size
+
+    def select(self, master_url: str, variants: List[Dict[str, Any]], by: str = 'bandwidth',
+               codec: str = None, max_bandwidth: int = None,
+               base_url: str = None) -> Tuple[str, Dict[str, Any], Dict[str, Any]]:
+        """
+        Selecting a variant stream of the master playlist
+        :param master_url: the URL to the master playlist, which the variant URIs are relative to
+        :param variants: the variants parsed from the master playlist
+        :param by: bandwidth, resolution or probe
+        :param codec: if given, only the variants whose codecs contain it are candidates
+        :param max_bandwidth: if given, only the variants not exceeding it are candidates
+        :param base_url: the URL the URIs in the variant playlists are relative to,
+        the URL to each variant playlist if None
+        :return: the URL to the playlist of the variant selected, the variant
+        and the content of its playlist in a dictionary
+        """
+        candidates = [variant for variant in variants
+                      if (not codec or codec in (variant.get('codecs') or ''))
+                      and (not max_bandwidth or variant.get('bandwidth') <= max_bandwidth)]
+        urls = [urljoin(master_url, variant.get('uri')) for variant in candidates]
+        candidates = [(url, variant, m3u_dict) for url, variant, m3u_dict
+                      in zip(urls, candidates, self._fetch_playlists(urls=urls, base_url=base_url))
+                      if m3u_dict]
+        if not candidates:
+            self._abort(reason="No variant stream in M3U8 matches the selection", code=1)
+
+        if by == 'probe':
+            url, variant, m3u_dict = self._select_by_probe(candidates=candidates)
+        elif by == 'resolution':
+            url, variant, m3u_dict = max(candidates, key=lambda candidate: (
+                self._pixels(variant=candidate[1]), candidate[1].get('bandwidth')))
+        else:
+            url, variant, m3u_dict = max(candidates,
+                                         key=lambda candidate: candidate[1].get('bandwidth'))
+
+        self._logger.debug('Variant selected by {}: {} {}'.format(by, url, variant))
+        return url, variant, m3u_dict
+
+    def renditions(self, master_url: str, variant: Dict[str, Any],
+                   renditions: List[Dict[str, Any]], pick: str = 'default',
+                   languages: List[str] = None) -> List[Dict[str, Any]]:
+        """
+        Selecting the alternate audio and subtitle renditions of a variant to download with it,
+        those carried in the variant stream itself (without URI) aside
+        :param master_url: the URL to the master playlist, which the rendition URIs are relative to
+        :param variant: the variant selected
+        :param renditions: the renditions parsed from the master playlist
+        :param pick: default for the default rendition of each group (the first if none is),
+        all for all of them, none for none
+        :param languages: if given, only the renditions in these languages are candidates
+        :return: the renditions selected, their URIs resolved
+        """
+        selected = []
+        for rendition_type in ('AUDIO', 'SUBTITLES') if pick != 'none' else ():
+            group_id = variant.get(rendition_type.lower())
+            candidates = [rendition for rendition in renditions
+                          if rendition.get('type') == rendition_type and group_id
+                          and rendition.get('group_id') == group_id and rendition.get('uri')
+                          and (not languages or rendition.get('language') in languages)]
+            if candidates and pick == 'default':
+                candidates = [next((candidate for candidate in candidates
+                                    if candidate.get('default')), candidates[0])]
+            selected += [dict(rendition, uri=urljoin(master_url, rendition.get('uri')))
+                         for rendition in candidates]
+
+        self._logger.debug('Renditions selected: {}'.format(selected))
+        return selected
+
+    def _fetch_playlists(self, urls: List[str],
+                         base_url: str = None) -> List[Optional[Dict[str, Any]]]:
+        """
+        Fetching and parsing the variant playlists concurrently
+        :param urls: the URLs to the variant playlists
+        :param base_url: the URL the URIs in the variant playlists are relative to
+        :return: the content of each variant playlist in a dictionary, in the order of urls,
+        None if it cannot be fetched or lists no fragment
+        """
+        playlists = [None] * len(urls)  # type: List[Optional[Dict[str, Any]]]
+
+        def fetch_playlist(index: int, url: str) -> None:
+            try:
+                m3u_dict = self._parser.parse_m3u(
+                    contents_bytes=self._fetcher.fetch_m3u(m3u_url=url), m3u_url=base_url or url)
+            except Exception as err:
+                self._logger.warning('Skipping variant {}: {}'.format(url, err))
+                return
+            playlists[index] = m3u_dict if m3u_dict.get('segments') else None
+
+        pool = threadpool.ThreadPool(min(self._pool_size, len(urls)) or 1)
+        [pool.putRequest(req) for req in threadpool.makeRequests(
+            fetch_playlist, [((index, url), None) for index, url in enumerate(urls)])]
+        pool.wait()
+        pool.dismissWorkers(len(pool.workers))
+        return playlists
+
+    def _select_by_probe(self, candidates: List[Tuple[str, Dict[str, Any], Dict[str, Any]]]) \
+            -> Tuple[str, Dict[str, Any], Dict[str, Any]]:
+        """
+        Downloading the first fragment of each variant, one after another so that the probes
+        do not compete for bandwidth, and selecting the variant of the highest bandwidth that
+        is downloaded faster than it plays, or the one closest to that if none is
+        :param candidates: the URL, the variant and the parsed playlist of each candidate
+        :return: the candidate selected
+        """
+        ratios = []
+        for url, variant, m3u_dict in candidates:
+            try:
+                size, seconds = self._fetcher.probe(url=m3u_dict.get('segments')[0].uri)
+            except Exception as err:
+                self._logger.warning('Skipping variant {}: {}'.format(url, err))
+                continue
+            throughput = size * 8 / max(seconds, 1e-6)
+            ratios.append((throughput / max(variant.get('bandwidth'), 1),
+                           (url, variant, m3u_dict)))
+            self._logger.debug('Variant {}: {:.0f} bit/s measured, {} bit/s declared'.format(
+                url, throughput, variant.get('bandwidth')))
+
+        if not ratios:
+            self._abort(reason="No variant stream in M3U8 can be probed", code=1)
+        sustained = [candidate for ratio, candidate in ratios if ratio >= 1]
+        if sustained:
+            return max(sustained, key=lambda candidate: candidate[1].get('bandwidth'))
+        return max(ratios, key=lambda ratio: ratio[0])[1]
+
+    @staticmethod
+    def _pixels(variant: Dict[str, Any]) -> int:
+        """
+        :param variant: the variant parsed from the master playlist
+        :return: the number of pixels of the variant, 0 if the resolution is unknown
+        """
+        resolution = variant.get('resolution')
+        return resolution[0] * resolution[1] if resolution else 0
+
+
+# Demo
+if __name__ == '__main__':
+    logger = logging.getLogger(__name__)
+    logger.setLevel(logging.DEBUG)
+    logger.addHandler(logging.StreamHandler(sys.stdout))
+
+    fet_minion, par_minion = Fetcher(logger), Parser(logger)
+    master = 'http://sample.m3u8'
+    minion = Selector(logger, fetcher=fet_minion, parser=par_minion)
+    print(minion.select(master_url=master, by='probe', variants=par_minion.parse_m3u(
+        contents_bytes=fet_minion.fetch_m3u(m3u_url=master)).get('variants')))
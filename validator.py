@@ -0,0 +1,85 @@
+"""
+Validator is responsible of telling a corrupt MPEG-TS segment (e.g. truncated, or an HTML error
+page served with 200) as soon as it lands, rather than once the conversion tool chokes on it:
+1. its length is a multiple of the 188-byte packet,
+2. every packet starts with the sync byte 0x47, checked at once over a strided slice, and
+3. the continuity counter of every PID carrying payload goes up by one from packet to packet,
+unless a discontinuity is signalled, a few errors being tolerated as encoders do produce them
+"""
+
+import logging
+import sys
+from typing import Optional
+
+
+class Validator:
+    PACKET_SIZE = 188
+    _SYNC_BYTE = b'\x47'
+    _NULL_PID = 0x1FFF
+
+    def __init__(self, val_logger: logging.Logger, max_cc_errors: float = 0.01) -> None:
+        """
+        Welcoming the logger assigned
+        :param val_logger: the logger assigned
+        :param max_cc_errors: the max share of packets whose continuity counter may be off
+        """
+        self._logger = val_logger
+        self._max_cc_errors = max_cc_errors
+
+    def check(self, data: bytes) -> Optional[str]:
+        """
+        Checking a decrypted segment
+        :param data: the content of the segment
+        :return: what is wrong with the segment, None if nothing
+        """
+        if not data:
+            return 'empty'
+        if len(data) % self.PACKET_SIZE:
+            return '{} bytes is not a whole number of packets'.format(len(data))
+        view = memoryview(data)
+        sync = view[::self.PACKET_SIZE].tobytes()
+        if sync.count(self._SYNC_BYTE) != len(sync):
+            return 'packet {} lost sync'.format(len(sync) - len(sync.lstrip(self._SYNC_BYTE)))
+        errors = self._continuity_errors(view=view)
+        if errors > len(sync) * self._max_cc_errors:
+            return '{} of {} packets out of continuity'.format(errors, len(sync))
+        return None
+
+    def _continuity_errors(self, view: memoryview) -> int:
+        """
+        Counting the packets whose continuity counter does not follow the previous one
+        of their PID, a repeated counter (a duplicate packet) is allowed
+        :param view: the packets, all in sync
+        :return: the number of packets out of continuity
+        """
+        size = self.PACKET_SIZE
+        last = {}
+        errors = 0
+        for pid_high, pid_low, control, af_length, af_flags in zip(
+                view[1::size].tobytes(), view[2::size].tobytes(), view[3::size].tobytes(),
+                view[4::size].tobytes(), view[5::size].tobytes()):
+            pid = (pid_high & 0x1F) << 8 | pid_low
+            if pid == self._NULL_PID or not control & 0x10:
+                continue
+            counter = control & 0x0F
+            previous = last.get(pid)
+            discontinuity = control & 0x20 and af_length and af_flags & 0x80
+            if previous is not None and not discontinuity \
+                    and counter not in (previous, (previous + 1) & 0x0F):
+                errors += 1
+            last[pid] = counter
+        return errors
+
+
+# Demo
+if __name__ == '__main__':
+    logger = logging.getLogger(__name__)
+    logger.setLevel(logging.DEBUG)
+    logger.addHandler(logging.StreamHandler(sys.stdout))
+
+    minion = Validator(logger)
+    packets = b''.join(bytes([0x47, 0x01, 0x00, 0x10 | counter % 16]) + bytes(184)
+                       for counter in range(100))
+    print(minion.check(data=packets))
+    print(minion.check(data=packets[:-1]))
+    print(minion.check(data=b'<html>Not Found</html>'))